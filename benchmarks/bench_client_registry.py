@@ -0,0 +1,137 @@
+# bench_client_registry.py - Client registry under concurrent connect/disconnect churn
+#
+# Starts --clients threads that each connect (add), stay connected for up to
+# --hold milliseconds, look themselves up and disconnect (remove), --cycles
+# times, all at once, while broadcaster threads
+# keep iterating the registry and "sending" to every entry, as
+# broadcast_message and the file server's notifications do (including the
+# file server's log line per recipient, written to os.devnull). Runs the same
+# load against ClientRegistry and against a plain dict (the old
+# ChatServer.clients) and reports cycles per second, broadcasts completed and
+# broadcasts that failed with "dictionary changed size during iteration".
+#
+#   python benchmarks/bench_client_registry.py [--clients 1000] [--cycles 20] [--hold 2] [--broadcasters 2]
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from client_registry import ClientRegistry
+from connection import BufferedConnection
+from framing import encode_frame
+
+
+class DictRegistry:
+    """The old registry: a bare dict, mutated and iterated from any thread"""
+
+    def __init__(self):
+        self.clients = {}
+
+    def add(self, name, connection, client_address):
+        if name in self.clients:
+            return False
+        self.clients[name] = (connection, client_address)
+        return True
+
+    def remove(self, name, connection=None):
+        return self.clients.pop(name, None) is not None
+
+    def get(self, name, default=None):
+        return self.clients.get(name, default)
+
+    def items(self):
+        return self.clients.items()  # a live view, as broadcast_message iterated it
+
+
+class QueueOnlyConnection(BufferedConnection):
+    """Outbound queue whose "writer" takes each frame straight back off"""
+
+    def _wake_writer(self):
+        with self.queue_lock:
+            if self.queue:
+                batch, size = self._take_batch()
+                self.queued_bytes -= size
+
+    def abort(self):
+        pass
+
+
+def run(registry, client_count, cycles, hold, broadcaster_count, resident):
+    # Long-lived clients, so broadcasts always have recipients
+    for i in range(resident):
+        registry.add(f"resident{i}", QueueOnlyConnection(), ('127.0.0.1', i))
+
+    start = threading.Barrier(client_count + broadcaster_count + 1)
+    done = threading.Event()
+    lost = []
+    results = {'broadcasts': 0, 'errors': 0}
+    results_lock = threading.Lock()
+
+    def client(index):
+        name = f"user{index}"
+        connection = QueueOnlyConnection()
+        rng = random.Random(index)
+        start.wait()
+        for _ in range(cycles):
+            if not registry.add(name, connection, ('127.0.0.1', index)):
+                lost.append(name)
+            time.sleep(rng.uniform(0, hold))
+            if registry.get(name) is None:
+                lost.append(name)
+            registry.remove(name, connection)
+
+    def broadcaster():
+        frame = encode_frame("SERVER: someone has joined the chat!")
+        log = os.open(os.devnull, os.O_WRONLY)
+        start.wait()
+        broadcasts = errors = 0
+        while not done.is_set():
+            try:
+                for name, (connection, _) in registry.items():
+                    connection.send_frame(frame)
+                    os.write(log, f"Notified client: {name}\n".encode())
+                broadcasts += 1
+            except RuntimeError:
+                errors += 1
+        os.close(log)
+        with results_lock:
+            results['broadcasts'] += broadcasts
+            results['errors'] += errors
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(client_count)]
+    broadcasters = [threading.Thread(target=broadcaster) for _ in range(broadcaster_count)]
+    for thread in threads + broadcasters:
+        thread.start()
+    start.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    for thread in broadcasters:
+        thread.join()
+    return elapsed, results, len(lost)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Client registry connect/disconnect churn benchmark")
+    parser.add_argument('--clients', type=int, default=1000, help="concurrent connecting threads")
+    parser.add_argument('--cycles', type=int, default=20, help="connect/disconnect cycles per thread")
+    parser.add_argument('--hold', type=float, default=2.0, help="longest time connected per cycle, in ms")
+    parser.add_argument('--broadcasters', type=int, default=2, help="threads iterating the registry")
+    parser.add_argument('--resident', type=int, default=200, help="clients connected throughout")
+    args = parser.parse_args()
+
+    total = args.clients * args.cycles
+    print(f"{args.clients} threads x {args.cycles} connect/disconnect cycles (held up to {args.hold:g} ms), "
+          f"{args.broadcasters} broadcasters, {args.resident} resident clients")
+    for label, registry in (("dict", DictRegistry()), ("ClientRegistry", ClientRegistry())):
+        elapsed, results, lost = run(registry, args.clients, args.cycles, args.hold / 1000,
+                                     args.broadcasters, args.resident)
+        print(f"{label:>15}: {total / elapsed:>10,.0f} cycles/s  "
+              f"{results['broadcasts']:>6} broadcasts  {results['errors']:>6} failed broadcasts  "
+              f"{lost} lost lookups")
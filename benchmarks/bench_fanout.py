@@ -0,0 +1,70 @@
+# bench_fanout.py - Per-message CPU cost of broadcast fan-out vs. recipient count
+#
+# Compares encoding the payload for every recipient (the old broadcast_message
+# loop) with encoding it once and sharing the frame across recipient queues.
+#
+#   python benchmarks/bench_fanout.py [--messages 200] [--size 200]
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from framing import encode_frame
+from connection import BufferedConnection
+
+RECIPIENT_COUNTS = [1, 10, 100, 500, 1000, 2000]
+
+
+class QueueOnlyConnection(BufferedConnection):
+    """Outbound queue without a writer, so only the fan-out cost is measured"""
+
+    def _wake_writer(self):
+        pass
+
+    def abort(self):
+        pass
+
+    def reset(self):
+        self.queue.clear()
+        self.queued_bytes = 0
+
+
+def per_recipient_encode(connections, message):
+    for connection in connections:
+        connection.send(message.encode('utf-8'))
+
+
+def encode_once(connections, message):
+    frame = encode_frame(message)
+    for connection in connections:
+        connection.send_frame(frame)
+
+
+def measure(fanout, connections, message, messages):
+    start = time.process_time()
+    for _ in range(messages):
+        fanout(connections, message)
+        for connection in connections:
+            connection.reset()
+    return (time.process_time() - start) / messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Broadcast fan-out CPU cost vs. recipient count")
+    parser.add_argument('--messages', type=int, default=200, help="messages broadcast per measurement")
+    parser.add_argument('--size', type=int, default=200, help="message size in characters")
+    args = parser.parse_args()
+
+    message = "alice: " + "é" * args.size
+    print(f"{'recipients':>10} {'per-recipient (us/msg)':>24} {'encode-once (us/msg)':>22} {'speedup':>8}")
+    for count in RECIPIENT_COUNTS:
+        connections = [QueueOnlyConnection(max_queued_frames=args.messages + 1) for _ in range(count)]
+        before = measure(per_recipient_encode, connections, message, args.messages)
+        after = measure(encode_once, connections, message, args.messages)
+        print(f"{count:>10} {before * 1e6:>24.1f} {after * 1e6:>22.1f} {before / after:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+# bench_file_server.py - File server throughput at 50 concurrent transfers
+#
+# Starts a FileTransferServer on a scratch database, then runs --concurrency
+# client threads that each upload a file and download files in a loop over
+# one keep-alive connection. The same workload runs against the old serial
+# HTTPServer and the pooled server. One extra client trickles a slow upload
+# the whole time, which is what used to stall everyone else.
+#
+#   python benchmarks/bench_file_server.py [--concurrency 50] [--size 1048576] [--seconds 10]
+import argparse
+import contextlib
+import http.client
+import io
+import os
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import HTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from file_transfer import FileTransferServer, FileTransferDatabase, FileTransferHandler
+
+BOUNDARY = 'benchboundary'
+
+
+class BenchDatabase(FileTransferDatabase):
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.init_file_tables()
+
+
+class HTTP10FileTransferHandler(FileTransferHandler):
+    protocol_version = 'HTTP/1.0'
+
+
+class SerialFileTransferServer(FileTransferServer):
+    """The previous single-threaded, HTTP/1.0 server, for comparison"""
+
+    def create_http_server(self, handler):
+        def serial_handler(*args, **kwargs):
+            return HTTP10FileTransferHandler(*args, database=self.database, clients=self.clients, **kwargs)
+        return HTTPServer((self.host, self.port), serial_handler)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def multipart_body(filename, data, sender='bench'):
+    head = (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="sender"\r\n\r\n{sender}\r\n'
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode()
+    return head + data + f'\r\n--{BOUNDARY}--\r\n'.encode()
+
+
+def upload(conn, data):
+    conn.request('POST', '/upload', body=multipart_body(f'{uuid.uuid4()}.bin', data),
+                 headers={'Content-Type': f'multipart/form-data; boundary={BOUNDARY}'})
+    response = conn.getresponse()
+    response.read()
+    return response.status
+
+
+def download(conn, file_id):
+    conn.request('GET', f'/download/{file_id}')
+    response = conn.getresponse()
+    return response.status, len(response.read())
+
+
+def slow_upload(port, size, stop):
+    """Send an upload body a few KB at a time until the benchmark ends"""
+    body = multipart_body('slow.bin', os.urandom(size))
+    with socket.create_connection(('localhost', port)) as sock:
+        sock.sendall((f'POST /upload HTTP/1.1\r\nHost: localhost\r\n'
+                      f'Content-Type: multipart/form-data; boundary={BOUNDARY}\r\n'
+                      f'Content-Length: {len(body)}\r\n\r\n').encode())
+        for offset in range(0, len(body), 4096):
+            if stop.is_set():
+                return
+            sock.sendall(body[offset:offset + 4096])
+            time.sleep(0.05)
+
+
+def client_loop(port, file_ids, data, deadline, results):
+    conn = http.client.HTTPConnection('localhost', port, timeout=60)
+    latencies, transferred, errors = [], 0, 0
+    i = 0
+    while time.monotonic() < deadline:
+        start = time.monotonic()
+        try:
+            if i % 4 == 0:
+                ok = upload(conn, data) == 200
+                size = len(data)
+            else:
+                status, size = download(conn, file_ids[i % len(file_ids)])
+                ok = status == 200
+        except (OSError, http.client.HTTPException):
+            ok, size = False, 0
+            conn.close()
+            conn = http.client.HTTPConnection('localhost', port, timeout=60)
+        latencies.append(time.monotonic() - start)
+        if ok:
+            transferred += size
+        else:
+            errors += 1
+        i += 1
+    conn.close()
+    results.append((latencies, transferred, errors))
+
+
+def run(server_class, args, data, workdir):
+    db = BenchDatabase(os.path.join(workdir, f'{server_class.__name__}.db'))
+    file_ids = []
+    for n in range(8):
+        file_id = str(uuid.uuid4())
+        db.save_file(file_id, f'seed{n}.bin', os.urandom(args.size), 'bench')
+        file_ids.append(file_id)
+
+    port = free_port()
+    server = server_class('localhost', port, db, {}, max_workers=args.concurrency + 8)
+    server.start()
+    time.sleep(0.2)
+
+    stop = threading.Event()
+    slow = threading.Thread(target=slow_upload, args=(port, args.size, stop), daemon=True)
+    slow.start()
+    time.sleep(0.2)
+
+    results = []
+    deadline = time.monotonic() + args.seconds
+    clients = [threading.Thread(target=client_loop, args=(port, file_ids, data, deadline, results))
+               for _ in range(args.concurrency)]
+    start = time.monotonic()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join(args.seconds + 120)
+    elapsed = time.monotonic() - start
+
+    stop.set()
+    server.stop()
+    db.close_connections()
+
+    latencies = sorted(l for result in results for l in result[0])
+    transferred = sum(result[1] for result in results)
+    errors = sum(result[2] for result in results)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'req_per_s': len(latencies) / elapsed,
+        'mb_per_s': transferred / elapsed / 1048576,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else 0,
+        'p95_ms': latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="File server throughput at N concurrent transfers")
+    parser.add_argument('--concurrency', type=int, default=50, help="concurrent client connections")
+    parser.add_argument('--size', type=int, default=1024 * 1024, help="bytes per uploaded/downloaded file")
+    parser.add_argument('--seconds', type=float, default=10, help="duration of each run")
+    args = parser.parse_args()
+
+    data = os.urandom(args.size)
+    workdir = tempfile.mkdtemp(prefix='bench_file_server')
+    print(f"{args.concurrency} clients, {args.size} byte files, 1 upload : 3 downloads, "
+          f"plus one slow upload, {args.seconds:.0f}s per server")
+    try:
+        rows = []
+        for server_class in (SerialFileTransferServer, FileTransferServer):
+            print(f"Running {server_class.__name__}...")
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                rows.append((server_class.__name__, run(server_class, args, data, workdir)))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print()
+    print(f"{'server':<26} {'requests':>9} {'errors':>7} {'req/s':>8} {'MB/s':>8} {'p50 ms':>8} {'p95 ms':>9}")
+    for name, r in rows:
+        print(f"{name:<26} {r['requests']:>9} {r['errors']:>7} {r['req_per_s']:>8.1f} "
+              f"{r['mb_per_s']:>8.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# bench_history.py - Message history latency before and after the composite indexes
+#
+# Seeds a scratch database with synthetic BROADCAST/PERSONAL/GROUP traffic,
+# times ChatDatabase.get_messages() on the unindexed table, then runs the
+# schema migration and times the same lookups again.
+#
+#   python benchmarks/bench_history.py [--rows 5000000] [--db /tmp/history_bench.db]
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from server2 import ChatDatabase
+
+USERS = 1000
+GROUPS = 200
+SEED_BATCH = 100000
+
+
+def synthetic_rows(count):
+    """Yield message rows in timestamp order: 50% broadcast, 30% personal, 20% group"""
+    rng = random.Random(42)
+    start = datetime(2024, 1, 1)
+    for i in range(count):
+        timestamp = (start + timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S")
+        sender = f"user{rng.randrange(USERS)}"
+        kind = rng.random()
+        if kind < 0.5:
+            yield (sender, None, None, f"broadcast {i}", "BROADCAST", timestamp)
+        elif kind < 0.8:
+            yield (sender, f"user{rng.randrange(USERS)}", None, f"personal {i}", "PERSONAL", timestamp)
+        else:
+            yield (sender, None, f"group{rng.randrange(GROUPS)}", f"group {i}", "GROUP", timestamp)
+
+
+def seed(db, rows):
+    conn = db.get_connection()
+    generator = synthetic_rows(rows)
+    written = 0
+    while written < rows:
+        batch = [row for _, row in zip(range(SEED_BATCH), generator)]
+        with conn:
+            conn.executemany('''
+                INSERT INTO messages (sender, recipient, group_name, content, message_type, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', batch)
+        written += len(batch)
+        print(f"  seeded {written}/{rows}", end="\r")
+    print()
+
+
+def drop_indexes(db):
+    conn = db.get_connection()
+    with conn:
+        for index_name in ChatDatabase.MESSAGE_INDEXES:
+            conn.execute(f'DROP INDEX IF EXISTS {index_name}')
+        conn.execute('PRAGMA user_version = 0')
+
+
+def time_lookups(db, samples):
+    rng = random.Random(7)
+    lookups = {
+        'BROADCAST': lambda: db.get_messages("BROADCAST"),
+        'PERSONAL': lambda: db.get_messages("PERSONAL", f"user{rng.randrange(USERS)}", f"user{rng.randrange(USERS)}"),
+        'GROUP': lambda: db.get_messages("GROUP", None, f"group{rng.randrange(GROUPS)}")
+    }
+    results = {}
+    for name, lookup in lookups.items():
+        timings = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                lookup()
+            timings.append((time.perf_counter() - start) * 1000)
+        results[name] = (statistics.median(timings), max(timings))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="get_messages latency before/after history indexes")
+    parser.add_argument('--rows', type=int, default=5000000, help="messages to seed")
+    parser.add_argument('--samples', type=int, default=5, help="lookups timed per message type")
+    parser.add_argument('--db', default='history_bench.db', help="scratch database file (deleted first)")
+    args = parser.parse_args()
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        db = ChatDatabase(args.db)
+    drop_indexes(db)
+
+    print(f"Seeding {args.rows} messages into {args.db}...")
+    seed(db, args.rows)
+
+    print("Timing history lookups without indexes...")
+    before = time_lookups(db, args.samples)
+
+    print("Running schema migration...")
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        db.migrate_schema()
+    print(f"  migration took {time.perf_counter() - start:.1f}s")
+
+    print("Timing history lookups with indexes...")
+    after = time_lookups(db, args.samples)
+
+    print()
+    print(f"{'lookup':<10} {'before median/max (ms)':>24} {'after median/max (ms)':>24}")
+    for name in before:
+        b_med, b_max = before[name]
+        a_med, a_max = after[name]
+        print(f"{name:<10} {b_med:>11.1f} / {b_max:<10.1f} {a_med:>11.2f} / {a_max:<10.2f}")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        db.close_connections()
+
+
+if __name__ == "__main__":
+    main()
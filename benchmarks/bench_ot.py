@@ -0,0 +1,146 @@
+# bench_ot.py - Convergence check and throughput of the code session OT engine
+#
+# Simulates a session in memory: several editors make random concurrent
+# edits through ClientSync, a ServerDocument orders them, and messages are
+# delivered in a random interleaving (per-connection order is kept, as on a
+# TCP connection). After every round all editors must hold the server's text.
+# Then times ServerDocument.receive() for a stream of keystrokes made by
+# editors that are a few operations behind, on a document of --lines lines.
+#
+#   python benchmarks/bench_ot.py [--rounds 200] [--editors 5] [--ops 20000] [--lines 3000]
+import argparse
+import collections
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ot import ClientSync, ServerDocument, TextOperation
+
+ALPHABET = "abcdefghij \n()=:"
+
+
+def random_edit(rng, text):
+    """A random keystroke-sized edit of text, as an operation"""
+    pos = rng.randint(0, len(text))
+    kind = rng.random()
+    if kind < 0.6 or not text:
+        inserted = ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 3)))
+        return TextOperation().retain(pos).insert(inserted).retain(len(text) - pos)
+    removed = min(rng.randint(1, 4), len(text) - pos)
+    if kind < 0.9:
+        return TextOperation().retain(pos).delete(removed).retain(len(text) - pos - removed)
+    return TextOperation().retain(pos).insert(rng.choice(ALPHABET)).delete(removed).retain(len(text) - pos - removed)
+
+
+class Editor:
+    def __init__(self, name, text, revision):
+        self.name = name
+        self.text = text
+        self.sync = ClientSync(revision)
+        self.to_server = collections.deque()    # (revision, operation wire form)
+        self.from_server = collections.deque()  # ('ack', None) or ('op', wire form)
+
+    def edit(self, rng):
+        operation = random_edit(rng, self.text)
+        self.text = operation.apply(self.text)
+        outgoing = self.sync.local(operation)
+        if outgoing is not None:
+            self.to_server.append((self.sync.revision, outgoing.to_json()))
+
+    def deliver(self):
+        kind, wire = self.from_server.popleft()
+        if kind == 'ack':
+            outgoing = self.sync.acknowledge()
+            if outgoing is not None:
+                self.to_server.append((self.sync.revision, outgoing.to_json()))
+        else:
+            operation = self.sync.remote(TextOperation.from_json(wire))
+            self.text = operation.apply(self.text)
+
+
+def server_step(server, editors, sender):
+    revision, wire = sender.to_server.popleft()
+    applied = server.receive(revision, TextOperation.from_json(wire))
+    for editor in editors:
+        if editor is sender:
+            editor.from_server.append(('ack', None))
+        else:
+            editor.from_server.append(('op', applied.to_json()))
+
+
+def convergence_round(seed, editor_count, steps):
+    rng = random.Random(seed)
+    start = ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 40)))
+    server = ServerDocument(start)
+    editors = [Editor(f"editor{i}", start, 0) for i in range(editor_count)]
+
+    for _ in range(steps):
+        editor = rng.choice(editors)
+        action = rng.random()
+        if action < 0.4:
+            editor.edit(rng)
+        elif action < 0.7 and editor.to_server:
+            server_step(server, editors, editor)
+        elif editor.from_server:
+            editor.deliver()
+
+    # Drain the network
+    while any(editor.to_server or editor.from_server for editor in editors):
+        editor = rng.choice(editors)
+        if editor.to_server and rng.random() < 0.5:
+            server_step(server, editors, editor)
+        elif editor.from_server:
+            editor.deliver()
+
+    for editor in editors:
+        if editor.text != server.text:
+            raise AssertionError(f"seed {seed}: {editor.name} diverged\n"
+                                 f"  server: {server.text!r}\n  editor: {editor.text!r}")
+    return server.revision
+
+
+def check_convergence(rounds, editor_count):
+    started = time.perf_counter()
+    operations = 0
+    for seed in range(rounds):
+        operations += convergence_round(seed, editor_count, steps=300)
+    elapsed = time.perf_counter() - started
+    print(f"Convergence: {rounds} random sessions with {editor_count} editors, "
+          f"{operations} operations, all converged ({elapsed:.2f}s)")
+
+
+def bench_receive(op_count, editor_count, lines, lag):
+    """Operations per second through one session's ServerDocument"""
+    rng = random.Random(1)
+    text = ''.join(f"    value_{i} = compute({i})  # line {i}\n" for i in range(lines))
+    server = ServerDocument(text)
+
+    # Most keystrokes are made against a revision `lag` operations old, as
+    # when editors type at once, so receive() transforms them past the others
+    snapshots = collections.deque([server.text], maxlen=lag + 1)  # texts of the last revisions
+    started = time.perf_counter()
+    for i in range(op_count):
+        behind = 0 if i % editor_count == 0 else len(snapshots) - 1
+        operation = random_edit(rng, snapshots[-1 - behind])
+        server.receive(server.revision - behind, operation)
+        snapshots.append(server.text)
+    elapsed = time.perf_counter() - started
+    print(f"Throughput: {op_count} operations on a {len(text)} character document, "
+          f"{editor_count} editors up to {lag} operations behind: "
+          f"{op_count / elapsed:,.0f} ops/s ({elapsed * 1e6 / op_count:.1f} us/op)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OT engine convergence check and benchmark")
+    parser.add_argument('--rounds', type=int, default=200, help="random sessions checked for convergence")
+    parser.add_argument('--editors', type=int, default=5, help="editors per session")
+    parser.add_argument('--ops', type=int, default=20000, help="operations timed in the throughput run")
+    parser.add_argument('--lines', type=int, default=3000, help="document size for the throughput run")
+    parser.add_argument('--lag', type=int, default=4, help="how many operations behind concurrent editors are")
+    args = parser.parse_args()
+
+    check_convergence(args.rounds, args.editors)
+    bench_receive(args.ops, args.editors, args.lines, args.lag)
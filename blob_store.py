@@ -0,0 +1,159 @@
+# blob_store.py - Content-addressed on-disk storage for shared files
+#
+# Uploaded file contents live on disk, named by their SHA-256 digest and
+# sharded two levels deep (ab/cd/abcd...), so no directory grows too large.
+# Identical uploads hash to the same blob and are stored once; shared_files
+# only keeps metadata plus the content_hash. Blobs are written to a temp file
+# first and renamed into place, so readers never see a partial blob.
+import hashlib
+import os
+import tempfile
+import threading
+from datetime import datetime
+
+HASH_ALGORITHM = 'sha256'
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def log_blob_store(message, operation="BLOB"):
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    print(f"[FILE_STORE {operation}] {timestamp} - {message}")
+
+
+class BlobWriter:
+    """Streams one blob to a temp file while hashing it; see BlobStore.writer()"""
+
+    def __init__(self, store):
+        self.store = store
+        self.hasher = hashlib.new(HASH_ALGORITHM)
+        self.size = 0
+        fd, self.temp_path = tempfile.mkstemp(dir=store.temp_dir, prefix='upload-')
+        self.file = os.fdopen(fd, 'wb')
+
+    def write(self, data):
+        self.hasher.update(data)
+        self.file.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def commit(self):
+        """Move the finished blob into place; returns (content_hash, size).
+
+        Callers that record the blob in the database must hold store.lock
+        across commit() and the INSERT, so a concurrent delete cannot remove
+        a blob that is about to gain a reference.
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+        content_hash = self.hasher.hexdigest()
+        final_path = self.store.path(content_hash)
+        if os.path.exists(final_path):
+            # Dedup: identical content is already stored
+            os.remove(self.temp_path)
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(self.temp_path, final_path)
+        self.temp_path = None
+        return content_hash, self.size
+
+    def abort(self):
+        """Discard a partially written blob"""
+        if self.temp_path is None:
+            return
+        self.file.close()
+        try:
+            os.remove(self.temp_path)
+        except OSError:
+            pass
+        self.temp_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.abort()
+        return False
+
+
+class BlobStore:
+    """SHA-256 addressed blob directory"""
+
+    def __init__(self, root):
+        self.root = root
+        self.temp_dir = os.path.join(root, 'tmp')
+        self.partial_dir = os.path.join(root, 'partial')
+        os.makedirs(self.temp_dir, exist_ok=True)
+        os.makedirs(self.partial_dir, exist_ok=True)
+        # Serializes "blob gains a reference" against "unreferenced blob is deleted"
+        self.lock = threading.RLock()
+
+    def path(self, content_hash):
+        return os.path.join(self.root, content_hash[:2], content_hash[2:4], content_hash)
+
+    def exists(self, content_hash):
+        return os.path.exists(self.path(content_hash))
+
+    def size(self, content_hash):
+        return os.path.getsize(self.path(content_hash))
+
+    def writer(self):
+        """Return a BlobWriter for streaming content of unknown size"""
+        return BlobWriter(self)
+
+    def put_bytes(self, data):
+        """Store data; caller holds self.lock if it records the hash. Returns (hash, size)"""
+        writer = self.writer()
+        try:
+            writer.write(data)
+            return writer.commit()
+        finally:
+            writer.abort()
+
+    def partial_path(self, upload_id):
+        """Where a resumable upload accumulates its chunks"""
+        return os.path.join(self.partial_dir, f'{upload_id}.part')
+
+    def hash_file(self, path):
+        hasher = hashlib.new(HASH_ALGORITHM)
+        with open(path, 'rb') as source:
+            while True:
+                chunk = source.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def put_file(self, path, content_hash=None):
+        """Move a finished file into the store; caller holds self.lock if it records the hash.
+
+        The file is consumed (renamed, or removed if the content is already
+        stored). Returns (content_hash, size).
+        """
+        if content_hash is None:
+            content_hash = self.hash_file(path)
+        size = os.path.getsize(path)
+        final_path = self.path(content_hash)
+        if os.path.exists(final_path):
+            os.remove(path)
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(path, final_path)
+        return content_hash, size
+
+    def open(self, content_hash):
+        return open(self.path(content_hash), 'rb')
+
+    def read_bytes(self, content_hash):
+        with self.open(content_hash) as blob:
+            return blob.read()
+
+    def delete(self, content_hash):
+        """Remove a blob; caller holds self.lock and has checked it is unreferenced"""
+        try:
+            os.remove(self.path(content_hash))
+            log_blob_store(f"Deleted unreferenced blob {content_hash[:12]}", "DELETE")
+            return True
+        except FileNotFoundError:
+            return False
@@ -7,11 +7,21 @@ import threading
 import json
 import os
 import base64
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import uuid
 from codeeditor import CodeEditorWindow
 import requests
 from tcp_logger import run_tcpdump_log
+from framing import FrameDecoder, encode_frame, recv_frame
+
+# Resumable uploads: chunks sent in parallel, each retried a few times, with
+# upload ids remembered on disk so an interrupted upload picks up where it stopped
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_PARALLELISM = 4
+UPLOAD_RETRIES = 3
+UPLOAD_STATE_FILE = os.path.join(os.path.expanduser("~"), ".devconnect_uploads.json")
 
 # Modern Style Constants
 class ModernStyle:
@@ -185,6 +195,11 @@ class ChatClient:
         self.host = host
         self.port = port
         self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.frame_decoder = FrameDecoder()
+        self.send_lock = threading.Lock()
+        self.http_port = 8080  # updated from SERVER_INFO
+        self.http_local = threading.local()  # one keep-alive session per upload thread
+        self.upload_state_lock = threading.Lock()
         self.connected = False
         self.supported_languages = []
         self.code_editor = None
@@ -202,6 +217,7 @@ class ChatClient:
         self.users_list = []
         self.groups_list = []
         self.pending_history_requests = set()  # Track pending history requests
+        self.history_state = {}  # {chat_name: {'oldest_id', 'has_more', 'loading'}}
         
         self.create_widgets()
         
@@ -392,12 +408,12 @@ class ChatClient:
                                    state="disabled",
                                    wrap="word")
         
-        msg_scrollbar = tk.Scrollbar(text_frame, orient="vertical")
-        self.messages_text.config(yscrollcommand=msg_scrollbar.set)
-        msg_scrollbar.config(command=self.messages_text.yview)
+        self.msg_scrollbar = tk.Scrollbar(text_frame, orient="vertical")
+        self.messages_text.config(yscrollcommand=self.on_messages_scroll)
+        self.msg_scrollbar.config(command=self.messages_text.yview)
         
         self.messages_text.pack(side="left", fill="both", expand=True)
-        msg_scrollbar.pack(side="right", fill="y")
+        self.msg_scrollbar.pack(side="right", fill="y")
         
         # Configure text tags for styling
         self.messages_text.tag_config("my_message", background=ModernStyle.MY_MESSAGE_BG, 
@@ -461,6 +477,37 @@ class ChatClient:
         self.message_entry.bind('<Return>', self.on_enter_key)
         self.message_entry.bind('<Shift-Return>', lambda e: None)
     
+    def on_messages_scroll(self, first, last):
+        """Update the scrollbar and fetch older history when scrolled to the top"""
+        self.msg_scrollbar.set(first, last)
+        if float(first) <= 0.0:
+            self.request_older_messages(self.current_chat)
+    
+    def history_request_target(self, chat_name):
+        """Map a chat name to the (msg_type, target) used by history requests"""
+        if chat_name.startswith("PM: "):
+            return "PERSONAL", chat_name[4:]
+        elif chat_name.startswith("Group: "):
+            return "GROUP", chat_name[7:]
+        return "BROADCAST", None
+    
+    def request_older_messages(self, chat_name):
+        """Lazily fetch the page of history just before the oldest loaded message"""
+        state = self.history_state.get(chat_name)
+        if not state or not state['has_more'] or state['loading'] or state['oldest_id'] is None:
+            return
+        
+        state['loading'] = True
+        msg_type, target = self.history_request_target(chat_name)
+        page_request = {
+            'msg_type': msg_type,
+            'target': target,
+            'before_id': state['oldest_id'],
+            'limit': 50
+        }
+        log_client_gui(f"Requesting older history for {chat_name} before {state['oldest_id']}", self.username)
+        self.send_to_server(f"GET_MESSAGES_PAGE|{json.dumps(page_request)}")
+    
     def on_enter_key(self, event):
         if not event.state & 0x1:  # Not Shift+Enter
             self.send_message()
@@ -507,42 +554,137 @@ class ChatClient:
             self.chat_listbox.insert(tk.END, chat_name)
             log_client_gui(f"Added chat to UI: {chat_name}", self.username)
 
+    @property
+    def file_server_url(self):
+        return f"http://{self.host}:{self.http_port}"
+    
+    def http_session(self):
+        """Keep-alive HTTP session for the calling thread"""
+        session = getattr(self.http_local, 'session', None)
+        if session is None:
+            session = self.http_local.session = requests.Session()
+        return session
+    
     def upload_file(self, file_path, recipient=None, group_name=None):
-        server_url = "localhost:8080"  # Adjust as needed
+        """Upload a file in parallel chunks, resuming an earlier interrupted upload of it.
+        
+        Runs on a background thread; UI updates go through root.after.
+        """
+        server_url = self.file_server_url
+        chat_name = self.current_chat
+        filename = os.path.basename(file_path)
         try:
-            with open(file_path, 'rb') as f:
-                files = {'file': f}
-                data = {
+            file_size = os.path.getsize(file_path)
+            resume_key = self.upload_resume_key(file_path, recipient, group_name)
+            status = self.resume_upload(resume_key)
+            
+            if status is None:
+                response = self.http_session().post(f"{server_url}/uploads", json={
+                    'filename': filename,
+                    'file_size': file_size,
+                    'chunk_size': UPLOAD_CHUNK_SIZE,
                     'sender': self.username,
                     'recipient': recipient or '',
                     'group_name': group_name or ''
-                }
-                response = requests.post(f"{server_url}/upload", files=files, data=data)
-                if response.status_code == 200:
-                    result = response.json()
-                    self.add_message("System", f"📎 Sent file '{os.path.basename(file_path)}' [Click to download]", "file_message", self.current_chat)
-                    return result
-                else:
-                    messagebox.showerror("Upload Failed", response.text)
-                    return None
+                })
+                response.raise_for_status()
+                status = response.json()
+                self.save_upload_state(resume_key, status['upload_id'])
+            else:
+                log_client_file(f"Resuming upload of {filename} at {status['next_offset']}/{file_size} bytes", self.username)
+            
+            upload_id = status['upload_id']
+            chunk_size = status['chunk_size']
+            with ThreadPoolExecutor(max_workers=UPLOAD_PARALLELISM) as pool:
+                list(pool.map(lambda offset: self.upload_chunk(server_url, upload_id, file_path, offset, chunk_size),
+                              status['missing']))
+            
+            response = self.http_session().post(f"{server_url}/uploads/{upload_id}/complete")
+            response.raise_for_status()
+            result = response.json()
+            self.save_upload_state(resume_key, None)
+            log_client_file(f"Uploaded {filename} ({file_size} bytes) as {result['file_id']}", self.username)
+            self.root.after(0, lambda: self.add_message("System", f"📎 Sent file '{filename}' [Click to download]", "file_message", chat_name))
+            return result
         except Exception as e:
-            messagebox.showerror("Upload Error", str(e))
+            log_client_file(f"Upload of {filename} failed: {e}", self.username)
+            self.root.after(0, lambda: messagebox.showerror("Upload Error", f"{e}\n\nSend the file again to resume."))
+            return None
+    
+    def upload_chunk(self, server_url, upload_id, file_path, offset, chunk_size):
+        """PUT one chunk with its checksum, retrying transient failures"""
+        with open(file_path, 'rb') as f:
+            f.seek(offset)
+            chunk = f.read(chunk_size)
+        checksum = hashlib.sha256(chunk).hexdigest()
+        
+        for attempt in range(1, UPLOAD_RETRIES + 1):
+            try:
+                response = self.http_session().put(f"{server_url}/uploads/{upload_id}",
+                                                   params={'offset': offset}, data=chunk,
+                                                   headers={'X-Chunk-SHA256': checksum})
+                if response.status_code == 200:
+                    return
+                if response.status_code != 422 or attempt == UPLOAD_RETRIES:
+                    response.raise_for_status()
+            except requests.ConnectionError:
+                # Drop the broken keep-alive connection and try again
+                self.http_local.session = None
+                if attempt == UPLOAD_RETRIES:
+                    raise
+            log_client_file(f"Retrying chunk at {offset} (attempt {attempt + 1})", self.username)
+    
+    def upload_resume_key(self, file_path, recipient, group_name):
+        stat = os.stat(file_path)
+        target = group_name or recipient or "BROADCAST"
+        return f"{self.file_server_url}|{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}|{target}"
+    
+    def load_upload_state(self):
+        try:
+            with open(UPLOAD_STATE_FILE) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def save_upload_state(self, resume_key, upload_id):
+        """Remember (or with upload_id None, forget) the upload id for a file"""
+        with self.upload_state_lock:
+            state = self.load_upload_state()
+            if upload_id:
+                state[resume_key] = upload_id
+            else:
+                state.pop(resume_key, None)
+            with open(UPLOAD_STATE_FILE, 'w') as f:
+                json.dump(state, f)
+    
+    def resume_upload(self, resume_key):
+        """Server-side status of an unfinished upload of this file, or None"""
+        upload_id = self.load_upload_state().get(resume_key)
+        if not upload_id:
+            return None
+        response = self.http_session().get(f"{self.file_server_url}/uploads/{upload_id}")
+        if response.status_code != 200:
+            # Expired or already completed on the server
+            self.save_upload_state(resume_key, None)
             return None
+        return response.json()
 
     def download_file(self, file_id):
-        server_url = "localhost:8080"
+        server_url = self.file_server_url
         try:
-            response = requests.get(f"{server_url}/download/{file_id}")
-            if response.status_code == 200:
-                content_disposition = response.headers.get('Content-Disposition', '')
-                filename = content_disposition.split('filename=')[1].strip('"') if 'filename=' in content_disposition else file_id
-                save_path = filedialog.asksaveasfilename(defaultextension="", initialfile=filename)
-                if save_path:
-                    with open(save_path, 'wb') as f:
-                        f.write(response.content)
-                    messagebox.showinfo("Download Complete", f"File saved to {save_path}")
-            else:
-                messagebox.showerror("Download Failed", f"Status code: {response.status_code}")
+            # Streamed to disk so large files are never held in memory
+            with requests.get(f"{server_url}/download/{file_id}", stream=True) as response:
+                if response.status_code == 200:
+                    content_disposition = response.headers.get('Content-Disposition', '')
+                    filename = content_disposition.split('filename=')[1].strip('"') if 'filename=' in content_disposition else file_id
+                    save_path = filedialog.asksaveasfilename(defaultextension="", initialfile=filename)
+                    if save_path:
+                        with open(save_path, 'wb') as f:
+                            for chunk in response.iter_content(chunk_size=256 * 1024):
+                                f.write(chunk)
+                        messagebox.showinfo("Download Complete", f"File saved to {save_path}")
+                else:
+                    messagebox.showerror("Download Failed", f"Status code: {response.status_code}")
         except Exception as e:
             messagebox.showerror("Download Error", str(e))
 
@@ -552,15 +694,16 @@ class ChatClient:
             return
     
         # Determine recipient or group
+        recipient = None
+        group_name = None
         if self.current_chat.startswith("PM: "):
             recipient = self.current_chat[4:]
-            self.upload_file(file_path, recipient=recipient)
         elif self.current_chat.startswith("Group: "):
             group_name = self.current_chat[7:]
-            self.upload_file(file_path, group_name=group_name)
-        else:
-            # Uploading to general chat
-            self.upload_file(file_path)
+        
+        # Large uploads must not freeze the UI
+        log_client_file(f"Uploading {file_path} to {group_name or recipient or 'General'}", self.username)
+        threading.Thread(target=self.upload_file, args=(file_path, recipient, group_name), daemon=True).start()
 
     def open_code_editor(self):
         """Open the collaborative code editor"""
@@ -650,14 +793,8 @@ class ChatClient:
             self.pending_history_requests.add(history_key)
             log_client_gui(f"Requesting history for {chat_name}", self.username)
             
-            if chat_name.startswith("PM: "):
-                user = chat_name[4:]
-                self.send_to_server(f"GET_MESSAGES|PERSONAL|{user}")
-            elif chat_name.startswith("Group: "):
-                group = chat_name[7:]
-                self.send_to_server(f"GET_MESSAGES|GROUP|{group}")
-            elif chat_name == "General":
-                self.send_to_server(f"GET_MESSAGES|BROADCAST|")
+            msg_type, target = self.history_request_target(chat_name)
+            self.send_to_server(f"GET_MESSAGES|{msg_type}|{target or ''}")
         
         self.messages_text.config(state="disabled")
         self.messages_text.see(tk.END)
@@ -695,7 +832,9 @@ class ChatClient:
     
     def send_to_server(self, message):
         try:
-            self.client_socket.send(message.encode('utf-8'))
+            frame = encode_frame(message)
+            with self.send_lock:
+                self.client_socket.sendall(frame)
         except:
             messagebox.showerror("Error", "Connection lost")
             self.on_closing()
@@ -703,9 +842,10 @@ class ChatClient:
     def connect(self):
         try:
             self.client_socket.connect((self.host, self.port))
-            self.client_socket.send(self.username.encode('utf-8'))
+            self.client_socket.sendall(encode_frame(self.username))
             
-            response = self.client_socket.recv(1024).decode('utf-8')
+            frame = recv_frame(self.client_socket, self.frame_decoder)
+            response = frame.decode('utf-8') if frame is not None else ""
             if response == "NAME_TAKEN":
                 messagebox.showerror("Error", "Username already taken")
                 return False
@@ -727,11 +867,12 @@ class ChatClient:
     def receive_messages(self):
         try:
             while self.connected:
-                message = self.client_socket.recv(8192).decode('utf-8')
-                if not message:
+                # Frames already buffered by the decoder are returned without a recv
+                frame = recv_frame(self.client_socket, self.frame_decoder)
+                if frame is None:
                     break
                 
-                self.process_received_message(message)
+                self.process_received_message(frame.decode('utf-8'))
                 
         except Exception as e:
             if self.connected:
@@ -743,6 +884,7 @@ class ChatClient:
             if message.startswith("SERVER_INFO|"):
                 data = json.loads(message[12:])
                 self.supported_languages = data.get('supported_languages', [])
+                self.http_port = data.get('http_port', self.http_port)
                 self.users_list = data.get('active_users', [])
                 self.update_users_list()
                 log_client_networking(f"Received server info, {len(self.users_list)} users online", self.username)
@@ -845,6 +987,7 @@ class ChatClient:
         msg_type = data.get('msg_type')
         target = data.get('target')
         messages = data.get('messages', [])
+        is_older_page = data.get('before_id') is not None
         
         chat_name = "General"
         if msg_type == "PERSONAL":
@@ -856,12 +999,22 @@ class ChatClient:
         history_key = f"{chat_name}_{self.username}"
         self.pending_history_requests.discard(history_key)
         
-        log_client_gui(f"Processing {len(messages)} history messages for {chat_name}", self.username)
+        log_client_gui(f"Processing {len(messages)} history messages for {chat_name}"
+                       f"{' (older page)' if is_older_page else ''}", self.username)
         
         self.ensure_chat_exists(chat_name)
         
-        # Clear existing messages for this chat
-        self.active_chats[chat_name] = []
+        # Remember where the next older page starts
+        state = self.history_state.setdefault(chat_name, {'oldest_id': None, 'has_more': False, 'loading': False})
+        state['loading'] = False
+        state['has_more'] = data.get('has_more', False)
+        if messages:
+            state['oldest_id'] = messages[0].get('id')
+        
+        # The latest page replaces the chat; older pages are prepended to it
+        page = []
+        if not is_older_page:
+            self.active_chats[chat_name] = []
         
         # Add historical messages
         for msg in messages:
@@ -897,23 +1050,46 @@ class ChatClient:
                 'file_data': file_data
             }
             
-            self.active_chats[chat_name].append(message_data)
+            page.append(message_data)
+        
+        if is_older_page:
+            self.active_chats[chat_name][:0] = page
+        else:
+            self.active_chats[chat_name].extend(page)
         
         # Refresh display if this is the current chat
         if chat_name == self.current_chat:
-            self.root.after(0, lambda: self.refresh_current_chat())
+            if is_older_page:
+                self.root.after(0, self.show_prepended_history)
+            else:
+                self.root.after(0, lambda: self.refresh_current_chat())
     
-    def refresh_current_chat(self):
+    def refresh_current_chat(self, keep_bottom=True):
         """Refresh the current chat display"""
         self.messages_text.config(state="normal")
         self.messages_text.delete(1.0, tk.END)
         
+        # Line positions change on every repaint
+        self.file_links = {}
+        
         if self.current_chat in self.active_chats:
             for message in self.active_chats[self.current_chat]:
                 self.display_message(message)
         
         self.messages_text.config(state="disabled")
-        self.messages_text.see(tk.END)
+        if keep_bottom:
+            self.messages_text.see(tk.END)
+    
+    def show_prepended_history(self):
+        """Repaint after an older page arrived, keeping the visible messages in place"""
+        old_line_count = int(self.messages_text.index("end-1c").split('.')[0])
+        first_visible = self.messages_text.index("@0,0")
+        
+        self.refresh_current_chat(keep_bottom=False)
+        
+        added_lines = int(self.messages_text.index("end-1c").split('.')[0]) - old_line_count
+        first_line = int(first_visible.split('.')[0]) + added_lines
+        self.messages_text.yview(f"{first_line}.0")
     
     def update_users_list(self):
         """Update the users list display"""
@@ -932,23 +1108,37 @@ class ChatClient:
         if msg_type == 'session_created':
             if self.code_editor:
                 self.code_editor.session_id = data['session_id']
+                self.code_editor.sync.reset(data.get('version', 0))
                 self.code_editor.session_label.config(text=f"Session: {data['session_id']}")
                 self.code_editor.window.title(f"Code Editor - {data['language'].title()} - {data['session_id']}")
                 
         elif msg_type == 'session_joined':
             if self.code_editor:
                 self.code_editor.session_id = data['session_id']
-                self.code_editor.update_code(data['code'])
+                self.code_editor.load_document(data['code'], data.get('version', 0))
                 self.code_editor.update_participants(data['participants'])
                 self.code_editor.session_label.config(text=f"Session: {data['session_id']}")
                 
         elif msg_type == 'code_update':
             if self.code_editor and self.code_editor.session_id == data['session_id']:
-                self.code_editor.update_code(data['code'], data.get('user'))
+                self.code_editor.apply_remote_edit(data)
+                
+        elif msg_type == 'code_ack':
+            if self.code_editor and self.code_editor.session_id == data['session_id']:
+                self.code_editor.handle_code_ack(data)
+                
+        elif msg_type == 'code_resync':
+            if self.code_editor and self.code_editor.session_id == data['session_id']:
+                self.code_editor.load_document(data['code'], data['version'])
                 
         elif msg_type == 'execution_result':
             if self.code_editor and self.code_editor.session_id == data['session_id']:
-                self.code_editor.handle_execution_result(data['result'], data['executed_by'])
+                self.code_editor.handle_execution_result(data['result'], data['executed_by'], data.get('job_id'))
+                
+        elif msg_type in ('execution_queued', 'execution_started', 'execution_output',
+                          'execution_cancelled', 'execution_rejected'):
+            if self.code_editor and self.code_editor.session_id == data['session_id']:
+                getattr(self.code_editor, f"handle_{msg_type}")(data)
                 
         elif msg_type == 'user_joined':
             if self.code_editor:
@@ -0,0 +1,91 @@
+# client_registry.py - The set of connected clients, safe to share across threads
+#
+# ChatServer.clients used to be a plain dict written by every client handler
+# thread and iterated by broadcasts and by the HTTP file server's threads, so
+# a connect or disconnect during a broadcast could raise "dictionary changed
+# size during iteration". ClientRegistry splits the names over STRIPES shards.
+# Each shard is an immutable-by-convention dict that writers replace under
+# the shard's lock (copy-on-write), so:
+#
+# - lookups are a hash, a shard pick and a dict read, with no lock taken;
+# - iteration walks the shards' current dicts and never blocks, or is
+#   blocked by, a connect or disconnect;
+# - a connect or disconnect copies one shard (about 1/STRIPES of the clients)
+#   and only contends with writers of the same shard.
+#
+# Entries are (connection, client_address) tuples, as in the old dict.
+import threading
+
+STRIPES = 16
+
+
+class ClientRegistry:
+    """Connected clients by name: lock-striped writes, lock-free reads"""
+
+    def __init__(self, stripes=STRIPES):
+        self.locks = [threading.Lock() for _ in range(stripes)]
+        self.shards = [{} for _ in range(stripes)]
+
+    def _stripe(self, name):
+        return hash(name) % len(self.shards)
+
+    # --- writes ---------------------------------------------------------------
+
+    def add(self, name, connection, client_address):
+        """Register a client; False if the name is already taken"""
+        stripe = self._stripe(name)
+        with self.locks[stripe]:
+            shard = self.shards[stripe]
+            if name in shard:
+                return False
+            updated = dict(shard)
+            updated[name] = (connection, client_address)
+            self.shards[stripe] = updated
+            return True
+
+    def remove(self, name, connection=None):
+        """Unregister a client (only if still bound to connection, when given); True if removed"""
+        stripe = self._stripe(name)
+        with self.locks[stripe]:
+            shard = self.shards[stripe]
+            entry = shard.get(name)
+            if entry is None or (connection is not None and entry[0] is not connection):
+                return False
+            updated = dict(shard)
+            del updated[name]
+            self.shards[stripe] = updated
+            return True
+
+    # --- reads (no locks) -----------------------------------------------------
+
+    def get(self, name, default=None):
+        return self.shards[self._stripe(name)].get(name, default)
+
+    def __getitem__(self, name):
+        return self.shards[self._stripe(name)][name]
+
+    def __contains__(self, name):
+        return name in self.shards[self._stripe(name)]
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def items(self):
+        """Snapshot list of (name, (connection, client_address))"""
+        items = []
+        for shard in list(self.shards):
+            items.extend(shard.items())
+        return items
+
+    def keys(self):
+        """Snapshot list of connected names"""
+        names = []
+        for shard in list(self.shards):
+            names.extend(shard)
+        return names
+
+    def values(self):
+        return [entry for _, entry in self.items()]
+
+    def __iter__(self):
+        return iter(self.keys())
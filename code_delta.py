@@ -0,0 +1,56 @@
+# code_delta.py - Edit operations for the collaborative code editor
+#
+# CODE_UPDATE messages carry the edits a keystroke made instead of the whole
+# document: a list of {"pos", "delete", "insert"} operations, each removing
+# `delete` characters at character offset `pos` and inserting `insert` there.
+# Operations in one list apply in order, each to the result of the previous.
+# The server keeps the canonical document and a version number that goes up
+# by one per accepted update; an update names the version it was made
+# against, so a client that fell behind is sent the full document again.
+
+
+def diff_edit(old, new):
+    """The single replace operation turning old into new, as an ops list.
+
+    Keeps the common prefix and suffix, which is exact for one keystroke,
+    a paste or a selection replaced. Returns [] if nothing changed.
+    """
+    if old == new:
+        return []
+    limit = min(len(old), len(new))
+    start = 0
+    while start < limit and old[start] == new[start]:
+        start += 1
+    end = 0
+    while end < limit - start and old[-1 - end] == new[-1 - end]:
+        end += 1
+    return [{'pos': start, 'delete': len(old) - start - end, 'insert': new[start:len(new) - end]}]
+
+
+def validate_edits(ops):
+    """Check the shape of an ops list from the network; raises ValueError"""
+    if not isinstance(ops, list):
+        raise ValueError("ops must be a list")
+    for op in ops:
+        if not isinstance(op, dict):
+            raise ValueError("op must be an object")
+        pos, delete, insert = op.get('pos'), op.get('delete', 0), op.get('insert', '')
+        if not isinstance(pos, int) or not isinstance(delete, int) or not isinstance(insert, str):
+            raise ValueError(f"malformed op {op!r}")
+        if pos < 0 or delete < 0:
+            raise ValueError(f"negative position in op {op!r}")
+
+
+def apply_edits(text, ops):
+    """Apply an ops list to text; raises ValueError if an op is out of range"""
+    for op in ops:
+        pos, delete, insert = op['pos'], op.get('delete', 0), op.get('insert', '')
+        if pos + delete > len(text):
+            raise ValueError(f"op {op!r} is past the end of a {len(text)} character document")
+        text = text[:pos] + insert + text[pos + delete:]
+    return text
+
+
+def edit_size(ops):
+    """Characters an ops list removes plus characters it inserts"""
+    return sum(op.get('delete', 0) + len(op.get('insert', '')) for op in ops)
@@ -4,6 +4,7 @@ from tkinter import ttk, messagebox, simpledialog
 import json
 import threading
 import time
+from ot import ClientSync, TextOperation
 
 class ModernStyle:
     BG_COLOR = "#1e1e1e"
@@ -29,8 +30,11 @@ class CodeEditorWindow:
         self.session_id = session_id
         self.language = language
         self.participants = []
-        self.last_code = ""
+        self.last_code = ""  # the document including every edit already handed to self.sync
+        self.sync = ClientSync()  # server version, plus our edits it has not confirmed
         self.update_lock = threading.Lock()
+        self.current_job_id = None  # our own queued or running execution
+        self.streamed = {}  # {job_id: {stream: characters shown}} for runs with live output
         
         self.create_window()
         
@@ -93,6 +97,17 @@ class CodeEditorWindow:
                                command=self.run_code)
         self.run_btn.pack(side="right", padx=2)
         
+        # Stop button (cancels our queued or running execution)
+        self.stop_btn = tk.Button(buttons_frame, text="■ Stop",
+                                font=("Arial", 10, "bold"),
+                                bg=ModernStyle.DANGER_COLOR,
+                                fg=ModernStyle.TEXT_COLOR,
+                                relief="flat", bd=0, padx=15, pady=5,
+                                cursor="hand2",
+                                state="disabled",
+                                command=self.stop_code)
+        self.stop_btn.pack(side="right", padx=2)
+        
         # Invite button
         self.invite_btn = tk.Button(buttons_frame, text="👥 Invite",
                                   font=("Arial", 10),
@@ -240,28 +255,46 @@ class CodeEditorWindow:
         self.line_numbers.insert("1.0", line_numbers_text)
         self.line_numbers.config(state="disabled")
     
+    def document_text(self):
+        """The editor contents without the newline Tk always keeps at the end"""
+        return self.code_editor.get("1.0", "end-1c")
+    
     def on_code_change(self, event=None):
-        """Handle code changes"""
-        current_code = self.code_editor.get("1.0", tk.END)
-        
+        """Send the edits made since the last update"""
         # Update line numbers
         self.update_line_numbers()
         
-        # Send update if code changed
-        if current_code != self.last_code and self.session_id:
-            with self.update_lock:
-                self.last_code = current_code
-                
-                # Get cursor position
-                cursor_pos = self.code_editor.index(tk.INSERT)
-                
-                update_data = {
-                    'session_id': self.session_id,
-                    'code': current_code,
-                    'cursor_pos': cursor_pos
-                }
-                
-                self.client.send_to_server(f"CODE_UPDATE|{json.dumps(update_data)}")
+        if not self.session_id:
+            return
+        with self.update_lock:
+            current_code = self.document_text()
+            if current_code == self.last_code:
+                return
+            operation = TextOperation.diff(self.last_code, current_code)
+            self.last_code = current_code
+            
+            # Only one edit is in flight at a time; later ones wait for the ack
+            outgoing = self.sync.local(operation)
+            if outgoing is not None:
+                self.send_operation(outgoing)
+    
+    def send_operation(self, operation):
+        update_data = {
+            'session_id': self.session_id,
+            'version': self.sync.revision,
+            'op': operation.to_json(),
+            'cursor_pos': self.code_editor.index(tk.INSERT)
+        }
+        self.client.send_to_server(f"CODE_UPDATE|{json.dumps(update_data)}")
+    
+    def handle_code_ack(self, data):
+        """The server merged our edit; send what was typed meanwhile"""
+        with self.update_lock:
+            if data['version'] <= self.sync.revision:
+                return  # already part of a document we loaded
+            outgoing = self.sync.acknowledge()
+            if outgoing is not None:
+                self.send_operation(outgoing)
     
     def start_update_checker(self):
         """Start a thread to check for updates"""
@@ -273,16 +306,13 @@ class CodeEditorWindow:
         update_thread.daemon = True
         update_thread.start()
     
-    def update_code(self, new_code, sender=None):
-        """Update code from remote source"""
-        if sender == self.client.username:
-            return  # Don't update from own changes
-        
+    def load_document(self, code, version):
+        """Replace the editor contents with the server's document"""
         with self.update_lock:
             current_pos = self.code_editor.index(tk.INSERT)
             
             self.code_editor.delete("1.0", tk.END)
-            self.code_editor.insert("1.0", new_code)
+            self.code_editor.insert("1.0", code)
             
             # Try to restore cursor position
             try:
@@ -290,7 +320,40 @@ class CodeEditorWindow:
             except:
                 pass
             
-            self.last_code = new_code
+            self.last_code = code
+            self.sync.reset(version)
+            self.update_line_numbers()
+    
+    def apply_remote_edit(self, data):
+        """Merge other participants' edits in place, keeping our cursor and selection"""
+        # Pick up keystrokes not seen by on_code_change yet, so the
+        # transforms below account for them
+        self.on_code_change()
+        
+        with self.update_lock:
+            # data['ops'] are consecutive versions ending at data['version']
+            first_version = data['version'] - len(data['ops']) + 1
+            combined = None
+            try:
+                for version, wire in enumerate(data['ops'], first_version):
+                    if version <= self.sync.revision:
+                        continue  # already part of a document we loaded
+                    operation = self.sync.remote(TextOperation.from_json(wire))
+                    combined = operation if combined is None else combined.compose(operation)
+                if combined is None:
+                    return
+                code = combined.apply(self.last_code)
+            except ValueError:
+                return  # cannot happen unless we diverged; the next edit resyncs us
+            
+            for edit in combined.to_edits():
+                start = f"1.0 + {edit['pos']} chars"
+                if edit['delete']:
+                    self.code_editor.delete(start, f"1.0 + {edit['pos'] + edit['delete']} chars")
+                if edit['insert']:
+                    self.code_editor.insert(start, edit['insert'])
+            
+            self.last_code = code
             self.update_line_numbers()
     
     def update_participants(self, participants):
@@ -323,14 +386,78 @@ class CodeEditorWindow:
         
         self.client.send_to_server(f"EXECUTE_CODE|{json.dumps(exec_data)}")
         
-        # Show "Running..." in output
-        self.add_output("Running code...\n", "info")
+        # The server answers with execution_queued, then execution_started
+        self.add_output("Submitting code...\n", "info")
+    
+    def stop_code(self):
+        """Cancel our queued or running execution"""
+        if self.current_job_id is None:
+            return
+        cancel_data = {
+            'session_id': self.session_id,
+            'job_id': self.current_job_id
+        }
+        self.client.send_to_server(f"CANCEL_EXECUTION|{json.dumps(cancel_data)}")
+        self.stop_btn.config(state="disabled")
+    
+    def track_job(self, job_id, executed_by):
+        """Remember the job id of our own submission so Stop can cancel it"""
+        if executed_by == self.client.username:
+            self.current_job_id = job_id
+            self.stop_btn.config(state="normal")
     
-    def handle_execution_result(self, result, executed_by):
+    def finish_job(self, job_id):
+        if job_id == self.current_job_id:
+            self.current_job_id = None
+            self.stop_btn.config(state="disabled")
+    
+    def handle_execution_queued(self, data):
+        """Show where a run is waiting in the execution queue"""
+        self.track_job(data['job_id'], data['executed_by'])
+        self.add_output(f"⏳ Run by {data['executed_by']} queued (position {data['position']})\n", "info")
+    
+    def handle_execution_started(self, data):
+        self.track_job(data['job_id'], data['executed_by'])
+        self.add_output(f"▶ Running code by {data['executed_by']}...\n", "info")
+    
+    def handle_execution_cancelled(self, data):
+        self.finish_job(data['job_id'])
+        self.add_output(f"■ Run by {data['executed_by']} cancelled by {data['cancelled_by']} before it started\n", "info")
+    
+    def handle_execution_rejected(self, data):
+        self.add_output(f"❌ {data['reason']}\n", "error")
+    
+    def handle_execution_output(self, data):
+        """Show output of a run while it is still going"""
+        shown = self.streamed.get(data['job_id'])
+        if shown is None:
+            shown = self.streamed[data['job_id']] = {'stdout': 0, 'stderr': 0}
+            self.add_output(f"\n--- Output of run by {data['executed_by']} ---\n", "info")
+        self.add_output(data['data'], "success" if data['stream'] == 'stdout' else "error")
+        shown[data['stream']] = data['offset'] + len(data['data'])
+    
+    def handle_execution_result(self, result, executed_by, job_id=None):
         """Handle code execution result"""
+        self.finish_job(job_id)
+        shown = self.streamed.pop(job_id, None)
+        if shown is not None:
+            # Most of the output was shown live; print what was held back
+            self.add_output(result.get('output', '')[shown['stdout']:], "success")
+            self.add_output(result.get('error', '')[shown['stderr']:], "error")
+            if result.get('exit_reason') == 'cancelled':
+                self.add_output("\n■ Execution cancelled\n", "error")
+            elif result.get('success'):
+                self.add_output("\n✅ Execution successful\n", "success")
+            else:
+                self.add_output(f"\n❌ Execution failed (exit code {result.get('return_code')})\n", "error")
+            self.add_execution_footer(result)
+            return
+        
         self.add_output(f"\n--- Execution by {executed_by} ---\n", "info")
         
-        if result.get('success'):
+        if result.get('exit_reason') == 'cancelled':
+            self.add_output("■ Execution cancelled\n", "error")
+        elif result.get('success'):
             self.add_output("✅ Execution successful\n", "success")
             if result.get('output'):
                 self.add_output("Output:\n", "info")
@@ -341,8 +468,17 @@ class CodeEditorWindow:
                 self.add_output("Error:\n", "info")
                 self.add_output(result['error'], "error")
         
+        self.add_execution_footer(result)
+    
+    def add_execution_footer(self, result):
         execution_time = result.get('execution_time', 0)
-        self.add_output(f"\nExecution time: {execution_time:.2f}s\n", "info")
+        build_note = " (cached build)" if result.get('cached_build') else ""
+        usage = ""
+        if result.get('cpu_time') is not None:
+            usage += f", CPU {result['cpu_time']:.2f}s"
+        if result.get('peak_rss'):
+            usage += f", peak memory {result['peak_rss'] / 1048576:.1f} MB"
+        self.add_output(f"\nExecution time: {execution_time:.2f}s{usage}{build_note}\n", "info")
         self.add_output("-" * 40 + "\n", "info")
     
     def add_output(self, text, tag=""):
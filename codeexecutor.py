@@ -1,9 +1,26 @@
 # codeexecutor.py
 import subprocess
 import tempfile
+import threading
 import os
+import shutil
 import json
+import re
+import selectors
+import sys
+import time
 from datetime import datetime
+from compile_cache import CompileCache, DEFAULT_CACHE_DIR, build_key
+from interpreter_pool import InterpreterPool
+from execution_output import OutputCollector
+from sandbox import (EXIT_MESSAGES, MB, RunCgroup, cgroup_available, exit_reason, kill_process_group,
+                     log_sandbox, make_preexec, merge_limits, out_of_memory, signal_name)
+
+READ_SIZE = 64 * 1024
+
+# Java's public class must live in a file of the same name
+JAVA_PUBLIC_CLASS = re.compile(r'\bpublic\s+(?:(?:final|abstract|static)\s+)*class\s+(\w+)')
+JAVA_CLASS = re.compile(r'\bclass\s+(\w+)')
 
 class CodeExecutor:
     """Code execution engine for various programming languages"""
@@ -12,36 +29,125 @@ class CodeExecutor:
         'python': {
             'extension': '.py',
             'command': ['python'],
-            'timeout': 30
+            'timeout': 30,
+            'limits': {}
         },
         'javascript': {
             'extension': '.js',
             'command': ['node'],
-            'timeout': 30
+            'timeout': 30,
+            # V8 reserves a large virtual heap up front
+            'limits': {'address_space_bytes': 4096 * MB}
         },
         'java': {
             'extension': '.java',
             'command': ['javac', '{file}', '&&', 'java', '{classname}'],
             'timeout': 45,
-            'compile_first': True
+            'compile_first': True,
+            'compiler': 'javac',
+            'compile_flags': [],
+            # The JVM reserves address space for its heap and code cache, and
+            # counts its threads against the process limit
+            'limits': {'address_space_bytes': None, 'max_processes': 128},
+            'run_flags': ['-Xmx256m', '-Xss8m']
         },
         'cpp': {
             'extension': '.cpp',
             'command': ['g++', '{file}', '-o', '{output}', '&&', '{output}'],
             'timeout': 45,
-            'compile_first': True
+            'compile_first': True,
+            'compiler': 'g++',
+            'compile_flags': [],
+            'limits': {}
         },
         'c': {
             'extension': '.c',
             'command': ['gcc', '{file}', '-o', '{output}', '&&', '{output}'],
             'timeout': 45,
-            'compile_first': True
+            'compile_first': True,
+            'compiler': 'gcc',
+            'compile_flags': [],
+            'limits': {}
         }
     }
     
+    # Compilers get more room than programs; language limits still apply on top
+    COMPILE_LIMITS = {'cpu_seconds': 30, 'memory_bytes': 1024 * MB, 'address_space_bytes': 2048 * MB}
+    
+    # Delegated cgroup v2 directory for per-run cgroups; see use_cgroup()
+    cgroup_parent = None
+    
+    # Builds of C, C++ and Java code, shared by all sessions
+    compile_cache = None
+    compile_cache_dir = None  # see use_compile_cache_dir()
+    compile_cache_lock = threading.Lock()
+    
+    # Warm Python/Node.js workers, once start_interpreter_pools() has run
+    interpreter_pools = {}
+    
+    @classmethod
+    def use_cgroup(cls, parent):
+        """Put each run in its own cgroup under parent; returns False if parent is unusable"""
+        if not cgroup_available(parent):
+            log_sandbox(f"{parent} is not a writable cgroup v2 directory with memory and pids "
+                        f"controllers enabled; using rlimits only", "WARN")
+            return False
+        cls.cgroup_parent = parent
+        log_sandbox(f"Runs get their own cgroup under {parent}")
+        return True
+    
+    @classmethod
+    def use_compile_cache_dir(cls, path):
+        """Keep compiled programs under path (a private directory) instead of the default"""
+        with cls.compile_cache_lock:
+            cls.compile_cache_dir = path
+    
+    @classmethod
+    def close_compile_cache(cls):
+        with cls.compile_cache_lock:
+            if cls.compile_cache is not None:
+                cls.compile_cache.close()
+                cls.compile_cache = None
+    
+    @classmethod
+    def run_limits(cls, language):
+        return merge_limits(cls.SUPPORTED_LANGUAGES[language]['limits'])
+    
+    @classmethod
+    def compile_limits(cls, language):
+        return merge_limits(cls.COMPILE_LIMITS, cls.SUPPORTED_LANGUAGES[language]['limits'])
+    
+    @classmethod
+    def start_interpreter_pools(cls, size):
+        """Pre-start size workers per interpreted language; runs fall back to a fresh process without them"""
+        for language in ('python', 'javascript'):
+            if language not in cls.interpreter_pools and InterpreterPool.available(language):
+                pool = InterpreterPool(language, size, cls.run_limits(language), cls.cgroup_parent)
+                pool.warm_up()
+                cls.interpreter_pools[language] = pool
+    
+    @classmethod
+    def shutdown_interpreter_pools(cls):
+        for pool in cls.interpreter_pools.values():
+            pool.shutdown()
+        cls.interpreter_pools = {}
+    
+    @classmethod
+    def get_compile_cache(cls):
+        with cls.compile_cache_lock:
+            if cls.compile_cache is None:
+                cls.compile_cache = CompileCache(cls.compile_cache_dir or DEFAULT_CACHE_DIR)
+            return cls.compile_cache
+    
     @classmethod
-    def execute_code(cls, code, language, input_data=""):
-        """Execute code in the specified language"""
+    def execute_code(cls, code, language, input_data="", job=None, on_output=None):
+        """Execute code in the specified language.
+        
+        job, if given, is told about every child process started for the run
+        (see ExecutionJob.attach_process) so the run can be cancelled.
+        on_output(stream, text), if given, receives the program's output
+        while it runs; the result still carries all of it (up to the cap).
+        """
         if language not in cls.SUPPORTED_LANGUAGES:
             return {
                 'success': False,
@@ -55,6 +161,18 @@ class CodeExecutor:
         try:
             start_time = datetime.now()
             
+            if lang_config.get('compile_first'):
+                # Built into the compile cache rather than a temp source file
+                result = cls._execute_built(code, language, input_data, lang_config, job, on_output)
+                result['execution_time'] = (datetime.now() - start_time).total_seconds()
+                return result
+            
+            pool = cls.interpreter_pools.get(language)
+            if pool is not None:
+                result = cls._execute_pooled(pool, code, input_data, lang_config['timeout'], job, on_output)
+                result['execution_time'] = (datetime.now() - start_time).total_seconds()
+                return result
+            
             # Create temporary file
             with tempfile.NamedTemporaryFile(
                 mode='w',
@@ -67,13 +185,9 @@ class CodeExecutor:
             
             try:
                 if language == 'python':
-                    result = cls._execute_python(temp_file_path, input_data, lang_config['timeout'])
+                    result = cls._execute_python(temp_file_path, input_data, lang_config['timeout'], job, on_output)
                 elif language == 'javascript':
-                    result = cls._execute_javascript(temp_file_path, input_data, lang_config['timeout'])
-                elif language == 'java':
-                    result = cls._execute_java(temp_file_path, input_data, lang_config['timeout'])
-                elif language in ['cpp', 'c']:
-                    result = cls._execute_compiled(temp_file_path, language, input_data, lang_config['timeout'])
+                    result = cls._execute_javascript(temp_file_path, input_data, lang_config['timeout'], job, on_output)
                 else:
                     result = {
                         'success': False,
@@ -103,51 +217,214 @@ class CodeExecutor:
             }
     
     @classmethod
-    def _execute_python(cls, file_path, input_data, timeout):
-        """Execute Python code"""
+    def _run_process(cls, args, input_data=None, timeout=30, cwd=None, job=None, on_output=None, limits=None):
+        """Run one child process to completion and describe how it ended.
+        
+        Output is read from the pipes as the program writes it and passed to
+        on_output(stream, text); at most MAX_OUTPUT_SIZE characters are kept,
+        and the program is stopped once it prints more. The child runs in its
+        own session under limits (see sandbox.DEFAULT_LIMITS), in a per-run
+        cgroup when cgroup_parent is set.
+        """
+        process = None
+        cgroup = None
+        output = OutputCollector(on_output)
+        limits = limits or merge_limits()
+        reason = None
+        rusage = None
         try:
+            cgroup = cls._create_cgroup(limits)
             process = subprocess.Popen(
-                ['python', file_path],
-                stdin=subprocess.PIPE,
+                args,
+                stdin=subprocess.PIPE if input_data is not None else subprocess.DEVNULL,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
-                text=True,
-                cwd=os.path.dirname(file_path)
+                cwd=cwd,
+                **cls._sandbox_options(limits, cgroup)
             )
+            if job is not None:
+                job.attach_process(process)
+            if input_data is not None:
+                # A thread, so a program that prints before reading cannot deadlock us
+                threading.Thread(target=cls._feed_stdin, args=(process.stdin, input_data),
+                                 daemon=True).start()
             
-            stdout, stderr = process.communicate(input=input_data, timeout=timeout)
+            deadline = time.monotonic() + timeout
+            reason = cls._drain_output(process, output, deadline)
+            if reason is not None:
+                kill_process_group(process)
+            reason, rusage = cls._reap(process, deadline, reason)
             
-            return {
-                'success': process.returncode == 0,
-                'output': stdout,
-                'error': stderr,
-                'return_code': process.returncode
-            }
-            
-        except subprocess.TimeoutExpired:
-            process.kill()
-            return {
-                'success': False,
-                'output': '',
-                'error': 'Execution timed out',
-                'return_code': -1
-            }
         except Exception as e:
+            if process is not None and process.poll() is None:
+                kill_process_group(process)
             return {
                 'success': False,
-                'output': '',
+                'output': output.text('stdout'),
                 'error': str(e),
-                'return_code': -1
+                'return_code': -1,
+                'exit_reason': 'error'
             }
+        finally:
+            if process is not None:
+                # Leftover background processes of the program go too
+                kill_process_group(process)
+                for pipe in (process.stdout, process.stderr):
+                    pipe.close()
+            if job is not None:
+                job.detach_process(process)
+            cgroup_stats = cgroup.stats() if cgroup is not None else {}
+            if cgroup is not None:
+                cgroup.close()
+        
+        return cls._process_result(process, output, reason, limits, rusage, cgroup_stats,
+                                   cancelled=job is not None and job.cancelled)
     
     @classmethod
-    def _execute_javascript(cls, file_path, input_data, timeout):
-        """Execute JavaScript code"""
+    def _create_cgroup(cls, limits):
+        if cls.cgroup_parent is None:
+            return None
         try:
-            # For Node.js, we need to modify the code to handle input
-            if input_data:
-                # Create a wrapper that provides input via process.stdin
-                wrapper_code = f"""
+            return RunCgroup(cls.cgroup_parent, limits)
+        except OSError as e:
+            log_sandbox(f"Running without a cgroup: {e}", "WARN")
+            return None
+    
+    @staticmethod
+    def _sandbox_options(limits, cgroup=None):
+        if os.name == 'nt':
+            return {}
+        return {'start_new_session': True, 'preexec_fn': make_preexec(limits, cgroup)}
+    
+    @staticmethod
+    def _reap(process, deadline, reason):
+        """Wait for the child, collecting its resource usage; returns (reason, rusage).
+        
+        A child that closed its output but keeps running is killed at the deadline.
+        """
+        if not hasattr(os, 'wait4'):
+            try:
+                process.wait(max(deadline - time.monotonic(), 0) if reason is None else None)
+            except subprocess.TimeoutExpired:
+                kill_process_group(process)
+                process.wait()
+                reason = 'timeout'
+            return reason, None
+        
+        delay = 0.0005
+        while True:
+            try:
+                pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+            except ChildProcessError:
+                # Reaped by Popen.poll() elsewhere (e.g. a cancel); no usage figures then
+                process.wait()
+                return reason, None
+            if pid:
+                process.returncode = os.waitstatus_to_exitcode(status)
+                return reason, rusage
+            if reason is None and time.monotonic() >= deadline:
+                kill_process_group(process)
+                reason = 'timeout'
+            time.sleep(delay)
+            delay = min(delay * 2, 0.01)
+    
+    @staticmethod
+    def _process_result(process, output, reason, limits, rusage, cgroup_stats, cancelled=False):
+        cpu_time = cgroup_stats.get('cpu_time')
+        peak_rss = cgroup_stats.get('peak_rss')
+        if rusage is not None:
+            if cpu_time is None:
+                cpu_time = rusage.ru_utime + rusage.ru_stime
+            if peak_rss is None:
+                # ru_maxrss is in kilobytes on Linux, bytes on macOS
+                peak_rss = rusage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        
+        error = output.text('stderr')
+        if cancelled:
+            reason = 'cancelled'
+        elif reason is None:
+            reason = exit_reason(process.returncode, limits, cpu_time, cgroup_stats.get('oom_killed'),
+                                 memory_error=out_of_memory(error))
+        
+        if reason in EXIT_MESSAGES:
+            error += EXIT_MESSAGES[reason]
+        elif reason == 'signal':
+            error += f"Killed by {signal_name(process.returncode)}"
+        
+        return {
+            'success': reason == 'exited' and process.returncode == 0,
+            'output': output.text('stdout'),
+            'error': error,
+            # -1 keeps meaning "did not run to completion" for callers like the compile step
+            'return_code': -1 if reason in ('timeout', 'cancelled', 'output_limit') else process.returncode,
+            'exit_reason': reason,
+            'cpu_time': round(cpu_time, 3) if cpu_time is not None else None,
+            'peak_rss': peak_rss
+        }
+    
+    @staticmethod
+    def _feed_stdin(pipe, input_data):
+        try:
+            pipe.write(input_data.encode('utf-8'))
+        except OSError:
+            pass  # the program exited without reading all of it
+        finally:
+            try:
+                pipe.close()
+            except OSError:
+                pass
+    
+    @staticmethod
+    def _drain_output(process, output, deadline):
+        """Read stdout/stderr until both close.
+        
+        Returns None, or 'timeout' / 'output_limit' if the program has to be stopped.
+        """
+        streams = {process.stdout.fileno(): 'stdout', process.stderr.fileno(): 'stderr'}
+        with selectors.DefaultSelector() as selector:
+            for fd in streams:
+                selector.register(fd, selectors.EVENT_READ)
+            while streams:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return 'timeout'
+                for key, _ in selector.select(remaining):
+                    data = os.read(key.fd, READ_SIZE)
+                    output.add_bytes(streams[key.fd], data)
+                    if not data:
+                        selector.unregister(key.fd)
+                        del streams[key.fd]
+                if output.truncated:
+                    return 'output_limit'
+        return None
+    
+    @classmethod
+    def _execute_pooled(cls, pool, code, input_data, timeout, job=None, on_output=None):
+        """Run Python/JavaScript code on a warm interpreter worker"""
+        run_dir = tempfile.mkdtemp(prefix='devconnect_run_')
+        try:
+            return pool.run(code, input_data, run_dir, timeout, job=job, on_output=on_output)
+        finally:
+            shutil.rmtree(run_dir, ignore_errors=True)
+    
+    @classmethod
+    def _execute_python(cls, file_path, input_data, timeout, job=None, on_output=None):
+        """Execute Python code"""
+        return cls._run_process(['python', '-u', file_path], input_data, timeout,
+                                cwd=os.path.dirname(file_path), job=job, on_output=on_output,
+                                limits=cls.run_limits('python'))
+    
+    @classmethod
+    def _execute_javascript(cls, file_path, input_data, timeout, job=None, on_output=None):
+        """Execute JavaScript code"""
+        if not input_data:
+            return cls._run_process(['node', file_path], None, timeout,
+                                    cwd=os.path.dirname(file_path), job=job, on_output=on_output,
+                                    limits=cls.run_limits('javascript'))
+        
+        # For Node.js, we need to modify the code to handle input
+        # Create a wrapper that provides input via process.stdin
+        wrapper_code = f"""
 const originalCode = require('fs').readFileSync('{file_path}', 'utf8');
 const inputData = `{input_data}`;
 
@@ -163,207 +440,92 @@ global.prompt = function(text) {{
 // Execute the original code
 eval(originalCode);
 """
-                with tempfile.NamedTemporaryFile(mode='w', suffix='.js', delete=False) as wrapper_file:
-                    wrapper_file.write(wrapper_code)
-                    wrapper_path = wrapper_file.name
-                
-                process = subprocess.Popen(
-                    ['node', wrapper_path],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True
-                )
-                
-                try:
-                    os.unlink(wrapper_path)
-                except:
-                    pass
-            else:
-                process = subprocess.Popen(
-                    ['node', file_path],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    cwd=os.path.dirname(file_path)
-                )
-            
-            stdout, stderr = process.communicate(timeout=timeout)
-            
-            return {
-                'success': process.returncode == 0,
-                'output': stdout,
-                'error': stderr,
-                'return_code': process.returncode
-            }
-            
-        except subprocess.TimeoutExpired:
-            process.kill()
-            return {
-                'success': False,
-                'output': '',
-                'error': 'Execution timed out',
-                'return_code': -1
-            }
-        except Exception as e:
-            return {
-                'success': False,
-                'output': '',
-                'error': str(e),
-                'return_code': -1
-            }
-    
-    @classmethod
-    def _execute_java(cls, file_path, input_data, timeout):
-        """Execute Java code"""
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.js', delete=False) as wrapper_file:
+            wrapper_file.write(wrapper_code)
+            wrapper_path = wrapper_file.name
+        
         try:
-            # Extract class name from file
-            dir_path = os.path.dirname(file_path)
-            filename = os.path.basename(file_path)
-            class_name = filename[:-5]  # Remove .java extension
-            
-            # Compile
-            compile_process = subprocess.Popen(
-                ['javac', file_path],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                cwd=dir_path
-            )
-            
-            compile_stdout, compile_stderr = compile_process.communicate(timeout=timeout)
-            
-            if compile_process.returncode != 0:
-                return {
-                    'success': False,
-                    'output': compile_stdout,
-                    'error': f'Compilation error: {compile_stderr}',
-                    'return_code': compile_process.returncode
-                }
-            
-            # Run
-            run_process = subprocess.Popen(
-                ['java', class_name],
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                cwd=dir_path
-            )
-            
-            stdout, stderr = run_process.communicate(input=input_data, timeout=timeout)
-            
-            # Clean up class file
-            try:
-                os.unlink(os.path.join(dir_path, f'{class_name}.class'))
-            except:
-                pass
-            
-            return {
-                'success': run_process.returncode == 0,
-                'output': stdout,
-                'error': stderr,
-                'return_code': run_process.returncode
-            }
-            
-        except subprocess.TimeoutExpired:
-            try:
-                compile_process.kill()
-            except:
-                pass
+            return cls._run_process(['node', wrapper_path], None, timeout, job=job, on_output=on_output,
+                                    limits=cls.run_limits('javascript'))
+        finally:
             try:
-                run_process.kill()
+                os.unlink(wrapper_path)
             except:
                 pass
-            return {
-                'success': False,
-                'output': '',
-                'error': 'Execution timed out',
-                'return_code': -1
-            }
-        except Exception as e:
-            return {
-                'success': False,
-                'output': '',
-                'error': str(e),
-                'return_code': -1
-            }
     
     @classmethod
-    def _execute_compiled(cls, file_path, language, input_data, timeout):
-        """Execute C/C++ code"""
-        try:
-            dir_path = os.path.dirname(file_path)
-            filename = os.path.basename(file_path)
-            executable_name = filename[:filename.rfind('.')] + '.exe' if os.name == 'nt' else filename[:filename.rfind('.')]
-            executable_path = os.path.join(dir_path, executable_name)
-            
-            # Compile
-            compiler = 'g++' if language == 'cpp' else 'gcc'
-            compile_process = subprocess.Popen(
-                [compiler, file_path, '-o', executable_path],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                cwd=dir_path
-            )
-            
-            compile_stdout, compile_stderr = compile_process.communicate(timeout=timeout)
-            
-            if compile_process.returncode != 0:
-                return {
-                    'success': False,
-                    'output': compile_stdout,
-                    'error': f'Compilation error: {compile_stderr}',
-                    'return_code': compile_process.returncode
-                }
-            
-            # Run
-            run_process = subprocess.Popen(
-                [executable_path],
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                cwd=dir_path
-            )
-            
-            stdout, stderr = run_process.communicate(input=input_data, timeout=timeout)
-            
-            # Clean up executable
-            try:
-                os.unlink(executable_path)
-            except:
-                pass
-            
-            return {
-                'success': run_process.returncode == 0,
-                'output': stdout,
-                'error': stderr,
-                'return_code': run_process.returncode
-            }
-            
-        except subprocess.TimeoutExpired:
-            try:
-                compile_process.kill()
-            except:
-                pass
+    def _execute_built(cls, code, language, input_data, lang_config, job=None, on_output=None):
+        """Compile (or reuse a cached build of) C/C++/Java code, then run it"""
+        timeout = lang_config['timeout']
+        compiler = lang_config['compiler']
+        flags = lang_config['compile_flags']
+        cache = cls.get_compile_cache()
+        key = build_key(language, compiler, flags, code)
+        
+        artifact_dir = cache.acquire(key)
+        cached = artifact_dir is not None
+        if not cached:
+            staging_dir = cache.staging_dir()
             try:
-                run_process.kill()
-            except:
-                pass
-            return {
-                'success': False,
-                'output': '',
-                'error': 'Execution timed out',
-                'return_code': -1
-            }
-        except Exception as e:
-            return {
-                'success': False,
-                'output': '',
-                'error': str(e),
-                'return_code': -1
-            }
+                if language == 'java':
+                    compile_result = cls._compile_java(code, staging_dir, flags, timeout, job)
+                else:
+                    compile_result = cls._compile_native(code, language, compiler, staging_dir, flags, timeout, job)
+                if compile_result['return_code'] != 0:
+                    if compile_result['return_code'] == -1:  # timed out, cancelled or failed to start
+                        return compile_result
+                    compile_result['error'] = f"Compilation error: {compile_result['error']}"
+                    return compile_result
+                artifact_dir = cache.store(key, os.path.join(staging_dir, 'build'))
+            finally:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+        
+        # Run from a scratch directory so programs that write files stay out of the cache
+        run_dir = tempfile.mkdtemp(prefix='devconnect_run_')
+        try:
+            if language == 'java':
+                args = ['java', *lang_config['run_flags'], '-cp', artifact_dir, cls._java_main_class(code)]
+            else:
+                args = [os.path.join(artifact_dir, cls._executable_name())]
+            result = cls._run_process(args, input_data, timeout, cwd=run_dir, job=job, on_output=on_output,
+                                      limits=cls.run_limits(language))
+            result['cached_build'] = cached
+            return result
+        finally:
+            cache.release(key)
+            shutil.rmtree(run_dir, ignore_errors=True)
+    
+    @staticmethod
+    def _java_main_class(code):
+        """The public class if there is one, else the first class declared"""
+        match = JAVA_PUBLIC_CLASS.search(code) or JAVA_CLASS.search(code)
+        return match.group(1) if match else 'Main'
+    
+    @staticmethod
+    def _executable_name():
+        return 'program.exe' if os.name == 'nt' else 'program'
+    
+    @classmethod
+    def _compile_java(cls, code, staging_dir, flags, timeout, job=None):
+        """Compile Java code into staging_dir/build"""
+        source_path = os.path.join(staging_dir, f'{cls._java_main_class(code)}.java')
+        with open(source_path, 'w', encoding='utf-8') as source_file:
+            source_file.write(code)
+        build_dir = os.path.join(staging_dir, 'build')
+        os.makedirs(build_dir)
+        return cls._run_process(['javac', *flags, '-d', build_dir, source_path], None, timeout,
+                                cwd=staging_dir, job=job, limits=cls.compile_limits('java'))
+    
+    @classmethod
+    def _compile_native(cls, code, language, compiler, staging_dir, flags, timeout, job=None):
+        """Compile C/C++ code into staging_dir/build"""
+        source_path = os.path.join(staging_dir, f'program{cls.SUPPORTED_LANGUAGES[language]["extension"]}')
+        with open(source_path, 'w', encoding='utf-8') as source_file:
+            source_file.write(code)
+        build_dir = os.path.join(staging_dir, 'build')
+        os.makedirs(build_dir)
+        return cls._run_process([compiler, *flags, source_path, '-o', os.path.join(build_dir, cls._executable_name())],
+                                None, timeout, cwd=staging_dir, job=job, limits=cls.compile_limits(language))
 
 # Test the code executor
 if __name__ == "__main__":
@@ -0,0 +1,225 @@
+# compile_cache.py - On-disk cache of compiled C, C++ and Java programs
+#
+# Each Run click used to compile the session's code from scratch and throw
+# the binary away afterwards, even when only the stdin changed. Builds are
+# now kept here, keyed by a SHA-256 of language, compiler, flags and source,
+# so running unchanged code again skips gcc/g++/javac. Entries are whole
+# directories (a binary, or a tree of .class files) published with a rename,
+# and the least recently used ones are removed once the cache passes its
+# size limit. Entries in use by a running program are never evicted.
+#
+# The server runs what it finds in the cache, so the cache lives in a
+# private (0700) directory owned by the server's user, next to its other
+# data, never in the shared temp directory. Each instance builds in its own
+# staging directory and only cleans up staging left by instances that are
+# no longer running.
+import collections
+import hashlib
+import os
+import re
+import shutil
+import stat
+import tempfile
+import threading
+from datetime import datetime
+
+# Relative to the server's working directory, like chat_history.db; the
+# chat server puts it next to its database (see CodeExecutor.use_compile_cache_dir)
+DEFAULT_CACHE_DIR = 'chat_history_compile_cache'
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def log_compile_cache(message):
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    print(f"[COMPILE_CACHE] {timestamp} - {message}")
+
+
+def build_key(language, compiler, flags, source):
+    """Cache key for one build: anything that changes the artifact goes in"""
+    hasher = hashlib.sha256()
+    for part in (language, compiler, *flags):
+        hasher.update(part.encode('utf-8'))
+        hasher.update(b'\0')
+    hasher.update(b'\0')
+    hasher.update(source.encode('utf-8'))
+    return hasher.hexdigest()
+
+
+KEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+def private_directory(path):
+    """Create path as a 0700 directory, or check that an existing one is ours.
+
+    Raises PermissionError if path is a symlink or not a directory, or is
+    owned by another user; an existing directory of ours that others can
+    read or write is tightened to 0700.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f"{path} is not a directory")
+    if hasattr(os, 'getuid'):
+        if info.st_uid != os.getuid():
+            raise PermissionError(f"{path} is owned by uid {info.st_uid}, not by this server")
+        if stat.S_IMODE(info.st_mode) & 0o077:
+            os.chmod(path, 0o700)
+            log_compile_cache(f"Restricted {path} to its owner (was {stat.S_IMODE(info.st_mode):o})")
+    return path
+
+
+def process_running(pid):
+    """False only when pid certainly does not exist"""
+    if os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def directory_size(path):
+    total = 0
+    for dir_path, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dir_path, filename))
+            except OSError:
+                pass
+    return total
+
+
+class CompileCache:
+    """LRU directory cache of build artifacts, bounded by total size on disk.
+
+    Typical use::
+
+        path = cache.acquire(key)
+        if path is None:
+            staging = cache.staging_dir()
+            ...compile into staging...
+            path = cache.store(key, staging)
+        try:
+            ...run from path...
+        finally:
+            cache.release(key)
+
+    acquire() and store() both pin the entry; release() unpins it.
+    """
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = private_directory(os.path.abspath(root))
+        self.max_bytes = max_bytes
+        self.staging_root = private_directory(os.path.join(self.root, 'tmp'))
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()  # {key: size}, least recently used first
+        self.pins = collections.Counter()  # {key: running programs using it}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._remove_stale_staging()
+        # This instance's own staging area, named after its pid
+        self.temp_dir = tempfile.mkdtemp(dir=self.staging_root, prefix=f'{os.getpid()}-')
+        self._load_entries()
+
+    def _remove_stale_staging(self):
+        """Delete staging areas of instances that are no longer running"""
+        for name in os.listdir(self.staging_root):
+            pid = name.split('-', 1)[0]
+            if pid.isdigit() and int(pid) != os.getpid() and not process_running(int(pid)):
+                shutil.rmtree(os.path.join(self.staging_root, name), ignore_errors=True)
+                log_compile_cache(f"Removed staging left by stopped instance {pid}")
+
+    def close(self):
+        """Remove this instance's staging area"""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _load_entries(self):
+        """Index entries left by a previous run, oldest use first"""
+        found = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not KEY_PATTERN.match(name) or os.path.islink(path) or not os.path.isdir(path):
+                continue
+            found.append((os.path.getmtime(path), name, directory_size(path)))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.total_bytes += size
+        if found:
+            log_compile_cache(f"Loaded {len(found)} cached builds ({self.total_bytes / 1048576:.1f} MB)")
+        self._evict()
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def acquire(self, key):
+        """Pin and return the entry's directory, or None on a miss"""
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            self.pins[key] += 1
+        try:
+            # Recency survives restarts through the directory mtime
+            os.utime(self.path(key))
+        except OSError:
+            pass
+        return self.path(key)
+
+    def release(self, key):
+        with self.lock:
+            self.pins[key] -= 1
+            if self.pins[key] <= 0:
+                del self.pins[key]
+            self._evict()
+
+    def staging_dir(self):
+        """A private scratch directory to build in before store()"""
+        return tempfile.mkdtemp(dir=self.temp_dir, prefix='build-')
+
+    def store(self, key, built_dir):
+        """Publish a finished build directory under key, pinned; returns its path.
+
+        If another worker stored the same key first, that entry is kept and
+        built_dir is discarded.
+        """
+        size = directory_size(built_dir)
+        with self.lock:
+            if key in self.entries:
+                shutil.rmtree(built_dir, ignore_errors=True)
+                self.entries.move_to_end(key)
+            else:
+                os.replace(built_dir, self.path(key))
+                self.entries[key] = size
+                self.total_bytes += size
+            self.pins[key] += 1
+            self._evict()
+        return self.path(key)
+
+    def _evict(self):
+        """Drop least recently used, unpinned entries past max_bytes; caller holds the lock"""
+        if self.total_bytes <= self.max_bytes:
+            return
+        for key in list(self.entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if self.pins[key]:
+                continue
+            self.total_bytes -= self.entries.pop(key)
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            log_compile_cache(f"Evicted {key[:12]}")
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -0,0 +1,338 @@
+# connection.py - Socket-like adapters used by the chat server engines
+#
+# Every client connection owns a bounded outbound queue drained by its own
+# writer (a thread for the threaded engine, a task for the asyncio engine).
+# send() only enqueues, so fan-out loops never wait on a slow recipient's
+# TCP window. A recipient whose queue passes its high-water mark is handled
+# by the slow consumer policy: 'drop' discards the new message, 'disconnect'
+# aborts the connection.
+import asyncio
+import collections
+import socket
+import struct
+import threading
+from datetime import datetime
+from framing import FrameDecoder, encode_frame, recv_frame, RECV_SIZE
+
+DEFAULT_MAX_QUEUED_FRAMES = 1024
+DEFAULT_HIGH_WATER_BYTES = 8 * 1024 * 1024
+SLOW_CONSUMER_POLICIES = ('drop', 'disconnect')
+
+# Frames queued together are written with one syscall, up to this size
+WRITE_BATCH_BYTES = 256 * 1024
+WRITE_BATCH_FRAMES = 512  # stays below IOV_MAX for sendmsg()
+
+# sendmsg() is not available on Windows
+HAVE_SENDMSG = hasattr(socket.socket, 'sendmsg')
+
+# How long a graceful close waits for the writer to flush queued frames
+CLOSE_LINGER_SECONDS = 5
+
+# Linux struct tcp_info: 8 one-byte fields, then u32s; tcpi_rtt (microseconds)
+# is the sixteenth of those
+TCP_INFO_RTT = struct.Struct('68xI')
+
+
+def log_connection(message, level="INFO"):
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    print(f"[CONNECTION {level}] {timestamp} - {message}")
+
+
+class SlowConsumerError(ConnectionError):
+    """Raised by send() when a slow recipient is disconnected by policy"""
+
+
+class BufferedConnection:
+    """Bounded outbound queue shared by both connection types.
+
+    Subclasses provide the writer that drains ``self.queue`` and implement
+    ``_wake_writer()`` and ``abort()``.
+    """
+
+    def __init__(self, max_queued_frames=DEFAULT_MAX_QUEUED_FRAMES,
+                 high_water_bytes=DEFAULT_HIGH_WATER_BYTES,
+                 slow_consumer_policy='disconnect'):
+        if slow_consumer_policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {slow_consumer_policy}")
+
+        self.max_queued_frames = max_queued_frames
+        self.high_water_bytes = high_water_bytes
+        self.slow_consumer_policy = slow_consumer_policy
+
+        self.queue = collections.deque()
+        self.queued_bytes = 0
+        self.queue_lock = threading.Lock()
+        self.dropped_frames = 0
+        self.closing = False
+        self.closed = False
+
+    def send(self, payload):
+        """Queue one message as a frame; never blocks on the network"""
+        self.send_frame(encode_frame(payload))
+        return len(payload)
+
+    def send_frame(self, frame):
+        """Queue an already encoded frame; returns False if it was dropped"""
+        with self.queue_lock:
+            if self.closing:
+                raise ConnectionError("Connection is closed")
+
+            if (len(self.queue) >= self.max_queued_frames or
+                    self.queued_bytes + len(frame) > self.high_water_bytes):
+                overflow = True
+            else:
+                overflow = False
+                self.queue.append(frame)
+                self.queued_bytes += len(frame)
+
+        if overflow:
+            return self._handle_overflow(frame)
+
+        self._wake_writer()
+        return True
+
+    def pending_bytes(self):
+        """Bytes queued or in flight to this client"""
+        return self.queued_bytes
+
+    def round_trip_time(self):
+        """The kernel's smoothed TCP round-trip time in seconds, or None (non-Linux)"""
+        sock = self._raw_socket()
+        if sock is None or not hasattr(socket, 'TCP_INFO'):
+            return None
+        try:
+            info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, TCP_INFO_RTT.size)
+        except OSError:
+            return None
+        if len(info) < TCP_INFO_RTT.size:
+            return None
+        return TCP_INFO_RTT.unpack(info)[0] / 1e6
+
+    def _raw_socket(self):
+        return None
+
+    def _handle_overflow(self, frame):
+        if self.slow_consumer_policy == 'drop':
+            with self.queue_lock:
+                self.dropped_frames += 1
+                dropped = self.dropped_frames
+            if dropped == 1 or dropped % 100 == 0:
+                log_connection(f"Slow consumer: dropped {dropped} frames "
+                               f"({self.queued_bytes} bytes queued)", "WARN")
+            return False
+
+        log_connection(f"Slow consumer: {len(self.queue)} frames / {self.queued_bytes} bytes queued, "
+                       f"disconnecting", "WARN")
+        self.abort()
+        raise SlowConsumerError("Outbound queue over high-water mark")
+
+    def _take_batch(self):
+        """Pop queued frames for one write; caller holds queue_lock"""
+        batch = [self.queue.popleft()]
+        size = len(batch[0])
+        while (self.queue and len(batch) < WRITE_BATCH_FRAMES and
+               size + len(self.queue[0]) <= WRITE_BATCH_BYTES):
+            frame = self.queue.popleft()
+            batch.append(frame)
+            size += len(frame)
+        return batch, size
+
+    def _sent(self, size):
+        """Account for a written batch; abort() may already have zeroed the count"""
+        with self.queue_lock:
+            self.queued_bytes = max(0, self.queued_bytes - size)
+
+    def _wake_writer(self):
+        raise NotImplementedError
+
+    def abort(self):
+        raise NotImplementedError
+
+
+class ClientConnection(BufferedConnection):
+    """Framed wrapper around a blocking client socket with a writer thread.
+
+    ``send()`` enqueues one protocol message; the writer thread writes queued
+    frames in order. ``recv_frame()`` returns one message at a time from the
+    per-connection reassembly buffer.
+    """
+
+    def __init__(self, sock, **limits):
+        super().__init__(**limits)
+        self.socket = sock
+        self.decoder = FrameDecoder()
+        self.queue_ready = threading.Condition(self.queue_lock)
+
+        self.writer_thread = threading.Thread(target=self._writer_loop)
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+
+    def _wake_writer(self):
+        with self.queue_ready:
+            self.queue_ready.notify()
+
+    def _writer_loop(self):
+        try:
+            while True:
+                with self.queue_ready:
+                    while not self.queue and not self.closing:
+                        self.queue_ready.wait()
+                    if not self.queue:
+                        break
+                    batch, size = self._take_batch()
+
+                self._send_batch(batch)
+                self._sent(size)
+        except OSError:
+            # Peer went away or the connection was aborted
+            self.abort()
+        finally:
+            self._close_socket()
+
+    def _send_batch(self, batch):
+        """Write frames with scatter-gather I/O so shared frames are never copied"""
+        if len(batch) == 1 or not HAVE_SENDMSG:
+            for frame in batch:
+                self.socket.sendall(frame)
+            return
+
+        while batch:
+            sent = self.socket.sendmsg(batch)
+            while batch and sent >= len(batch[0]):
+                sent -= len(batch[0])
+                batch.pop(0)
+            if sent:
+                batch[0] = memoryview(batch[0])[sent:]
+
+    def recv_frame(self):
+        """Return the next message payload as bytes, or None on EOF"""
+        return recv_frame(self.socket, self.decoder)
+
+    def _raw_socket(self):
+        return self.socket
+
+    def close(self):
+        """Flush queued frames, then close the socket"""
+        with self.queue_ready:
+            self.closing = True
+            self.queue_ready.notify()
+
+        if threading.current_thread() is not self.writer_thread:
+            self.writer_thread.join(CLOSE_LINGER_SECONDS)
+            if self.writer_thread.is_alive():
+                self.abort()
+
+    def abort(self):
+        """Close immediately, discarding queued frames"""
+        with self.queue_ready:
+            self.closing = True
+            self.queue.clear()
+            self.queued_bytes = 0
+            self.queue_ready.notify()
+        try:
+            # Unblocks both the reader's recv() and the writer's sendall()
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _close_socket(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                self.socket.close()
+            except OSError:
+                pass
+
+
+class AsyncClientConnection(BufferedConnection):
+    """Socket-like wrapper around an asyncio stream pair with a writer task.
+
+    ChatServer code writes to clients with ``self.clients[name][0].send(...)``
+    from the event loop, from executor threads and from the HTTP server
+    thread. ``send()`` is safe from any of them: it enqueues the frame and
+    wakes the writer task on the loop.
+    """
+
+    def __init__(self, reader, writer, loop, **limits):
+        super().__init__(**limits)
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+        self.decoder = FrameDecoder()
+        self.queue_ready = asyncio.Event()
+        self.writer_task = loop.create_task(self._writer_loop())
+
+    def _call_on_loop(self, callback):
+        if threading.get_ident() == self.loop_thread:
+            callback()
+        else:
+            self.loop.call_soon_threadsafe(callback)
+
+    def _wake_writer(self):
+        self._call_on_loop(self.queue_ready.set)
+
+    async def _writer_loop(self):
+        try:
+            while True:
+                await self.queue_ready.wait()
+                self.queue_ready.clear()
+
+                while True:
+                    with self.queue_lock:
+                        if not self.queue:
+                            break
+                        batch, size = self._take_batch()
+
+                    self.writer.writelines(batch)
+                    await self.writer.drain()
+                    self._sent(size)
+
+                if self.closing:
+                    break
+        except (ConnectionError, OSError):
+            self.abort()
+        finally:
+            self.closed = True
+            self.writer.close()
+
+    def _raw_socket(self):
+        return self.writer.get_extra_info('socket')
+
+    async def read_frame(self):
+        """Return the next message payload as bytes, or None on EOF"""
+        while True:
+            frame = self.decoder.next_frame()
+            if frame is not None:
+                return frame
+            data = await self.reader.read(RECV_SIZE)
+            if not data:
+                return None
+            self.decoder.feed(data)
+
+    def close(self):
+        """Flush queued frames, then close the transport"""
+        with self.queue_lock:
+            self.closing = True
+        self._call_on_loop(self._start_linger)
+
+    def _start_linger(self):
+        self.queue_ready.set()
+        # A peer that stops reading must not keep the writer task alive forever
+        self.loop.call_later(CLOSE_LINGER_SECONDS, self._abort_if_open)
+
+    def _abort_if_open(self):
+        if not self.closed:
+            self._abort_transport()
+
+    def abort(self):
+        """Close immediately, discarding queued frames"""
+        with self.queue_lock:
+            self.closing = True
+            self.queue.clear()
+            self.queued_bytes = 0
+        self._call_on_loop(self._abort_transport)
+
+    def _abort_transport(self):
+        self.writer.transport.abort()
+        self.queue_ready.set()
@@ -0,0 +1,78 @@
+# dbpool.py - Long-lived SQLite connections for the chat and file databases
+#
+# Opening a connection per statement pays the file open, schema parse and
+# an fsync-heavy rollback journal every time. Instead each thread keeps one
+# connection for its lifetime, opened in WAL mode so readers never block the
+# writer, and sqlite3's per-connection statement cache reuses prepared
+# statements across calls.
+import sqlite3
+import threading
+from datetime import datetime
+
+# Prepared statements kept per connection (sqlite3 default is 128)
+CACHED_STATEMENTS = 256
+
+# How long a writer waits for a competing write lock before giving up
+BUSY_TIMEOUT_SECONDS = 10
+
+
+def log_pool(message, operation="POOL"):
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    print(f"[DATABASE {operation}] {timestamp} - {message}")
+
+
+class SQLiteConnectionManager:
+    """Hands out one long-lived, WAL-mode connection per thread"""
+
+    def __init__(self, db_file, synchronous="NORMAL"):
+        self.db_file = db_file
+        self.synchronous = synchronous
+        self.local = threading.local()
+        self.connections = {}  # {thread: connection}
+        self.lock = threading.Lock()
+
+    def get_connection(self):
+        """Return the calling thread's connection, opening it on first use"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self._open()
+            self.local.conn = conn
+        return conn
+
+    def _open(self):
+        # Connections are only used by their owning thread; check_same_thread
+        # is off so close_all() can close them from the shutdown thread.
+        conn = sqlite3.connect(self.db_file,
+                               timeout=BUSY_TIMEOUT_SECONDS,
+                               cached_statements=CACHED_STATEMENTS,
+                               check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+
+        with self.lock:
+            self._prune_dead_threads()
+            self.connections[threading.current_thread()] = conn
+            open_count = len(self.connections)
+
+        log_pool(f"Opened connection for {threading.current_thread().name} ({open_count} open)")
+        return conn
+
+    def _prune_dead_threads(self):
+        """Close connections whose owning thread has exited; caller holds lock"""
+        for thread in [t for t in self.connections if not t.is_alive()]:
+            try:
+                self.connections.pop(thread).close()
+            except sqlite3.Error:
+                pass
+
+    def close_all(self):
+        """Close every connection; used at server shutdown"""
+        with self.lock:
+            for conn in self.connections.values():
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self.connections.clear()
+        self.local = threading.local()
+        log_pool("All connections closed")
@@ -0,0 +1,53 @@
+# execution_output.py - Bounded collection of a running program's output
+#
+# Both ways of running code (a child process read through its pipes, or a
+# warm interpreter worker sending output messages) feed what the program
+# prints into an OutputCollector as it arrives. The collector keeps at most
+# MAX_OUTPUT_SIZE characters for the final result, hands each kept piece to
+# an optional on_output(stream, text) callback so it can be shown live, and
+# marks the cut with TRUNCATION_MARKER once the limit is reached.
+import codecs
+
+MAX_OUTPUT_SIZE = 1024 * 1024  # characters of stdout + stderr kept per run
+TRUNCATION_MARKER = "\n[output truncated: more than {limit} characters]\n"
+
+
+class OutputCollector:
+    """stdout/stderr text of one run, capped at limit characters in total"""
+
+    def __init__(self, on_output=None, limit=MAX_OUTPUT_SIZE):
+        self.on_output = on_output
+        self.limit = limit
+        self.parts = {'stdout': [], 'stderr': []}
+        self.size = 0
+        self.truncated = False
+        self.decoders = {}
+
+    def add(self, stream, text):
+        """Record text printed on stream ('stdout' or 'stderr')"""
+        if self.truncated or not text:
+            return
+        room = self.limit - self.size
+        if len(text) > room:
+            text = text[:room]
+            self.truncated = True
+        if text:
+            self._keep(stream, text)
+            self.size += len(text)
+        if self.truncated:
+            self._keep(stream, TRUNCATION_MARKER.format(limit=self.limit))
+
+    def add_bytes(self, stream, data):
+        """Record raw pipe output; multi-byte characters may span reads"""
+        decoder = self.decoders.get(stream)
+        if decoder is None:
+            decoder = self.decoders[stream] = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.add(stream, decoder.decode(data, final=not data))
+
+    def _keep(self, stream, text):
+        self.parts[stream].append(text)
+        if self.on_output is not None:
+            self.on_output(stream, text)
+
+    def text(self, stream):
+        return ''.join(self.parts[stream])
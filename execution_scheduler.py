@@ -0,0 +1,251 @@
+# execution_scheduler.py - Bounded, fair scheduling of code execution requests
+#
+# Running code used to happen inside the requesting client's handler thread,
+# so that user saw no chat traffic until their program finished, and every
+# Run click started another compiler. Requests are now queued here and run
+# by a fixed number of worker threads, each supervising one child process
+# at a time. Users take turns: the next job comes from the user after the
+# one who ran last, so a user with several queued runs cannot starve others.
+import collections
+import itertools
+import os
+import threading
+import time
+from datetime import datetime
+from sandbox import kill_process_group
+
+# Child processes (compilers/programs) allowed to run at once
+DEFAULT_EXECUTION_WORKERS = min(4, os.cpu_count() or 1)
+
+# Runs one user may have waiting before new requests are rejected
+MAX_QUEUED_PER_USER = 3
+
+
+def log_scheduler(message, job_id=None):
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    job_info = f"[job {job_id}]" if job_id else "[SCHEDULER]"
+    print(f"[EXECUTION] {timestamp} {job_info} {message}")
+
+
+class ExecutionQueueFull(Exception):
+    """Raised by submit() when the user already has too many queued runs"""
+
+
+class ExecutionJob:
+    """One queued or running execution request"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, user, session_id, code, language, input_data):
+        self.job_id = next(self._ids)
+        self.user = user
+        self.session_id = session_id
+        self.code = code
+        self.language = language
+        self.input_data = input_data
+        self.submitted_at = time.time()
+        self.state = 'queued'  # queued -> running -> finished, or cancelled
+        self.cancelled = False
+        self.processes = set()
+        self.lock = threading.Lock()
+
+    def attach_process(self, process):
+        """Called by CodeExecutor for each child it starts"""
+        with self.lock:
+            self.processes.add(process)
+            cancelled = self.cancelled
+        if cancelled:
+            kill_process_group(process)
+
+    def detach_process(self, process):
+        with self.lock:
+            self.processes.discard(process)
+
+    def cancel(self):
+        """Kill whatever the job is running; CodeExecutor reports it as cancelled"""
+        with self.lock:
+            self.cancelled = True
+            processes = list(self.processes)
+        for process in processes:
+            kill_process_group(process)
+
+
+class ExecutionScheduler:
+    """Runs ExecutionJobs on a bounded worker pool, round-robin across users.
+
+    run_job(job) does the work on a worker thread. on_queue_change(job,
+    position) is called for every waiting job whose 1-based position in the
+    dispatch order changed; on_start(job) when a worker picks a job up.
+    """
+
+    def __init__(self, run_job, on_queue_change=None, on_start=None,
+                 max_workers=DEFAULT_EXECUTION_WORKERS, max_queued_per_user=MAX_QUEUED_PER_USER):
+        self.run_job = run_job
+        self.on_queue_change = on_queue_change
+        self.on_start = on_start
+        self.max_queued_per_user = max_queued_per_user
+
+        self.queues = collections.OrderedDict()  # {user: deque of jobs}, in turn order
+        self.jobs = {}  # {job_id: job} for queued and running jobs
+        self.positions = {}  # {job_id: last reported position}
+        self.condition = threading.Condition()
+        # Serializes queue and start notifications, which are made outside
+        # self.condition; see _report_positions
+        self.report_lock = threading.Lock()
+        self.stopping = False
+
+        self.workers = []
+        for i in range(max_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"Execution-{i + 1}")
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+        log_scheduler(f"Started {max_workers} execution workers")
+
+    def submit(self, user, session_id, code, language, input_data=""):
+        """Queue a run; returns the job. Raises ExecutionQueueFull past the per-user limit"""
+        with self.condition:
+            queue = self.queues.get(user)
+            if queue is not None and len(queue) >= self.max_queued_per_user:
+                raise ExecutionQueueFull(f"{user} already has {len(queue)} runs waiting")
+
+            job = ExecutionJob(user, session_id, code, language, input_data)
+            if queue is None:
+                queue = self.queues[user] = collections.deque()
+            queue.append(job)
+            self.jobs[job.job_id] = job
+            changes = self._position_changes()
+            self.condition.notify()
+
+        log_scheduler(f"Queued {language} run for {user} in session {session_id}", job.job_id)
+        self._report_positions(changes)
+        return job
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job.
+
+        Returns the state it was cancelled from, 'queued' or 'running', as
+        decided under the scheduler lock, or None if the job is unknown or
+        already finished.
+        """
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            state = job.state
+            if state == 'queued':
+                self.queues[job.user].remove(job)
+                if not self.queues[job.user]:
+                    del self.queues[job.user]
+                del self.jobs[job_id]
+                self.positions.pop(job_id, None)
+                job.state = 'cancelled'
+                job.cancelled = True
+                changes = self._position_changes()
+            else:
+                changes = []
+
+        if state == 'running':
+            job.cancel()
+        log_scheduler(f"Cancelled ({state})", job_id)
+        self._report_positions(changes)
+        return state
+
+    def get_job(self, job_id):
+        with self.condition:
+            return self.jobs.get(job_id)
+
+    def queued_count(self):
+        with self.condition:
+            return sum(len(queue) for queue in self.queues.values())
+
+    def shutdown(self):
+        """Stop taking jobs and kill the running ones"""
+        with self.condition:
+            self.stopping = True
+            running = [job for job in self.jobs.values() if job.state == 'running']
+            self.condition.notify_all()
+        for job in running:
+            job.cancel()
+
+    def _dispatch_order(self):
+        """Waiting jobs in the order workers will take them; caller holds the lock"""
+        order = []
+        queues = [list(queue) for queue in self.queues.values()]
+        for round_jobs in itertools.zip_longest(*queues):
+            order.extend(job for job in round_jobs if job is not None)
+        return order
+
+    def _position_changes(self):
+        """Jobs whose position moved since last reported; caller holds the lock"""
+        changes = []
+        for position, job in enumerate(self._dispatch_order(), start=1):
+            if self.positions.get(job.job_id) != position:
+                self.positions[job.job_id] = position
+                changes.append((job, position))
+        return changes
+
+    def _report_positions(self, changes):
+        """Report position changes worked out under the lock, unless already out of date.
+
+        Another thread may have moved the queue on between the changes being
+        worked out and reported: a job that has since started or been
+        cancelled, or whose position changed again, is skipped. Checking and
+        reporting under report_lock, which on_start is also called under,
+        keeps a stale "queued" from arriving after "started".
+        """
+        if self.on_queue_change is None:
+            return
+        with self.report_lock:
+            for job, position in changes:
+                with self.condition:
+                    current = job.state == 'queued' and self.positions.get(job.job_id) == position
+                if not current:
+                    continue
+                try:
+                    self.on_queue_change(job, position)
+                except Exception as e:
+                    log_scheduler(f"Queue position callback failed: {e}", job.job_id)
+
+    def _next_job(self):
+        """Take the next user's oldest job, or None when stopping"""
+        with self.condition:
+            while not self.queues and not self.stopping:
+                self.condition.wait()
+            if self.stopping:
+                return None, []
+
+            # The user at the front takes a turn, then goes to the back
+            user, queue = next(iter(self.queues.items()))
+            job = queue.popleft()
+            self.queues.move_to_end(user)
+            if not queue:
+                del self.queues[user]
+
+            job.state = 'running'
+            self.positions.pop(job.job_id, None)
+            return job, self._position_changes()
+
+    def _worker_loop(self):
+        while True:
+            job, changes = self._next_job()
+            if job is None:
+                return
+            self._report_positions(changes)
+
+            wait = time.time() - job.submitted_at
+            log_scheduler(f"Running {job.language} for {job.user} after {wait:.2f}s in queue", job.job_id)
+            if self.on_start is not None:
+                with self.report_lock:
+                    try:
+                        self.on_start(job)
+                    except Exception as e:
+                        log_scheduler(f"Start callback failed: {e}", job.job_id)
+            try:
+                self.run_job(job)
+            except Exception as e:
+                log_scheduler(f"Job failed: {e}", job.job_id)
+            finally:
+                with self.condition:
+                    job.state = 'finished'
+                    self.jobs.pop(job.job_id, None)
@@ -1,12 +1,55 @@
 # file_transfer.py - With Detailed Logging
+import errno
+import hashlib
+import io
+import math
+import os
+import re
 import threading
+import time
 import json
 import uuid
 import mimetypes
-import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
+from framing import encode_frame
+from dbpool import SQLiteConnectionManager
+from blob_store import BlobStore
+from multipart import MultipartParser, MultipartError, get_boundary
+
+# Concurrent transfers served at once, and accepted connections allowed to
+# wait for a worker before new ones are turned away with 503
+DEFAULT_HTTP_WORKERS = 32
+DEFAULT_HTTP_PENDING = 64
+
+# Idle keep-alive connections are closed after this many seconds so they
+# do not hold a worker forever
+KEEPALIVE_TIMEOUT = 15
+
+# Resumable uploads: chunk size offered to clients, the largest accepted,
+# and how long an abandoned upload keeps its partial data
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+UPLOAD_EXPIRY_SECONDS = 24 * 60 * 60
+MAX_JSON_BODY = 64 * 1024
+
+# Largest file accepted by POST /upload or announced to POST /uploads;
+# a resumable upload reserves its full size on disk up front
+DEFAULT_MAX_UPLOAD_SIZE = 2 * 1024 * 1024 * 1024
+
+# Errors from reserving space for an upload that mean the disk (or the
+# user's quota) is full rather than that the server is broken
+NO_SPACE_ERRORS = {errno.ENOSPC, errno.EDQUOT, errno.EFBIG}
+
+# /uploads/<id>, /uploads/<id>/complete
+UPLOAD_PATH = re.compile(r'^/uploads/([0-9a-f]{32})(/complete)?$')
+
+# Single byte range, e.g. "bytes=0-499", "bytes=500-" or "bytes=-500"
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+# parse_range() result for a Range header that must be ignored (served as a 200)
+IGNORE_RANGE = 'ignore'
 
 # Enhanced logging functions
 def log_http(message, level="INFO", client_ip=None):
@@ -24,9 +67,17 @@ def log_database_file(message, operation="DB"):
     print(f"[FILE_DB {operation}] {timestamp} - {message}")
 
 class FileTransferHandler(BaseHTTPRequestHandler):
-    def __init__(self, *args, database=None, clients=None, **kwargs):
+    # HTTP/1.1 keeps connections open between requests, so every response
+    # must carry a Content-Length
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
+    
+    def __init__(self, *args, database=None, clients=None, presence=None,
+                 max_upload_size=DEFAULT_MAX_UPLOAD_SIZE, **kwargs):
         self.database = database
         self.clients = clients
+        self.presence = presence  # the chat server's PresenceIndex, if running inside it
+        self.max_upload_size = max_upload_size
         self.client_ip = None
         super().__init__(*args, **kwargs)
     
@@ -40,16 +91,31 @@ class FileTransferHandler(BaseHTTPRequestHandler):
         log_http("CORS preflight request received", client_ip=self.client_ip)
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Methods', 'GET, HEAD, POST, PUT, DELETE, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Range, If-None-Match, If-Range, X-Chunk-SHA256')
+        self.send_header('Content-Length', '0')
         self.end_headers()
         log_http("CORS headers sent", client_ip=self.client_ip)
     
+    def do_HEAD(self):
+        """Headers of a download without the body (size, ETag, range support)"""
+        try:
+            path = urlparse(self.path).path
+            log_http(f"HEAD request: {path}", client_ip=self.client_ip)
+            if path.startswith('/download/'):
+                self.handle_file_download(path.split('/')[-1], send_body=False)
+            else:
+                self.send_error(404, "Endpoint not found")
+        except Exception as e:
+            log_http(f"❌ Error in HEAD request: {e}", "ERROR", self.client_ip)
+            self.send_error(500, "Internal server error")
+    
     def do_GET(self):
         """Handle file download requests"""
         try:
             parsed_url = urlparse(self.path)
             path = parsed_url.path
+            upload_match = UPLOAD_PATH.match(path)
             log_http(f"GET request: {path}", client_ip=self.client_ip)
             
             if path.startswith('/download/'):
@@ -61,6 +127,8 @@ class FileTransferHandler(BaseHTTPRequestHandler):
                 user = query_params.get('user', [None])[0]
                 log_file_operation(f"File list request for user: {user}", "LIST", self.client_ip)
                 self.handle_file_list(user)
+            elif upload_match and not upload_match.group(2):
+                self.handle_upload_status(upload_match.group(1))
             else:
                 log_http(f"❌ Unknown endpoint: {path}", "ERROR", self.client_ip)
                 self.send_error(404, "Endpoint not found")
@@ -72,9 +140,14 @@ class FileTransferHandler(BaseHTTPRequestHandler):
         """Handle file upload requests"""
         try:
             log_http(f"POST request: {self.path}", client_ip=self.client_ip)
+            upload_match = UPLOAD_PATH.match(self.path)
             if self.path == '/upload':
                 log_file_operation("File upload started", "UPLOAD", self.client_ip)
                 self.handle_file_upload()
+            elif self.path == '/uploads':
+                self.handle_upload_init()
+            elif upload_match and upload_match.group(2):
+                self.handle_upload_complete(upload_match.group(1))
             else:
                 log_http(f"❌ Unknown POST endpoint: {self.path}", "ERROR", self.client_ip)
                 self.send_error(404, "Endpoint not found")
@@ -82,8 +155,37 @@ class FileTransferHandler(BaseHTTPRequestHandler):
             log_http(f"❌ Error in POST request: {e}", "ERROR", self.client_ip)
             self.send_error(500, "Internal server error")
     
+    def do_PUT(self):
+        """Receive one chunk of a resumable upload"""
+        try:
+            parsed_url = urlparse(self.path)
+            upload_match = UPLOAD_PATH.match(parsed_url.path)
+            if upload_match and not upload_match.group(2):
+                offset = parse_qs(parsed_url.query).get('offset', [None])[0]
+                self.handle_upload_chunk(upload_match.group(1), offset)
+            else:
+                log_http(f"❌ Unknown PUT endpoint: {self.path}", "ERROR", self.client_ip)
+                self.send_error(404, "Endpoint not found")
+        except Exception as e:
+            log_http(f"❌ Error in PUT request: {e}", "ERROR", self.client_ip)
+            self.send_error(500, "Internal server error")
+    
+    def do_DELETE(self):
+        """Abandon a resumable upload"""
+        try:
+            upload_match = UPLOAD_PATH.match(urlparse(self.path).path)
+            if upload_match and not upload_match.group(2):
+                self.handle_upload_cancel(upload_match.group(1))
+            else:
+                log_http(f"❌ Unknown DELETE endpoint: {self.path}", "ERROR", self.client_ip)
+                self.send_error(404, "Endpoint not found")
+        except Exception as e:
+            log_http(f"❌ Error in DELETE request: {e}", "ERROR", self.client_ip)
+            self.send_error(500, "Internal server error")
+    
     def handle_file_upload(self):
         """Handle file upload via POST request"""
+        blob_writers = []
         try:
             content_type = self.headers.get('Content-Type', '')
             log_file_operation(f"Upload content type: {content_type}", "UPLOAD")
@@ -101,59 +203,41 @@ class FileTransferHandler(BaseHTTPRequestHandler):
                 self.send_error(400, "No content received")
                 return
             
-            # Read the request body
-            log_file_operation("Reading upload data...", "UPLOAD")
-            post_data = self.rfile.read(content_length)
-            log_file_operation(f"✅ Read {len(post_data)} bytes", "UPLOAD")
-            
-            # Parse multipart data
-            log_file_operation("Parsing multipart data...", "UPLOAD")
-            boundary = content_type.split('boundary=')[1].encode()
-            parts = post_data.split(b'--' + boundary)
-            log_file_operation(f"Found {len(parts)} parts in multipart data", "UPLOAD")
-            
-            file_data = None
-            filename = None
-            sender = None
-            recipient = None
-            group_name = None
-            
-            for i, part in enumerate(parts):
-                if b'Content-Disposition' in part:
-                    log_file_operation(f"Processing part {i}", "UPLOAD")
-                    lines = part.split(b'\r\n')
-                    for j, line in enumerate(lines):
-                        if b'Content-Disposition' in line:
-                            if b'name="file"' in line:
-                                # Extract filename
-                                if b'filename=' in line:
-                                    filename = line.split(b'filename=')[1].strip(b'"').decode('utf-8')
-                                    log_file_operation(f"📄 Filename: {filename}", "UPLOAD")
-                                # Find file data
-                                data_start = part.find(b'\r\n\r\n') + 4
-                                if data_start > 3:
-                                    file_data = part[data_start:].rstrip(b'\r\n')
-                                    log_file_operation(f"📦 File data: {len(file_data)} bytes", "UPLOAD")
-                            elif b'name="sender"' in line:
-                                data_start = part.find(b'\r\n\r\n') + 4
-                                if data_start > 3:
-                                    sender = part[data_start:].rstrip(b'\r\n').decode('utf-8')
-                                    log_file_operation(f"👤 Sender: {sender}", "UPLOAD")
-                            elif b'name="recipient"' in line:
-                                data_start = part.find(b'\r\n\r\n') + 4
-                                if data_start > 3:
-                                    recipient = part[data_start:].rstrip(b'\r\n').decode('utf-8')
-                                    log_file_operation(f"👤 Recipient: {recipient}", "UPLOAD")
-                            elif b'name="group_name"' in line:
-                                data_start = part.find(b'\r\n\r\n') + 4
-                                if data_start > 3:
-                                    group_name = part[data_start:].rstrip(b'\r\n').decode('utf-8')
-                                    log_file_operation(f"👥 Group: {group_name}", "UPLOAD")
-            
-            if not file_data or not filename or not sender:
+            if content_length > self.max_upload_size:
+                log_file_operation(f"❌ Upload larger than {self.max_upload_size} bytes", "UPLOAD")
+                self.send_error(413, f"File larger than the {self.max_upload_size} byte limit")
+                return
+            
+            # Stream the body through the parser; the file part goes straight to the blob store
+            log_file_operation("Streaming multipart data...", "UPLOAD")
+            store = self.database.get_blob_store()
+            
+            def open_file(field_name, filename):
+                if field_name != 'file' or blob_writers:
+                    return None
+                blob_writers.append(store.writer())
+                return blob_writers[0]
+            
+            try:
+                boundary = get_boundary(content_type)
+                fields, files = MultipartParser(self.rfile, boundary, content_length, open_file).parse()
+            except MultipartError as e:
+                log_file_operation(f"❌ Malformed upload: {e}", "UPLOAD")
+                self.send_error(400, f"Malformed multipart data: {e}")
+                return
+            
+            sender = fields.get('sender')
+            recipient = fields.get('recipient')
+            group_name = fields.get('group_name')
+            filename, blob_writer = files.get('file', (None, None))
+            log_file_operation(f"📄 Filename: {filename}, 👤 Sender: {sender}, "
+                               f"🎯 Recipient: {recipient}, 👥 Group: {group_name}", "UPLOAD")
+            
+            if blob_writer is None or not filename or not sender:
                 log_file_operation("❌ Missing required fields", "UPLOAD")
                 self.send_error(400, "Missing required fields: file, filename, or sender")
                 return
+            log_file_operation(f"📦 File data: {blob_writer.size} bytes", "UPLOAD")
             
             # Generate unique file ID
             file_id = str(uuid.uuid4())
@@ -163,9 +247,12 @@ class FileTransferHandler(BaseHTTPRequestHandler):
             target = group_name or recipient or "BROADCAST"
             log_file_operation(f"🎯 Target: {target}", "UPLOAD")
             
-            # Save file to database
+            # Move the blob into place and record it
             log_file_operation(f"💾 Saving file to database...", "UPLOAD")
-            success = self.database.save_file(file_id, filename, file_data, sender, recipient, group_name)
+            with store.lock:
+                content_hash, file_size = blob_writer.commit()
+                success = self.database.save_file_record(file_id, filename, content_hash, file_size,
+                                                         sender, recipient, group_name)
             
             if success:
                 log_file_operation(f"✅ File saved successfully", "UPLOAD")
@@ -182,11 +269,7 @@ class FileTransferHandler(BaseHTTPRequestHandler):
                     'download_url': f'/download/{file_id}'
                 }
                 
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
-                self.wfile.write(json.dumps(response).encode('utf-8'))
+                self.send_json(response)
                 log_file_operation(f"✅ Upload complete - sent response", "UPLOAD")
             else:
                 log_file_operation(f"❌ Failed to save file to database", "UPLOAD")
@@ -195,42 +278,336 @@ class FileTransferHandler(BaseHTTPRequestHandler):
         except Exception as e:
             log_file_operation(f"❌ Upload error: {e}", "UPLOAD")
             self.send_error(500, f"Upload error: {str(e)}")
+        finally:
+            # Drops the temp file of an upload that failed before commit()
+            for writer in blob_writers:
+                writer.abort()
     
-    def handle_file_download(self, file_id):
-        """Handle file download via GET request"""
+    def read_json_body(self):
+        """Parse a small JSON request body; None (after replying 400) if invalid"""
+        content_length = int(self.headers.get('Content-Length', 0))
+        if content_length > MAX_JSON_BODY:
+            self.send_error(413, "Request body too large")
+            return None
+        try:
+            return json.loads(self.rfile.read(content_length) or b'{}')
+        except ValueError:
+            self.send_error(400, "Invalid JSON")
+            return None
+    
+    def upload_status(self, upload):
+        """JSON view of a resumable upload for the client to resume from"""
+        received = set(upload['received'])
+        total_chunks = math.ceil(upload['file_size'] / upload['chunk_size'])
+        missing = [i * upload['chunk_size'] for i in range(total_chunks)
+                   if i * upload['chunk_size'] not in received]
+        return {
+            'status': 'success',
+            'upload_id': upload['upload_id'],
+            'filename': upload['filename'],
+            'file_size': upload['file_size'],
+            'chunk_size': upload['chunk_size'],
+            'received': sorted(received),
+            'missing': missing,
+            # First byte not yet acknowledged; file_size once everything arrived
+            'next_offset': missing[0] if missing else upload['file_size']
+        }
+    
+    def handle_upload_init(self):
+        """Start a resumable upload: POST /uploads {filename, file_size, sender, ...}"""
+        request = self.read_json_body()
+        if request is None:
+            return
+        
+        filename = request.get('filename')
+        sender = request.get('sender')
+        file_size = request.get('file_size')
+        if not filename or not sender or not isinstance(file_size, int) or file_size < 0:
+            log_file_operation("❌ Missing required fields for chunked upload", "UPLOAD")
+            self.send_error(400, "Missing required fields: filename, file_size, or sender")
+            return
+        if file_size > self.max_upload_size:
+            log_file_operation(f"❌ Chunked upload of {file_size} bytes refused "
+                               f"(limit {self.max_upload_size})", "UPLOAD")
+            self.send_error(413, f"File larger than the {self.max_upload_size} byte limit")
+            return
+        chunk_size = request.get('chunk_size') or DEFAULT_CHUNK_SIZE
+        if not isinstance(chunk_size, int) or not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            self.send_error(400, f"chunk_size must be between 1 and {MAX_CHUNK_SIZE}")
+            return
+        
+        self.database.expire_chunked_uploads(UPLOAD_EXPIRY_SECONDS)
+        
+        upload_id = uuid.uuid4().hex
+        partial_path = self.database.get_blob_store().partial_path(upload_id)
+        try:
+            with open(partial_path, 'wb') as partial:
+                partial.truncate(file_size)
+        except OSError as e:
+            log_file_operation(f"❌ Could not reserve {file_size} bytes for {filename}: {e}", "UPLOAD")
+            try:
+                os.remove(partial_path)
+            except OSError:
+                pass
+            if e.errno in NO_SPACE_ERRORS:
+                self.send_error(507, "Not enough storage for this upload")
+            else:
+                self.send_error(500, "Failed to create upload")
+            return
+        
+        self.database.create_chunked_upload(upload_id, filename, file_size, chunk_size, sender,
+                                            request.get('recipient') or None,
+                                            request.get('group_name') or None,
+                                            request.get('sha256'))
+        log_file_operation(f"🆕 Chunked upload {upload_id}: {filename} ({file_size} bytes, "
+                           f"{chunk_size} byte chunks) from {sender}", "UPLOAD")
+        self.send_json(self.upload_status(self.database.get_chunked_upload(upload_id)))
+    
+    def handle_upload_status(self, upload_id):
+        """GET /uploads/<id>: which chunks the server already has"""
+        upload = self.database.get_chunked_upload(upload_id)
+        if not upload:
+            self.send_error(404, "Upload not found")
+            return
+        self.send_json(self.upload_status(upload))
+    
+    def handle_upload_chunk(self, upload_id, offset):
+        """PUT /uploads/<id>?offset=N with the chunk as body and X-Chunk-SHA256"""
+        upload = self.database.get_chunked_upload(upload_id)
+        if not upload:
+            self.send_error(404, "Upload not found")
+            return
+        
+        try:
+            offset = int(offset)
+        except (TypeError, ValueError):
+            self.send_error(400, "offset query parameter required")
+            return
+        content_length = int(self.headers.get('Content-Length', 0))
+        expected_length = min(upload['chunk_size'], upload['file_size'] - offset)
+        if offset < 0 or offset % upload['chunk_size'] or expected_length <= 0:
+            self.send_error(400, "offset must be a chunk boundary inside the file")
+            return
+        if content_length != expected_length:
+            self.send_error(400, f"Chunk at {offset} must be {expected_length} bytes")
+            return
+        
+        # Chunks land at their own offset, so parallel PUTs never overlap
+        hasher = hashlib.sha256()
+        remaining = content_length
+        with open(self.database.get_blob_store().partial_path(upload_id), 'r+b') as partial:
+            partial.seek(offset)
+            while remaining:
+                data = self.rfile.read(min(remaining, 256 * 1024))
+                if not data:
+                    raise ConnectionError("Client closed the connection mid-chunk")
+                hasher.update(data)
+                partial.write(data)
+                remaining -= len(data)
+        
+        chunk_hash = hasher.hexdigest()
+        expected_hash = self.headers.get('X-Chunk-SHA256')
+        if expected_hash and expected_hash.lower() != chunk_hash:
+            log_file_operation(f"❌ Checksum mismatch for chunk {offset} of {upload_id}", "UPLOAD")
+            # The bad bytes overwrote this chunk, so it must be sent again
+            self.database.forget_upload_chunk(upload_id, offset)
+            self.send_error(422, "Chunk checksum mismatch")
+            return
+        
+        self.database.record_upload_chunk(upload_id, offset, content_length, chunk_hash)
+        log_file_operation(f"📦 Chunk {offset}+{content_length} of {upload_id} stored", "UPLOAD")
+        self.send_json(self.upload_status(self.database.get_chunked_upload(upload_id)))
+    
+    def handle_upload_complete(self, upload_id):
+        """POST /uploads/<id>/complete: move the assembled file into the blob store"""
+        upload = self.database.get_chunked_upload(upload_id)
+        if not upload:
+            self.send_error(404, "Upload not found")
+            return
+        
+        status = self.upload_status(upload)
+        if status['missing']:
+            log_file_operation(f"❌ Upload {upload_id} still missing {len(status['missing'])} chunks", "UPLOAD")
+            self.send_json(dict(status, status='incomplete'), 409)
+            return
+        
+        store = self.database.get_blob_store()
+        partial_path = store.partial_path(upload_id)
+        content_hash = store.hash_file(partial_path)
+        if upload['sha256'] and upload['sha256'].lower() != content_hash:
+            # Every chunk matched its checksum, so the client's own copy changed
+            log_file_operation(f"❌ Whole-file checksum mismatch for {upload_id}", "UPLOAD")
+            self.send_error(422, "File checksum mismatch")
+            return
+        
+        file_id = str(uuid.uuid4())
+        with store.lock:
+            content_hash, file_size = store.put_file(partial_path, content_hash)
+            success = self.database.save_file_record(file_id, upload['filename'], content_hash, file_size,
+                                                     upload['sender'], upload['recipient'], upload['group_name'])
+        if not success:
+            self.send_error(500, "Failed to save file")
+            return
+        self.database.delete_chunked_upload(upload_id)
+        log_file_operation(f"✅ Chunked upload {upload_id} complete as file {file_id}", "UPLOAD")
+        
+        self.notify_file_upload(file_id, upload['filename'], upload['sender'],
+                                upload['recipient'], upload['group_name'])
+        self.send_json({
+            'status': 'success',
+            'file_id': file_id,
+            'filename': upload['filename'],
+            'download_url': f'/download/{file_id}'
+        })
+    
+    def handle_upload_cancel(self, upload_id):
+        """DELETE /uploads/<id>: drop an upload and its partial data"""
+        if not self.database.get_chunked_upload(upload_id):
+            self.send_error(404, "Upload not found")
+            return
+        self.database.delete_chunked_upload(upload_id)
+        log_file_operation(f"🗑️ Chunked upload {upload_id} cancelled", "UPLOAD")
+        self.send_json({'status': 'success', 'upload_id': upload_id})
+    
+    def handle_file_download(self, file_id, send_body=True):
+        """Stream a file from the blob store, honouring Range and If-None-Match"""
         try:
             log_file_operation(f"🔍 Looking up file ID: {file_id}", "DOWNLOAD")
-            file_info = self.database.get_file(file_id)
+            file_info = self.database.get_file_info(file_id)
             
             if not file_info:
                 log_file_operation(f"❌ File not found: {file_id}", "DOWNLOAD")
                 self.send_error(404, "File not found")
                 return
             
-            filename, file_data, sender, recipient, group_name, timestamp = file_info
-            log_file_operation(f"✅ File found: {filename} ({len(file_data)} bytes, from {sender})", "DOWNLOAD")
+            filename = file_info['filename']
+            file_size = file_info['file_size']
+            log_file_operation(f"✅ File found: {filename} ({file_size} bytes, from {file_info['sender']})", "DOWNLOAD")
+            
+            # Blobs are content addressed, so the hash is a strong validator
+            etag = f'"{file_info["content_hash"]}"' if file_info['content_hash'] else None
+            # "*" matches any current representation, so any existing file
+            if_none_match = self.parse_etags(self.headers.get('If-None-Match'))
+            if '*' in if_none_match or (etag and etag in if_none_match):
+                log_file_operation(f"♻️ Not modified: {filename}", "DOWNLOAD")
+                self.send_response(304)
+                if etag:
+                    self.send_header('ETag', etag)
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                return
             
             # Determine content type
-            content_type, _ = mimetypes.guess_type(filename)
+            content_type = file_info['mime_type'] or mimetypes.guess_type(filename)[0]
             if not content_type:
                 content_type = 'application/octet-stream'
             log_file_operation(f"📋 Content type: {content_type}", "DOWNLOAD")
             
-            # Send file
-            log_file_operation(f"📤 Sending file to client...", "DOWNLOAD")
-            self.send_response(200)
+            # A stale If-Range means the client's partial copy is outdated: send it all
+            byte_range = None
+            range_header = self.headers.get('Range')
+            # Multi-range requests are answered with the whole file, as RFC 9110 allows
+            if range_header and ',' not in range_header and self.headers.get('If-Range', etag) == etag:
+                byte_range = self.parse_range(range_header, file_size)
+                if byte_range == IGNORE_RANGE:
+                    log_file_operation(f"Ignoring malformed or non-byte range {range_header!r}", "DOWNLOAD")
+                    byte_range = None
+                elif byte_range is None:
+                    log_file_operation(f"❌ Unsatisfiable range {range_header} for {file_size} bytes", "DOWNLOAD")
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{file_size}')
+                    self.send_header('Content-Length', '0')
+                    self.send_header('Access-Control-Allow-Origin', '*')
+                    self.end_headers()
+                    return
+            
+            if byte_range:
+                start, end = byte_range
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{file_size}')
+            else:
+                start, end = 0, file_size - 1
+                self.send_response(200)
+            count = end - start + 1
+            
             self.send_header('Content-Type', content_type)
             self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
-            self.send_header('Content-Length', str(len(file_data)))
+            self.send_header('Content-Length', str(count))
+            self.send_header('Accept-Ranges', 'bytes')
+            if etag:
+                self.send_header('ETag', etag)
             self.send_header('Access-Control-Allow-Origin', '*')
             self.end_headers()
-            self.wfile.write(file_data)
+            
+            if not send_body or count <= 0:
+                return
+            
+            # Send file
+            log_file_operation(f"📤 Streaming bytes {start}-{end} to client...", "DOWNLOAD")
+            with self.open_file_contents(file_info) as contents:
+                self.stream_file(contents, start, count)
             log_file_operation(f"✅ Download complete: {filename}", "DOWNLOAD")
             
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+            log_file_operation(f"⚠️ Client closed the connection during download of {file_id}", "DOWNLOAD")
         except Exception as e:
             log_file_operation(f"❌ Download error: {e}", "DOWNLOAD")
             self.send_error(500, "Download error")
     
+    def open_file_contents(self, file_info):
+        """Open a blob, or wrap the inline data of a not yet migrated row"""
+        if file_info['file_data'] is not None:
+            return io.BytesIO(file_info['file_data'])
+        return self.database.get_blob_store().open(file_info['content_hash'])
+    
+    def stream_file(self, contents, offset, count):
+        """Copy count bytes from offset straight to the socket.
+        
+        socket.sendfile() uses os.sendfile() for real files, so the data never
+        passes through Python, and falls back to chunked reads and send()
+        where sendfile is unavailable (other platforms, inline legacy data).
+        """
+        self.wfile.flush()
+        sent = self.connection.sendfile(contents, offset, count)
+        if sent != count:
+            raise ConnectionError(f"Sent {sent} of {count} bytes")
+    
+    @staticmethod
+    def parse_etags(header):
+        """ETags listed in an If-None-Match header; '*' is returned as is for the caller to match anything"""
+        if not header:
+            return set()
+        tags = {tag.strip() for tag in header.split(',')}
+        # Weak comparison is fine here: our tags never change for the same URL
+        return {tag[2:] if tag.startswith('W/') else tag for tag in tags}
+    
+    @staticmethod
+    def parse_range(header, file_size):
+        """Parse a single byte range into inclusive (start, end).
+        
+        Returns None if the range is valid but unsatisfiable (a 416), and
+        IGNORE_RANGE for a header that is malformed or uses another unit,
+        which RFC 9110 says to ignore.
+        """
+        match = RANGE_PATTERN.match(header.strip())
+        if not match:
+            return IGNORE_RANGE
+        first, last = match.groups()
+        if not first and not last:
+            return IGNORE_RANGE
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length == 0:
+                return None
+            return max(file_size - length, 0), file_size - 1
+        start = int(first)
+        end = min(int(last), file_size - 1) if last else file_size - 1
+        if start >= file_size or start > end:
+            return None
+        return start, end
+    
     def handle_file_list(self, user):
         """Handle file listing request"""
         try:
@@ -248,17 +625,23 @@ class FileTransferHandler(BaseHTTPRequestHandler):
                 'files': files
             }
             
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps(response).encode('utf-8'))
+            self.send_json(response)
             log_file_operation(f"✅ File list sent to {user}", "LIST")
             
         except Exception as e:
             log_file_operation(f"❌ File list error: {e}", "LIST")
             self.send_error(500, "List error")
     
+    def send_json(self, response, status=200):
+        """Send a JSON response with the Content-Length keep-alive needs"""
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+    
     def notify_file_upload(self, file_id, filename, sender, recipient, group_name):
         """Notify clients about new file upload"""
         try:
@@ -273,7 +656,8 @@ class FileTransferHandler(BaseHTTPRequestHandler):
                 'timestamp': datetime.now().isoformat()
             }
             
-            message = f"FILE_NOTIFICATION|{json.dumps(file_notification)}"
+            # Encoded once and shared by every notified client
+            frame = encode_frame(f"FILE_NOTIFICATION|{json.dumps(file_notification)}")
             
             # Determine who to notify
             notified_users = []
@@ -281,13 +665,17 @@ class FileTransferHandler(BaseHTTPRequestHandler):
             if group_name:
                 # Notify all group members
                 log_file_operation(f" Notifying group '{group_name}' about file upload", "NOTIFY")
-                group_members = self.database.get_group_members(group_name)
-                log_file_operation(f" Group has {len(group_members)} members: {group_members}", "NOTIFY")
+                if self.presence is not None:
+                    group_members = self.presence.online_members(group_name)
+                    log_file_operation(f" Group has {len(group_members)} members online: {group_members}", "NOTIFY")
+                else:
+                    group_members = self.database.get_group_members(group_name)
+                    log_file_operation(f" Group has {len(group_members)} members: {group_members}", "NOTIFY")
                 
                 for member in group_members:
                     if member in self.clients:
                         try:
-                            self.clients[member][0].send(message.encode('utf-8'))
+                            self.clients[member][0].send_frame(frame)
                             notified_users.append(member)
                             log_file_operation(f" Notified group member: {member}", "NOTIFY")
                         except Exception as e:
@@ -299,7 +687,7 @@ class FileTransferHandler(BaseHTTPRequestHandler):
                 
                 if recipient in self.clients:
                     try:
-                        self.clients[recipient][0].send(message.encode('utf-8'))
+                        self.clients[recipient][0].send_frame(frame)
                         notified_users.append(recipient)
                         log_file_operation(f" Notified recipient: {recipient}", "NOTIFY")
                     except Exception as e:
@@ -307,7 +695,7 @@ class FileTransferHandler(BaseHTTPRequestHandler):
                         
                 if sender in self.clients and sender != recipient:
                     try:
-                        self.clients[sender][0].send(message.encode('utf-8'))
+                        self.clients[sender][0].send_frame(frame)
                         notified_users.append(sender)
                         log_file_operation(f" Notified sender: {sender}", "NOTIFY")
                     except Exception as e:
@@ -317,9 +705,9 @@ class FileTransferHandler(BaseHTTPRequestHandler):
                 # Broadcast to all clients
                 log_file_operation(f" Broadcasting file notification to all clients", "NOTIFY")
                 
-                for client_name, (client_socket, _) in self.clients.items():
+                for client_name, (connection, _) in self.clients.items():
                     try:
-                        client_socket.send(message.encode('utf-8'))
+                        connection.send_frame(frame)
                         notified_users.append(client_name)
                         log_file_operation(f" Notified client: {client_name}", "NOTIFY")
                     except Exception as e:
@@ -334,27 +722,86 @@ class FileTransferHandler(BaseHTTPRequestHandler):
         """Override to reduce HTTP server logging"""
         return  # Comment this out if you want HTTP logs
 
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer that serves each connection on a bounded worker pool.
+    
+    Up to max_workers connections are served concurrently and max_pending
+    more wait for a free worker; beyond that, new connections get an
+    immediate 503 instead of piling up threads.
+    """
+    
+    REJECT_RESPONSE = (b"HTTP/1.1 503 Service Unavailable\r\n"
+                       b"Content-Length: 0\r\nRetry-After: 1\r\nConnection: close\r\n\r\n")
+    
+    def __init__(self, server_address, handler_class, max_workers=DEFAULT_HTTP_WORKERS,
+                 max_pending=DEFAULT_HTTP_PENDING):
+        self.request_queue_size = max_pending
+        super().__init__(server_address, handler_class)
+        self.max_workers = max_workers
+        self.workers = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="FileHTTP")
+        self.slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self.rejected = 0
+    
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            self.rejected += 1
+            log_http(f" Worker pool full, rejecting connection ({self.rejected} rejected so far)",
+                     "WARN", client_address[0])
+            try:
+                request.sendall(self.REJECT_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        self.workers.submit(self.process_request_worker, request, client_address)
+    
+    def process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+    
+    def server_close(self):
+        super().server_close()
+        self.workers.shutdown(wait=False, cancel_futures=True)
+
 class FileTransferServer:
-    def __init__(self, host='localhost', port=8080, database=None, clients=None):
+    def __init__(self, host='localhost', port=8080, database=None, clients=None, presence=None,
+                 max_workers=DEFAULT_HTTP_WORKERS, max_pending=DEFAULT_HTTP_PENDING,
+                 max_upload_size=DEFAULT_MAX_UPLOAD_SIZE):
         self.host = host
         self.port = port
         self.database = database
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_upload_size = max_upload_size
         
         self.clients = clients
+        self.presence = presence
         self.http_server = None
         self.server_thread = None
         
-        log_http(f"FileTransferServer initialized on {host}:{port}")
+        log_http(f"FileTransferServer initialized on {host}:{port} "
+                 f"({max_workers} workers, {max_pending} pending connections, "
+                 f"uploads up to {max_upload_size} bytes)")
+    
+    def create_http_server(self, handler):
+        return PooledHTTPServer((self.host, self.port), handler, self.max_workers, self.max_pending)
         
     def start(self):
         """Start the HTTP file transfer server"""
         log_http(f"Starting HTTP file transfer server...")
         
         def handler(*args, **kwargs):
-            return FileTransferHandler(*args, database=self.database, clients=self.clients, **kwargs)
+            return FileTransferHandler(*args, database=self.database, clients=self.clients,
+                                       presence=self.presence, max_upload_size=self.max_upload_size,
+                                       **kwargs)
         
         try:
-            self.http_server = HTTPServer((self.host, self.port), handler)
+            self.http_server = self.create_http_server(handler)
             log_http(f" HTTP server socket bound to {self.host}:{self.port}")
         except Exception as e:
             log_http(f" Failed to bind HTTP server: {e}", "ERROR")
@@ -391,93 +838,332 @@ class FileTransferServer:
 class FileTransferDatabase:
     """Mixin class to add file transfer capabilities to your existing database"""
     
+    _manager_lock = threading.Lock()
+    
+    # File contents live in the blob store; file_data is only set on legacy
+    # rows that migrate_blobs.py has not moved out yet
+    SHARED_FILES_TABLE = '''
+        CREATE TABLE IF NOT EXISTS shared_files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file_id TEXT UNIQUE NOT NULL,
+            filename TEXT NOT NULL,
+            file_data BLOB,
+            content_hash TEXT,
+            sender TEXT NOT NULL,
+            recipient TEXT,
+            group_name TEXT,
+            file_size INTEGER,
+            mime_type TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    '''
+    
+    def get_connection(self):
+        """Return the calling thread's long-lived connection to self.db_file"""
+        manager = getattr(self, 'connection_manager', None)
+        if manager is None:
+            with self._manager_lock:
+                manager = getattr(self, 'connection_manager', None)
+                if manager is None:
+                    manager = self.connection_manager = SQLiteConnectionManager(self.db_file)
+        return manager.get_connection()
+    
+    def get_blob_store(self):
+        """Return the blob store kept next to the database file"""
+        store = getattr(self, 'blob_store', None)
+        if store is None:
+            with self._manager_lock:
+                store = getattr(self, 'blob_store', None)
+                if store is None:
+                    blob_dir = os.path.splitext(os.path.abspath(self.db_file))[0] + '_files'
+                    store = self.blob_store = BlobStore(blob_dir)
+                    log_database_file(f"Blob store at {blob_dir}")
+        return store
+    
+    def close_connections(self):
+        """Close every pooled connection; call on shutdown"""
+        manager = getattr(self, 'connection_manager', None)
+        if manager is not None:
+            manager.close_all()
+    
     def init_file_tables(self):
         """Initialize file-related tables"""
         log_database_file("Initializing file transfer tables")
-        conn = sqlite3.connect(self.db_file)
+        conn = self.get_connection()
         cursor = conn.cursor()
         
         # Enhanced files table
+        cursor.execute(self.SHARED_FILES_TABLE)
+        conn.commit()
+        
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(shared_files)')]
+        if 'content_hash' not in columns:
+            self.upgrade_shared_files_table(columns)
+        
+        # Reference counting for deduplicated blobs
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_shared_files_hash ON shared_files (content_hash)')
+        
+        # Resumable uploads in progress and the chunks acknowledged so far
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS shared_files (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                file_id TEXT UNIQUE NOT NULL,
+            CREATE TABLE IF NOT EXISTS chunked_uploads (
+                upload_id TEXT PRIMARY KEY,
                 filename TEXT NOT NULL,
-                file_data BLOB NOT NULL,
+                file_size INTEGER NOT NULL,
+                chunk_size INTEGER NOT NULL,
+                sha256 TEXT,
                 sender TEXT NOT NULL,
                 recipient TEXT,
                 group_name TEXT,
-                file_size INTEGER,
-                mime_type TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                created_at REAL NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS upload_chunks (
+                upload_id TEXT NOT NULL,
+                chunk_offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                PRIMARY KEY (upload_id, chunk_offset)
             )
         ''')
-        
         conn.commit()
-        conn.close()
         log_database_file("File transfer tables initialized")
     
+    def upgrade_shared_files_table(self, columns):
+        """Rebuild a pre-blob-store shared_files table (file_data NOT NULL, no content_hash).
+        
+        SQLite cannot relax NOT NULL in place, so rows are copied into the new
+        table. Their file_data stays inline until migrate_blobs.py moves it out.
+        """
+        log_database_file("Upgrading shared_files table for the blob store", "MIGRATE")
+        copied = ', '.join(c for c in columns if c != 'content_hash')
+        conn = self.get_connection()
+        conn.execute('BEGIN')
+        with conn:
+            conn.execute('ALTER TABLE shared_files RENAME TO shared_files_legacy')
+            conn.execute(self.SHARED_FILES_TABLE)
+            conn.execute(f'INSERT INTO shared_files ({copied}) SELECT {copied} FROM shared_files_legacy')
+            conn.execute('DROP TABLE shared_files_legacy')
+        log_database_file("shared_files table upgraded; run migrate_blobs.py to move file data out", "MIGRATE")
+    
+    def migrate_legacy_blobs(self, batch_size=20):
+        """Move inline file_data into the blob store; returns the number of files moved.
+        
+        Works in small batches so memory stays bounded by batch_size files and
+        an interrupted run can simply be restarted.
+        """
+        store = self.get_blob_store()
+        conn = self.get_connection()
+        moved = 0
+        while True:
+            rows = conn.execute('''
+                SELECT id, file_data FROM shared_files
+                WHERE file_data IS NOT NULL
+                LIMIT ?
+            ''', (batch_size,)).fetchall()
+            if not rows:
+                break
+            
+            with store.lock, conn:
+                for row_id, file_data in rows:
+                    content_hash, size = store.put_bytes(bytes(file_data))
+                    conn.execute('''
+                        UPDATE shared_files SET content_hash = ?, file_size = ?, file_data = NULL
+                        WHERE id = ?
+                    ''', (content_hash, size, row_id))
+            moved += len(rows)
+            log_database_file(f"Moved {moved} files to the blob store", "MIGRATE")
+        return moved
+    
     def save_file(self, file_id, filename, file_data, sender, recipient=None, group_name=None):
-        """Save a file to the database"""
+        """Save a file's contents to the blob store and its metadata to the database"""
         try:
             target = group_name or recipient or "BROADCAST"
             log_database_file(f"Saving file: {filename} ({len(file_data)} bytes) from {sender} to {target}")
             
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
+            store = self.get_blob_store()
+            with store.lock:
+                content_hash, file_size = store.put_bytes(file_data)
+                return self.save_file_record(file_id, filename, content_hash, file_size,
+                                             sender, recipient, group_name)
+        except Exception as e:
+            log_database_file(f" Error saving file: {e}")
+            return False
+    
+    def save_file_record(self, file_id, filename, content_hash, file_size, sender, recipient=None, group_name=None):
+        """Record metadata for a blob already in the store; caller holds the store lock"""
+        try:
             # Determine MIME type
             mime_type, _ = mimetypes.guess_type(filename)
             if not mime_type:
                 mime_type = 'application/octet-stream'
             log_database_file(f"MIME type determined: {mime_type}")
             
-            cursor.execute('''
-                INSERT INTO shared_files (file_id, filename, file_data, sender, recipient, group_name, file_size, mime_type)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (file_id, filename, file_data, sender, recipient, group_name, len(file_data), mime_type))
-            
-            conn.commit()
-            conn.close()
-            log_database_file(f" File saved successfully with ID: {file_id}")
+            conn = self.get_connection()
+            with conn:
+                conn.execute('''
+                    INSERT INTO shared_files (file_id, filename, content_hash, sender, recipient, group_name, file_size, mime_type)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (file_id, filename, content_hash, sender, recipient, group_name, file_size, mime_type))
+
+            log_database_file(f" File saved successfully with ID: {file_id} (blob {content_hash[:12]})")
             return True
         except Exception as e:
             log_database_file(f" Error saving file: {e}")
             return False
     
+    def create_chunked_upload(self, upload_id, filename, file_size, chunk_size, sender,
+                              recipient=None, group_name=None, sha256=None):
+        """Record a new resumable upload; its data goes to the store's partial file"""
+        conn = self.get_connection()
+        with conn:
+            conn.execute('''
+                INSERT INTO chunked_uploads (upload_id, filename, file_size, chunk_size, sha256,
+                                             sender, recipient, group_name, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (upload_id, filename, file_size, chunk_size, sha256, sender, recipient, group_name, time.time()))
+        log_database_file(f"Chunked upload {upload_id} created for {filename}")
+    
+    def get_chunked_upload(self, upload_id):
+        """Upload metadata plus the offsets of acknowledged chunks, or None"""
+        conn = self.get_connection()
+        row = conn.execute('''
+            SELECT upload_id, filename, file_size, chunk_size, sha256, sender, recipient, group_name, created_at
+            FROM chunked_uploads WHERE upload_id = ?
+        ''', (upload_id,)).fetchone()
+        if not row:
+            return None
+        upload = dict(zip(('upload_id', 'filename', 'file_size', 'chunk_size', 'sha256',
+                           'sender', 'recipient', 'group_name', 'created_at'), row))
+        upload['received'] = [r[0] for r in conn.execute(
+            'SELECT chunk_offset FROM upload_chunks WHERE upload_id = ?', (upload_id,))]
+        return upload
+    
+    def record_upload_chunk(self, upload_id, offset, length, sha256):
+        """Acknowledge a chunk once its data is on disk"""
+        conn = self.get_connection()
+        with conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO upload_chunks (upload_id, chunk_offset, length, sha256)
+                VALUES (?, ?, ?, ?)
+            ''', (upload_id, offset, length, sha256))
+    
+    def forget_upload_chunk(self, upload_id, offset):
+        conn = self.get_connection()
+        with conn:
+            conn.execute('DELETE FROM upload_chunks WHERE upload_id = ? AND chunk_offset = ?', (upload_id, offset))
+    
+    def delete_chunked_upload(self, upload_id):
+        """Forget an upload and remove its partial file if still there"""
+        conn = self.get_connection()
+        with conn:
+            conn.execute('DELETE FROM upload_chunks WHERE upload_id = ?', (upload_id,))
+            conn.execute('DELETE FROM chunked_uploads WHERE upload_id = ?', (upload_id,))
+        try:
+            os.remove(self.get_blob_store().partial_path(upload_id))
+        except FileNotFoundError:
+            pass
+    
+    def expire_chunked_uploads(self, max_age_seconds):
+        """Drop uploads started more than max_age_seconds ago"""
+        expired = [row[0] for row in self.get_connection().execute(
+            'SELECT upload_id FROM chunked_uploads WHERE created_at < ?', (time.time() - max_age_seconds,))]
+        for upload_id in expired:
+            self.delete_chunked_upload(upload_id)
+        if expired:
+            log_database_file(f"Expired {len(expired)} abandoned chunked uploads")
+        return len(expired)
+    
     def get_file(self, file_id):
-        """Retrieve a file from the database"""
+        """Retrieve a file's metadata and contents"""
         try:
             log_database_file(f"Retrieving file with ID: {file_id}")
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
+            cursor = self.get_connection().cursor()
             
             cursor.execute('''
-                SELECT filename, file_data, sender, recipient, group_name, timestamp
+                SELECT filename, file_data, content_hash, sender, recipient, group_name, timestamp
                 FROM shared_files 
                 WHERE file_id = ?
             ''', (file_id,))
             
             result = cursor.fetchone()
-            conn.close()
             
-            if result:
-                filename, file_data, sender, recipient, group_name, timestamp = result
-                log_database_file(f" File found: {filename} ({len(file_data)} bytes)")
-            else:
+            if not result:
                 log_database_file(f" File not found: {file_id}")
-                
-            return result
+                return None
+            
+            filename, file_data, content_hash, sender, recipient, group_name, timestamp = result
+            if file_data is None:
+                file_data = self.get_blob_store().read_bytes(content_hash)
+            log_database_file(f" File found: {filename} ({len(file_data)} bytes)")
+            return filename, file_data, sender, recipient, group_name, timestamp
         except Exception as e:
             log_database_file(f" Error retrieving file: {e}")
             return None
     
+    def get_file_info(self, file_id):
+        """Metadata needed to stream a file, without reading its contents.
+        
+        file_data is only set for legacy rows still stored inline.
+        """
+        try:
+            row = self.get_connection().execute('''
+                SELECT filename, content_hash, file_size, mime_type, sender, recipient,
+                       group_name, timestamp, file_data
+                FROM shared_files
+                WHERE file_id = ?
+            ''', (file_id,)).fetchone()
+            if not row:
+                log_database_file(f" File not found: {file_id}")
+                return None
+            
+            info = dict(zip(('filename', 'content_hash', 'file_size', 'mime_type', 'sender',
+                             'recipient', 'group_name', 'timestamp', 'file_data'), row))
+            if info['file_data'] is not None:
+                info['file_size'] = len(info['file_data'])
+            elif info['file_size'] is None:
+                info['file_size'] = self.get_blob_store().size(info['content_hash'])
+            return info
+        except Exception as e:
+            log_database_file(f" Error retrieving file info: {e}")
+            return None
+    
+    def delete_file(self, file_id, sender):
+        """Delete a file shared by sender; its blob goes once nothing references it"""
+        try:
+            log_database_file(f"Deleting file {file_id} for {sender}")
+            store = self.get_blob_store()
+            conn = self.get_connection()
+            with store.lock:
+                row = conn.execute('''
+                    SELECT content_hash FROM shared_files WHERE file_id = ? AND sender = ?
+                ''', (file_id, sender)).fetchone()
+                if not row:
+                    log_database_file(f" File {file_id} not found or not owned by {sender}")
+                    return False
+                
+                content_hash = row[0]
+                with conn:
+                    conn.execute('DELETE FROM shared_files WHERE file_id = ?', (file_id,))
+                
+                if content_hash:
+                    references = conn.execute('''
+                        SELECT COUNT(*) FROM shared_files WHERE content_hash = ?
+                    ''', (content_hash,)).fetchone()[0]
+                    if references == 0:
+                        store.delete(content_hash)
+            
+            log_database_file(f" File {file_id} deleted")
+            return True
+        except Exception as e:
+            log_database_file(f" Error deleting file: {e}")
+            return False
+    
     def get_user_files(self, username):
         """Get all files accessible to a user"""
         try:
             log_database_file(f"Getting accessible files for user: {username}")
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
+            cursor = self.get_connection().cursor()
             
             # Get user's groups
             cursor.execute('SELECT group_name FROM group_members WHERE member = ?', (username,))
@@ -519,7 +1205,6 @@ class FileTransferDatabase:
                     'download_url': f'/download/{row[0]}'
                 })
             
-            conn.close()
             log_database_file(f" Found {len(files)} accessible files for {username}")
             return files
         except Exception as e:
@@ -528,10 +1213,8 @@ class FileTransferDatabase:
     
     def get_group_members(self, group_name):
         log_database_file(f"Getting members for group: {group_name}")
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+        cursor = self.get_connection().cursor()
         cursor.execute("SELECT member FROM group_members WHERE group_name = ?", (group_name,))
         members = [row[0] for row in cursor.fetchall()]
-        conn.close()
         log_database_file(f"Group {group_name} has {len(members)} members")
         return members
@@ -0,0 +1,82 @@
+# framing.py - Length-prefixed framing for the TCP chat protocol
+#
+# Every protocol message ("BROADCAST|...", "CODE_UPDATE|{...}", ...) travels
+# as one frame: a 4-byte big-endian payload length followed by the UTF-8
+# payload. TCP is a byte stream, so a single recv() can contain several
+# frames or only part of one; FrameDecoder reassembles them per connection.
+import struct
+
+HEADER = struct.Struct('!I')
+HEADER_SIZE = HEADER.size
+
+# Upper bound for a single frame; protects the reassembly buffer from bogus lengths
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+RECV_SIZE = 65536
+
+
+class FrameTooLarge(ValueError):
+    """Raised when a frame header announces more than the allowed payload size"""
+
+
+def encode_frame(payload):
+    """Return the wire representation of a payload (str or bytes)"""
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    if len(payload) > MAX_FRAME_SIZE:
+        raise FrameTooLarge(f"Frame of {len(payload)} bytes exceeds {MAX_FRAME_SIZE}")
+    return HEADER.pack(len(payload)) + payload
+
+
+class FrameDecoder:
+    """Per-connection reassembly buffer for length-prefixed frames"""
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def feed(self, data):
+        """Append bytes received from the socket"""
+        if self.offset:
+            # Drop consumed bytes before growing the buffer
+            del self.buffer[:self.offset]
+            self.offset = 0
+        self.buffer += data
+
+    def next_frame(self):
+        """Return the next complete payload as bytes, or None if more data is needed"""
+        available = len(self.buffer) - self.offset
+        if available < HEADER_SIZE:
+            return None
+
+        (length,) = HEADER.unpack_from(self.buffer, self.offset)
+        if length > self.max_frame_size:
+            raise FrameTooLarge(f"Frame of {length} bytes exceeds {self.max_frame_size}")
+        if available < HEADER_SIZE + length:
+            return None
+
+        start = self.offset + HEADER_SIZE
+        payload = bytes(self.buffer[start:start + length])
+        self.offset = start + length
+        return payload
+
+    def frames(self):
+        """Yield every complete payload currently buffered"""
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                return
+            yield frame
+
+
+def recv_frame(sock, decoder, bufsize=RECV_SIZE):
+    """Block until one frame is available on a socket; returns None on EOF"""
+    while True:
+        frame = decoder.next_frame()
+        if frame is not None:
+            return frame
+        data = sock.recv(bufsize)
+        if not data:
+            return None
+        decoder.feed(data)
@@ -0,0 +1,497 @@
+# interpreter_pool.py - Pre-started Python and Node.js workers for short runs
+#
+# Starting `python` or `node` for every Run click costs 50-150 ms before the
+# first line of user code executes. An InterpreterPool keeps a few worker
+# interpreters already started and waiting. A run is sent to an idle worker
+# as one JSON line on its stdin; the worker runs the code as its main
+# program with stdin fed from the request, sends what the program prints as
+# {"stream", "data"} lines while it runs, and ends with a {"return_code"}
+# line.
+#
+# Every worker serves exactly one run and is then killed and replaced: one
+# interpreter cannot be cleaned up well enough to be handed to the next
+# submitter (a patched module or an escaped Node.js vm context outlives any
+# reset), so the pool only saves interpreter startup. Since the worker is
+# the submitter's own process, the program can write to the reply channel
+# too; that only affects the report of its own run, and the CPU time is
+# measured from outside where the platform allows.
+#
+# Workers run under the same sandbox limits as one-off processes, started in
+# their own session (and cgroup, if configured). RLIMIT_CPU counts a
+# process's whole life, so before its run the pool moves the worker's CPU
+# limit to "used while starting + cpu_seconds". peak_rss is the worker's own
+# peak, interpreter included.
+import collections
+import json
+import os
+import select
+import shutil
+import subprocess
+import threading
+import time
+from datetime import datetime
+from execution_output import OutputCollector
+from sandbox import (EXIT_MESSAGES, RunCgroup, exit_reason, kill_process_group, log_sandbox,
+                     make_preexec, merge_limits, out_of_memory, process_cpu_time, set_cpu_budget,
+                     signal_name)
+
+READ_SIZE = 64 * 1024
+
+PYTHON_WORKER = r"""
+import io, json, linecache, os, resource, sys, threading, traceback, types
+
+# Keep private copies of the pipes; the program gets in-memory streams and
+# anything written to the raw file descriptors goes to /dev/null
+control = os.fdopen(os.dup(0), 'r', encoding='utf-8')
+reply = os.fdopen(os.dup(1), 'w', encoding='utf-8')
+null = os.open(os.devnull, os.O_RDWR)
+os.dup2(null, 0)
+os.dup2(null, 1)
+
+worker_pid = os.getpid()
+
+def send(message):
+    reply.write(json.dumps(message) + '\n')
+    reply.flush()
+
+
+def usage():
+    # CPU seconds so far, and peak RSS in bytes, of this worker and its children
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+    return cpu, max(own.ru_maxrss, children.ru_maxrss) * 1024
+
+
+class OutputStream(io.TextIOBase):
+    # Line-buffered stream that forwards what the program prints to the pool
+
+    encoding = 'utf-8'
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.pending = []
+        self.pending_size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if not isinstance(text, str):
+            raise TypeError(f"write() argument must be str, not {type(text).__name__}")
+        self.pending.append(text)
+        self.pending_size += len(text)
+        if '\n' in text or self.pending_size >= 8192:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self.pending:
+            send({'stream': self.stream, 'data': ''.join(self.pending)})
+            self.pending = []
+            self.pending_size = 0
+
+
+def run_program(code):
+    # Exit status of the program, and whether it ran out of memory
+    main = types.ModuleType('__main__')
+    main.__file__ = 'main.py'
+    sys.modules['__main__'] = main
+    linecache.cache['main.py'] = (len(code), None, code.splitlines(True), 'main.py')
+    try:
+        exec(compile(code, 'main.py', 'exec'), main.__dict__)
+        # Like interpreter shutdown, let the program's own threads finish
+        for thread in threading.enumerate():
+            if thread is not threading.main_thread() and not thread.daemon:
+                thread.join()
+    except SystemExit as e:
+        if e.code is None:
+            return 0, False
+        if isinstance(e.code, int):
+            return e.code, False
+        print(e.code, file=sys.stderr)
+        return 1, False
+    except BaseException as e:
+        # Leave the worker's frames out of the traceback
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next, file=sys.stderr)
+        return 1, isinstance(e, MemoryError)
+    return 0, False
+
+
+request = json.loads(control.readline())
+stdout, stderr = OutputStream('stdout'), OutputStream('stderr')
+os.chdir(request['cwd'])
+sys.argv = ['main.py']
+sys.stdin, sys.stdout, sys.stderr = io.StringIO(request['input']), stdout, stderr
+
+cpu_before, _ = usage()
+return_code, memory_error = run_program(request['code'])
+stdout.flush()
+stderr.flush()
+if os.getpid() == worker_pid:
+    # (a child the program forked and that fell off the end of the code
+    # only exits)
+    cpu_after, peak_rss = usage()
+    send({'return_code': return_code, 'memory_error': memory_error,
+          'cpu_time': cpu_after - cpu_before, 'peak_rss': peak_rss})
+os._exit(return_code & 0xff)
+"""
+
+NODE_WORKER = r"""
+const fs = require('fs');
+const path = require('path');
+const { Console } = require('console');
+const { Readable, Writable } = require('stream');
+
+let cpuStart = null;
+let finished = false;
+
+function send(message) {
+    fs.writeSync(1, JSON.stringify(message) + '\n');
+}
+
+function finish(returnCode) {
+    if (finished || !cpuStart) return;
+    finished = true;
+    const cpu = process.cpuUsage(cpuStart);
+    send({
+        return_code: returnCode,
+        cpu_time: (cpu.user + cpu.system) / 1e6,
+        peak_rss: process.resourceUsage().maxRSS * 1024
+    });
+}
+
+function fail(error) {
+    let message = error && error.stack ? error.stack : String(error);
+    // Drop the worker's own frames below the program's
+    const workerFrame = message.search(/\n\s+at .*\[eval\]/);
+    if (workerFrame >= 0) message = message.slice(0, workerFrame);
+    send({ stream: 'stderr', data: message + '\n' });
+    process.exit(1);
+}
+
+function execute(request) {
+    const sink = (stream) => new Writable({
+        write(chunk, encoding, callback) {
+            if (!finished) send({ stream, data: chunk.toString() });
+            callback();
+        }
+    });
+    const stdout = sink('stdout');
+    const stderr = sink('stderr');
+    const inputLines = request.input.split('\n');
+    let inputIndex = 0;
+
+    // The program runs as this process's main module, as `node main.js`
+    // would, with its standard streams replaced by the pool's
+    for (const [name, stream] of [['stdout', stdout], ['stderr', stderr],
+                                  ['stdin', Readable.from([request.input])]]) {
+        Object.defineProperty(process, name, { value: stream, configurable: true });
+    }
+    globalThis.console = new Console(stdout, stderr);
+    globalThis.prompt = (text) => {
+        if (text) stdout.write(text);
+        return inputLines[inputIndex++] || '';
+    };
+    const filename = path.join(request.cwd, 'main.js');
+    process.argv = [process.argv[0], filename];
+    process.chdir(request.cwd);
+    fs.writeFileSync(filename, request.code);
+
+    process.on('exit', finish);
+    process.on('uncaughtException', fail);
+    process.on('unhandledRejection', fail);
+    cpuStart = process.cpuUsage();
+    require(filename);
+}
+
+let buffered = '';
+process.stdin.setEncoding('utf8');
+process.stdin.on('data', (chunk) => {
+    buffered += chunk;
+    const index = buffered.indexOf('\n');
+    if (index < 0) return;
+    // One run per worker: stop listening, so the process ends with the program
+    process.stdin.destroy();
+    execute(JSON.parse(buffered.slice(0, index)));
+});
+"""
+
+INTERPRETERS = {
+    'python': ['python', '-u', '-c', PYTHON_WORKER],
+    'javascript': ['node', '-e', NODE_WORKER]
+}
+
+
+def log_interpreter_pool(message, language=None):
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    pool_info = f"[{language}]" if language else "[POOL]"
+    print(f"[INTERPRETER] {timestamp} {pool_info} {message}")
+
+
+class WorkerCrashed(Exception):
+    """The worker exited or wrote something that is not a reply"""
+
+    def __init__(self, message, return_code=None):
+        super().__init__(message)
+        self.return_code = return_code
+
+
+class OutputLimitExceeded(Exception):
+    """The run printed more than the output cap"""
+
+
+class InterpreterWorker:
+    """One running interpreter waiting for the JSON line of its single run"""
+
+    def __init__(self, language, limits, cgroup_parent=None):
+        self.language = language
+        self.buffer = b''
+        self.final_cpu_time = None
+        self.cgroup = None
+        if cgroup_parent is not None:
+            try:
+                self.cgroup = RunCgroup(cgroup_parent, limits)
+            except OSError as e:
+                log_sandbox(f"Starting {language} worker without a cgroup: {e}", "WARN")
+        options = {}
+        if os.name != 'nt':
+            options = {'start_new_session': True, 'preexec_fn': make_preexec(limits, self.cgroup)}
+        self.process = subprocess.Popen(
+            INTERPRETERS[language],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            **options
+        )
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def run(self, code, input_data, cwd, timeout, output):
+        """Run code, feeding printed text to output; returns the final reply.
+
+        Raises TimeoutError, OutputLimitExceeded or WorkerCrashed.
+        """
+        request = json.dumps({'code': code, 'input': input_data or '', 'cwd': cwd}) + '\n'
+        try:
+            self.process.stdin.write(request.encode('utf-8'))
+            self.process.stdin.flush()
+        except OSError as e:
+            raise WorkerCrashed(f"worker stdin closed: {e}")
+
+        deadline = time.monotonic() + timeout
+        fd = self.process.stdout.fileno()
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError()
+            readable, _, _ = select.select([fd], [], [], remaining)
+            if not readable:
+                continue
+            data = os.read(fd, READ_SIZE)
+            if not data:
+                return_code = self.wait()
+                raise WorkerCrashed(f"worker exited with code {return_code}", return_code)
+            self.buffer += data
+
+            *lines, self.buffer = self.buffer.split(b'\n')
+            # Output lines that arrived together are passed on as one piece per stream
+            printed = []
+            for line in lines:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    raise WorkerCrashed("worker sent a malformed reply")
+                if not isinstance(message, dict) or not self._well_formed(message):
+                    raise WorkerCrashed("worker sent a malformed reply")
+                if 'stream' not in message:
+                    self._add_output(output, printed)
+                    if output.truncated:
+                        raise OutputLimitExceeded()
+                    return message
+                if printed and printed[-1][0] == message['stream']:
+                    printed[-1][1].append(message['data'])
+                else:
+                    printed.append((message['stream'], [message['data']]))
+            self._add_output(output, printed)
+            if output.truncated:
+                raise OutputLimitExceeded()
+
+    @staticmethod
+    def _well_formed(message):
+        if 'stream' in message:
+            return message['stream'] in ('stdout', 'stderr') and isinstance(message.get('data'), str)
+        return_code = message.get('return_code')
+        return isinstance(return_code, int) and not isinstance(return_code, bool)
+
+    @staticmethod
+    def _add_output(output, printed):
+        for stream, pieces in printed:
+            output.add(stream, ''.join(pieces))
+
+    def wait(self):
+        """Reap the worker, keeping its lifetime CPU time for accounting"""
+        if self.final_cpu_time is None and hasattr(os, 'wait4') and self.process.returncode is None:
+            try:
+                _, status, rusage = os.wait4(self.process.pid, 0)
+                self.process.returncode = os.waitstatus_to_exitcode(status)
+                self.final_cpu_time = rusage.ru_utime + rusage.ru_stime
+            except ChildProcessError:
+                pass
+        return self.process.wait()
+
+    def cpu_time(self):
+        """CPU seconds the worker has used in its life so far"""
+        if self.final_cpu_time is not None:
+            return self.final_cpu_time
+        try:
+            return process_cpu_time(self.process.pid)
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def close(self):
+        # The whole session: anything the last run forked goes too
+        kill_process_group(self.process)
+        self.process.wait()
+        for pipe in (self.process.stdin, self.process.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+        if self.cgroup is not None:
+            self.cgroup.close()
+
+    def oom_killed(self):
+        return self.cgroup is not None and self.cgroup.stats()['oom_killed']
+
+
+class InterpreterPool:
+    """Keeps up to size started, unused workers for one language.
+
+    run() takes an idle worker (starting one if none is idle), hands it the
+    code and kills it afterwards. Each used worker is replaced right away so
+    the next run finds a started one.
+    """
+
+    def __init__(self, language, size, limits=None, cgroup_parent=None):
+        self.language = language
+        self.size = size
+        self.limits = limits or merge_limits()
+        self.cgroup_parent = cgroup_parent
+        self.idle = collections.deque()
+        self.lock = threading.Lock()
+        self.closed = False
+        self.started = 0
+        self.recycled = 0
+
+    @staticmethod
+    def available(language):
+        return shutil.which(INTERPRETERS[language][0]) is not None
+
+    def warm_up(self):
+        """Start workers until size are waiting"""
+        while True:
+            with self.lock:
+                if self.closed or len(self.idle) >= self.size:
+                    return
+            worker = self._start_worker()
+            with self.lock:
+                if self.closed:
+                    worker.close()
+                    return
+                self.idle.append(worker)
+
+    def _start_worker(self):
+        worker = InterpreterWorker(self.language, self.limits, self.cgroup_parent)
+        with self.lock:
+            self.started += 1
+        return worker
+
+    def _acquire(self):
+        while True:
+            with self.lock:
+                worker = self.idle.popleft() if self.idle else None
+            if worker is None:
+                return self._start_worker()
+            if worker.alive():
+                return worker
+            worker.close()
+
+    def _retire(self, worker):
+        """Kill a worker after its run; workers are never handed to a second run"""
+        worker.close()
+        with self.lock:
+            self.recycled += 1
+        # Replace it off the caller's thread; Popen returns before the interpreter is up anyway
+        threading.Thread(target=self.warm_up, daemon=True).start()
+
+    def run(self, code, input_data, cwd, timeout, job=None, on_output=None):
+        """Execute code on a warm worker; returns a CodeExecutor-style result dict"""
+        worker = self._acquire()
+        output = OutputCollector(on_output)
+        cpu_before = worker.cpu_time()
+        set_cpu_budget(worker.process.pid, self.limits.get('cpu_seconds'))
+        if job is not None:
+            job.attach_process(worker.process)
+        reply = {}
+        try:
+            reply = worker.run(code, input_data, cwd, timeout, output)
+            return_code = reply['return_code']
+            reason = exit_reason(return_code, self.limits, memory_error=reply.get('memory_error'))
+        except TimeoutError:
+            return_code, reason = -1, 'timeout'
+        except OutputLimitExceeded:
+            return_code, reason = -1, 'output_limit'
+        except WorkerCrashed as e:
+            if job is not None and job.cancelled:
+                return_code, reason = -1, 'cancelled'
+            elif e.return_code is None:
+                log_interpreter_pool(f"Worker crashed: {e}", self.language)
+                return_code, reason = -1, 'crashed'
+            else:
+                # os._exit() and deaths by signal, including SIGXCPU from the CPU limit
+                return_code = e.return_code
+                reason = exit_reason(return_code, self.limits, oom_killed=worker.oom_killed(),
+                                     memory_error=out_of_memory(output.text('stderr')))
+        finally:
+            if job is not None:
+                job.detach_process(worker.process)
+            # Measured from outside when possible: the reply comes from the program's own process
+            cpu_after = worker.cpu_time() if cpu_before is not None else None
+            if cpu_after is not None:
+                cpu_time = cpu_after - cpu_before
+            else:
+                cpu_time = reply.get('cpu_time')
+            self._retire(worker)
+
+        error = output.text('stderr')
+        if reason in EXIT_MESSAGES:
+            error += EXIT_MESSAGES[reason]
+        elif reason == 'signal':
+            error += f"Killed by {signal_name(return_code)}"
+        return {
+            'success': reason == 'exited' and return_code == 0,
+            'output': output.text('stdout'),
+            'error': error,
+            'return_code': return_code,
+            'exit_reason': reason,
+            'cpu_time': round(cpu_time, 3) if cpu_time is not None else None,
+            'peak_rss': reply.get('peak_rss')
+        }
+
+    def shutdown(self):
+        with self.lock:
+            self.closed = True
+            workers = list(self.idle)
+            self.idle.clear()
+        for worker in workers:
+            worker.close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'idle': len(self.idle),
+                'started': self.started,
+                'recycled': self.recycled
+            }
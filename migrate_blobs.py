@@ -0,0 +1,59 @@
+# migrate_blobs.py - Move file contents out of shared_files into the blob store
+#
+# Databases created before the blob store keep every upload inline in
+# shared_files.file_data. Opening them with the current server upgrades the
+# table; this tool then moves the data out in small batches (deduplicating
+# identical files) and vacuums the database to give the space back.
+# Safe to re-run: only rows that still have inline data are touched.
+#
+#   python migrate_blobs.py [--db chat_history.db] [--batch-size 20] [--no-vacuum]
+import argparse
+import os
+import sys
+from datetime import datetime
+from file_transfer import FileTransferDatabase
+
+
+def log_migration(message, level="INFO"):
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    print(f"[MIGRATE {level}] {timestamp} - {message}")
+
+
+class BlobMigrationDatabase(FileTransferDatabase):
+    """Just the file-transfer tables of a chat database"""
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.init_file_tables()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move shared file data from SQLite into the blob store")
+    parser.add_argument('--db', default='chat_history.db', help="chat database to migrate")
+    parser.add_argument('--batch-size', type=int, default=20, help="files moved per transaction")
+    parser.add_argument('--no-vacuum', action='store_true', help="skip VACUUM after moving the data")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        log_migration(f"Database not found: {args.db}", "ERROR")
+        sys.exit(1)
+
+    size_before = os.path.getsize(args.db)
+    db = BlobMigrationDatabase(args.db)
+    moved = db.migrate_legacy_blobs(batch_size=args.batch_size)
+    log_migration(f"Moved {moved} files into {db.get_blob_store().root}")
+
+    if moved and not args.no_vacuum:
+        log_migration("Vacuuming database...")
+        conn = db.get_connection()
+        conn.execute('VACUUM')
+        # In WAL mode the file only shrinks once the log is checkpointed
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        log_migration(f"Database size {size_before / 1048576:.1f} MB -> "
+                      f"{os.path.getsize(args.db) / 1048576:.1f} MB")
+
+    db.close_connections()
+
+
+if __name__ == "__main__":
+    main()
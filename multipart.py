@@ -0,0 +1,166 @@
+# multipart.py - Incremental multipart/form-data parser for uploads
+#
+# The request body is read in fixed-size chunks and scanned for the part
+# delimiter as it arrives, carrying a delimiter-sized tail across chunk
+# edges. File parts are handed to a sink chunk by chunk (the upload handler
+# passes a blob store writer, which hashes while it writes), so peak memory
+# is a few chunk sizes however large the upload is. Small text fields are
+# collected in memory up to max_field_size.
+import re
+
+CHUNK_SIZE = 64 * 1024
+MAX_HEADER_SIZE = 16 * 1024
+MAX_FIELD_SIZE = 64 * 1024
+
+DISPOSITION_PARAM = re.compile(r';\s*([\w*]+)\s*=\s*(?:"((?:[^"\\]|\\.)*)"|([^;\s]*))')
+
+
+class MultipartError(ValueError):
+    """Malformed or oversized multipart body"""
+
+
+def get_boundary(content_type):
+    """Extract the boundary from a multipart/form-data Content-Type header"""
+    match = re.search(r'boundary=(?:"([^"]+)"|([^;\s]+))', content_type)
+    if not match:
+        raise MultipartError("Missing multipart boundary")
+    return (match.group(1) or match.group(2)).encode('latin-1')
+
+
+def parse_content_disposition(value):
+    """Return the parameters of a Content-Disposition header, e.g. name and filename"""
+    params = {}
+    for key, quoted, token in DISPOSITION_PARAM.findall(value):
+        if quoted:
+            params[key.lower()] = re.sub(r'\\(.)', r'\1', quoted)
+        else:
+            params[key.lower()] = token
+    return params
+
+
+def parse_part_headers(raw):
+    headers = {}
+    for line in raw.decode('utf-8', 'replace').split('\r\n'):
+        if ':' in line:
+            key, value = line.split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+    return headers
+
+
+class _FieldSink:
+    """Collects a small form field or header block in memory"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.data = bytearray()
+
+    def write(self, data):
+        if len(self.data) + len(data) > self.max_size:
+            raise MultipartError(f"Form field or part headers larger than {self.max_size} bytes")
+        self.data += data
+
+
+class _DiscardSink:
+    def write(self, data):
+        pass
+
+
+class MultipartParser:
+    """Streams a multipart/form-data body from a file-like object.
+
+    ``open_file(field_name, filename)`` is called for each file part and
+    returns an object with ``write(bytes)``, or None to discard the part.
+    ``parse()`` returns ``(fields, files)``: text fields as ``{name: str}``
+    and file parts as ``{name: (filename, sink)}``.
+    """
+
+    def __init__(self, rfile, boundary, content_length, open_file,
+                 chunk_size=CHUNK_SIZE, max_field_size=MAX_FIELD_SIZE):
+        self.rfile = rfile
+        self.remaining = content_length
+        self.open_file = open_file
+        self.chunk_size = chunk_size
+        self.max_field_size = max_field_size
+
+        # The first delimiter has no leading CRLF; pretend it does
+        self.delimiter = b'\r\n--' + boundary
+        self.buffer = bytearray(b'\r\n')
+
+    def _fill(self):
+        """Read the next chunk of the body; False once it is exhausted"""
+        if self.remaining <= 0:
+            return False
+        data = self.rfile.read(min(self.chunk_size, self.remaining))
+        if not data:
+            raise MultipartError("Request body ended early")
+        self.remaining -= len(data)
+        self.buffer += data
+        return True
+
+    def _read_until(self, marker, sink):
+        """Pass bytes before marker to sink and consume the marker.
+
+        Only the tail that could be the start of a split marker is kept
+        between reads, so the buffer never grows past chunk + marker size.
+        """
+        keep = len(marker) - 1
+        while True:
+            index = self.buffer.find(marker)
+            if index >= 0:
+                if index:
+                    sink.write(bytes(self.buffer[:index]))
+                del self.buffer[:index + len(marker)]
+                return
+
+            if len(self.buffer) > keep:
+                flush = len(self.buffer) - keep
+                sink.write(bytes(self.buffer[:flush]))
+                del self.buffer[:flush]
+
+            if not self._fill():
+                raise MultipartError("Missing closing boundary")
+
+    def _read_exactly(self, count):
+        while len(self.buffer) < count:
+            if not self._fill():
+                raise MultipartError("Missing closing boundary")
+        data = bytes(self.buffer[:count])
+        del self.buffer[:count]
+        return data
+
+    def parse(self):
+        fields = {}
+        files = {}
+        discard = _DiscardSink()
+
+        # Skip the preamble up to the first delimiter
+        self._read_until(self.delimiter, discard)
+
+        while True:
+            suffix = self._read_exactly(2)
+            if suffix == b'--':
+                break
+            if suffix != b'\r\n':
+                raise MultipartError("Malformed boundary line")
+
+            raw_headers = _FieldSink(MAX_HEADER_SIZE)
+            self._read_until(b'\r\n\r\n', raw_headers)
+            headers = parse_part_headers(bytes(raw_headers.data))
+            disposition = parse_content_disposition(headers.get('content-disposition', ''))
+            name = disposition.get('name')
+
+            if 'filename' in disposition:
+                sink = self.open_file(name, disposition['filename']) or discard
+                self._read_until(self.delimiter, sink)
+                if sink is not discard:
+                    files[name] = (disposition['filename'], sink)
+            else:
+                sink = _FieldSink(self.max_field_size)
+                self._read_until(self.delimiter, sink)
+                if name:
+                    fields[name] = sink.data.decode('utf-8')
+
+        # Drain the epilogue so a keep-alive connection stays in sync
+        while self._fill():
+            self.buffer.clear()
+        return fields, files
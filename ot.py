@@ -0,0 +1,334 @@
+# ot.py - Operational transformation for collaborative code sessions
+#
+# When two participants edit at once their updates are made against the same
+# document version. Instead of resyncing the loser, the server orders all
+# updates of a session and transforms each incoming operation against the
+# operations it missed, so every edit survives and all editors converge on
+# the same text. This is the server-ordered scheme of ot.js / Google Wave:
+#
+# - TextOperation: a sequence of retain(n) / insert(text) / delete(n)
+#   components spanning the whole document, with apply(), compose() and
+#   transform().
+# - ServerDocument: the canonical text, its revision and the recent history
+#   needed to transform operations made against older revisions.
+# - ClientSync: the editor side. At most one operation is in flight; edits
+#   made meanwhile are composed into a buffer and sent once the server
+#   acknowledges, and incoming operations are transformed past both.
+#
+# On the wire an operation is a JSON list: a positive int retains, a negative
+# int deletes and a string inserts, e.g. [12, "x", -3, 40].
+import collections
+import itertools
+
+from code_delta import diff_edit
+
+# Operations kept per session for clients that are behind; a client further
+# behind than this is sent the whole document instead
+MAX_HISTORY = 1000
+
+
+def _is_retain(component):
+    return isinstance(component, int) and component > 0
+
+
+def _is_delete(component):
+    return isinstance(component, int) and component < 0
+
+
+class TextOperation:
+    """An edit of a whole document of base_length characters"""
+
+    def __init__(self):
+        self.ops = []
+        self.base_length = 0    # length of the text the operation applies to
+        self.target_length = 0  # length of the text it produces
+
+    def retain(self, n):
+        """Skip over n characters"""
+        if n < 0:
+            raise ValueError("retain expects a non-negative count")
+        if n == 0:
+            return self
+        self.base_length += n
+        self.target_length += n
+        if self.ops and _is_retain(self.ops[-1]):
+            self.ops[-1] += n
+        else:
+            self.ops.append(n)
+        return self
+
+    def insert(self, text):
+        """Insert text at the current position"""
+        if not text:
+            return self
+        self.target_length += len(text)
+        ops = self.ops
+        if ops and isinstance(ops[-1], str):
+            ops[-1] += text
+        elif ops and _is_delete(ops[-1]):
+            # Inserts go before deletes, so equal edits have one representation
+            if len(ops) > 1 and isinstance(ops[-2], str):
+                ops[-2] += text
+            else:
+                ops.insert(len(ops) - 1, text)
+        else:
+            ops.append(text)
+        return self
+
+    def delete(self, n):
+        """Remove the next n characters"""
+        if n < 0:
+            raise ValueError("delete expects a non-negative count")
+        if n == 0:
+            return self
+        self.base_length += n
+        if self.ops and _is_delete(self.ops[-1]):
+            self.ops[-1] -= n
+        else:
+            self.ops.append(-n)
+        return self
+
+    def is_noop(self):
+        return all(_is_retain(component) for component in self.ops)
+
+    def __eq__(self, other):
+        return isinstance(other, TextOperation) and self.ops == other.ops
+
+    def __repr__(self):
+        return f"TextOperation({self.ops!r})"
+
+    # --- conversions ---------------------------------------------------------
+
+    def to_json(self):
+        return list(self.ops)
+
+    @classmethod
+    def from_json(cls, components):
+        """Build an operation from its wire form; raises ValueError if malformed"""
+        if not isinstance(components, list):
+            raise ValueError("operation must be a list")
+        operation = cls()
+        for component in components:
+            if isinstance(component, str):
+                operation.insert(component)
+            elif isinstance(component, int) and not isinstance(component, bool):
+                if component > 0:
+                    operation.retain(component)
+                else:
+                    operation.delete(-component)
+            else:
+                raise ValueError(f"bad operation component {component!r}")
+        return operation
+
+    @classmethod
+    def from_edits(cls, edits, length):
+        """Operation equivalent to a code_delta ops list on a length-character text"""
+        operation = cls().retain(length)
+        for edit in edits:
+            pos, removed, inserted = edit['pos'], edit.get('delete', 0), edit.get('insert', '')
+            current = operation.target_length
+            if pos < 0 or removed < 0 or pos + removed > current:
+                raise ValueError(f"edit {edit!r} does not fit a {current} character document")
+            step = cls().retain(pos).insert(inserted).delete(removed).retain(current - pos - removed)
+            operation = operation.compose(step)
+        return operation
+
+    @classmethod
+    def diff(cls, old, new):
+        """Operation turning old into new (one replaced range)"""
+        return cls.from_edits(diff_edit(old, new), len(old))
+
+    def to_edits(self):
+        """The operation as a code_delta ops list, positions in the text being edited"""
+        edits = []
+        pos = 0
+        for component in self.ops:
+            if _is_retain(component):
+                pos += component
+            elif isinstance(component, str):
+                edits.append({'pos': pos, 'delete': 0, 'insert': component})
+                pos += len(component)
+            else:
+                if edits and edits[-1]['pos'] + len(edits[-1]['insert']) == pos and not edits[-1]['delete']:
+                    edits[-1]['delete'] = -component  # an insert followed by a delete is a replace
+                else:
+                    edits.append({'pos': pos, 'delete': -component, 'insert': ''})
+        return edits
+
+    # --- the algebra ---------------------------------------------------------
+
+    def apply(self, text):
+        """The text this operation produces from text"""
+        if len(text) != self.base_length:
+            raise ValueError(f"operation expects {self.base_length} characters, got {len(text)}")
+        parts = []
+        pos = 0
+        for component in self.ops:
+            if _is_retain(component):
+                parts.append(text[pos:pos + component])
+                pos += component
+            elif isinstance(component, str):
+                parts.append(component)
+            else:
+                pos -= component
+        return ''.join(parts)
+
+    def compose(self, other):
+        """One operation with the effect of self followed by other"""
+        if self.target_length != other.base_length:
+            raise ValueError("compose: the second operation must start where the first ends")
+        result = TextOperation()
+        first, second = iter(self.ops), iter(other.ops)
+        a, b = next(first, None), next(second, None)
+        while a is not None or b is not None:
+            if _is_delete(a):
+                result.delete(-a)
+                a = next(first, None)
+            elif isinstance(b, str):
+                result.insert(b)
+                b = next(second, None)
+            elif a is None or b is None:
+                raise ValueError("compose: operations do not line up")
+            elif _is_retain(a) and _is_retain(b):
+                step = min(a, b)
+                result.retain(step)
+                a = a - step or next(first, None)
+                b = b - step or next(second, None)
+            elif isinstance(a, str) and _is_delete(b):
+                # Text inserted by self and deleted by other never appears
+                step = min(len(a), -b)
+                a = a[step:] or next(first, None)
+                b = b + step or next(second, None)
+            elif isinstance(a, str):  # and b retains
+                step = min(len(a), b)
+                result.insert(a[:step])
+                a = a[step:] or next(first, None)
+                b = b - step or next(second, None)
+            else:  # a retains, b deletes
+                step = min(a, -b)
+                result.delete(step)
+                a = a - step or next(first, None)
+                b = b + step or next(second, None)
+        return result
+
+    @staticmethod
+    def transform(a, b):
+        """(a', b') for concurrent a and b, so that b' after a equals a' after b.
+
+        Where both insert at the same position, a's text ends up first.
+        """
+        if a.base_length != b.base_length:
+            raise ValueError("transform: operations must apply to the same text")
+        a_prime, b_prime = TextOperation(), TextOperation()
+        first, second = iter(a.ops), iter(b.ops)
+        x, y = next(first, None), next(second, None)
+        while x is not None or y is not None:
+            if isinstance(x, str):
+                a_prime.insert(x)
+                b_prime.retain(len(x))
+                x = next(first, None)
+            elif isinstance(y, str):
+                a_prime.retain(len(y))
+                b_prime.insert(y)
+                y = next(second, None)
+            elif x is None or y is None:
+                raise ValueError("transform: operations do not line up")
+            elif _is_retain(x) and _is_retain(y):
+                step = min(x, y)
+                a_prime.retain(step)
+                b_prime.retain(step)
+                x = x - step or next(first, None)
+                y = y - step or next(second, None)
+            elif _is_delete(x) and _is_delete(y):
+                # Both removed the same characters; neither needs to again
+                step = min(-x, -y)
+                x = x + step or next(first, None)
+                y = y + step or next(second, None)
+            elif _is_delete(x):  # y retains
+                step = min(-x, y)
+                a_prime.delete(step)
+                x = x + step or next(first, None)
+                y = y - step or next(second, None)
+            else:  # x retains, y deletes
+                step = min(x, -y)
+                b_prime.delete(step)
+                x = x - step or next(first, None)
+                y = y + step or next(second, None)
+        return a_prime, b_prime
+
+
+class StaleRevision(Exception):
+    """The operation was made against a revision no longer in the history"""
+
+
+class ServerDocument:
+    """The canonical text of a session and the operations that produced it"""
+
+    def __init__(self, text='', revision=0, max_history=MAX_HISTORY):
+        self.text = text
+        self.revision = revision
+        self.history = collections.deque(maxlen=max_history)
+
+    def length_at(self, revision):
+        """Length of the text as it was at revision (must be in the history)"""
+        missed = self._missed(revision)
+        if missed == 0:
+            return len(self.text)
+        return self.history[len(self.history) - missed].base_length
+
+    def _missed(self, revision):
+        if not isinstance(revision, int) or revision < 0 or revision > self.revision:
+            raise ValueError(f"unknown revision {revision!r}")
+        missed = self.revision - revision
+        if missed > len(self.history):
+            raise StaleRevision(f"revision {revision} is {missed} operations behind")
+        return missed
+
+    def receive(self, revision, operation):
+        """Apply an operation made against revision; returns it as applied.
+
+        Raises StaleRevision if the revision is too old and ValueError if the
+        operation does not fit the text.
+        """
+        missed = self._missed(revision)
+        for concurrent in itertools.islice(self.history, len(self.history) - missed, None):
+            operation, _ = TextOperation.transform(operation, concurrent)
+        self.text = operation.apply(self.text)
+        self.revision += 1
+        self.history.append(operation)
+        return operation
+
+
+class ClientSync:
+    """Editor-side state: which local edits the server has not confirmed yet"""
+
+    def __init__(self, revision=0):
+        self.reset(revision)
+
+    def reset(self, revision):
+        self.revision = revision  # last server revision we have applied
+        self.outstanding = None   # sent, waiting for the server's ack
+        self.buffer = None        # made since, waiting for the ack
+
+    def local(self, operation):
+        """Record a local edit; returns it if it should be sent now"""
+        if self.outstanding is None:
+            self.outstanding = operation
+            return operation
+        self.buffer = operation if self.buffer is None else self.buffer.compose(operation)
+        return None
+
+    def acknowledge(self):
+        """The server applied our outstanding edit; returns the next one to send"""
+        self.revision += 1
+        self.outstanding, self.buffer = self.buffer, None
+        return self.outstanding
+
+    def remote(self, operation):
+        """Another participant's edit; returns it transformed for our text"""
+        self.revision += 1
+        if self.outstanding is not None:
+            self.outstanding, operation = TextOperation.transform(self.outstanding, operation)
+        if self.buffer is not None:
+            self.buffer, operation = TextOperation.transform(self.buffer, operation)
+        return operation
@@ -0,0 +1,126 @@
+# persistence.py - Write-behind persistence for chat messages
+#
+# Chat delivery should not wait for an fsync. Messages are queued here and a
+# background thread inserts them in batches, one transaction (and one
+# commit) per batch. A batch is written as soon as it reaches batch_size
+# rows or flush_interval seconds after its first row was queued, whichever
+# comes first. Callers that need durability wait on the Future returned by
+# submit(), which resolves to the row id once the batch has committed.
+import collections
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 0.02  # seconds
+
+
+def log_persistence(message, operation="WRITE_BEHIND"):
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    print(f"[DATABASE {operation}] {timestamp} - {message}")
+
+
+class MessageWriteBehind:
+    """Group-commit buffer in front of the messages table"""
+
+    INSERT_SQL = '''
+        INSERT INTO messages (sender, recipient, group_name, content, message_type, file_data)
+        VALUES (?, ?, ?, ?, ?, ?)
+    '''
+
+    def __init__(self, connection_manager, batch_size=DEFAULT_BATCH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.connection_manager = connection_manager
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.pending = collections.deque()  # [(row, future)]
+        self.condition = threading.Condition()
+        self.submitted = 0
+        self.committed = 0
+        self.flush_requested = False
+        self.closing = False
+
+        self.writer_thread = threading.Thread(target=self._writer_loop, name="MessageWriteBehind")
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+
+    def submit(self, sender, content, message_type, recipient=None, group_name=None, file_data=None):
+        """Queue a message row; returns a Future that resolves to its id once committed"""
+        future = Future()
+        row = (sender, recipient, group_name, content, message_type, file_data)
+        with self.condition:
+            if self.closing:
+                raise RuntimeError("Write-behind buffer is closed")
+            self.pending.append((row, future))
+            self.submitted += 1
+            self.condition.notify_all()
+        return future
+
+    def flush(self, timeout=None):
+        """Block until every message submitted so far is committed"""
+        with self.condition:
+            target = self.submitted
+            if self.committed >= target:
+                return True
+            self.flush_requested = True
+            self.condition.notify_all()
+            return self.condition.wait_for(lambda: self.committed >= target, timeout)
+
+    def close(self):
+        """Write everything still queued and stop the writer thread"""
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        self.writer_thread.join()
+
+    def _next_batch(self):
+        """Wait for a full batch, the flush deadline, or a flush request"""
+        with self.condition:
+            while not self.pending and not self.closing:
+                self.condition.wait()
+            if not self.pending:
+                return None
+
+            deadline = time.monotonic() + self.flush_interval
+            while (len(self.pending) < self.batch_size and
+                   not self.flush_requested and not self.closing):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+            count = min(len(self.pending), self.batch_size)
+            batch = [self.pending.popleft() for _ in range(count)]
+            if not self.pending:
+                self.flush_requested = False
+            return batch
+
+    def _writer_loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        conn = self.connection_manager.get_connection()
+        row_ids = []
+        try:
+            # One transaction, one commit for the whole batch
+            with conn:
+                for row, _ in batch:
+                    row_ids.append(conn.execute(self.INSERT_SQL, row).lastrowid)
+        except Exception as e:
+            log_persistence(f"Failed to write batch of {len(batch)} messages: {e}", "ERROR")
+            for _, future in batch:
+                future.set_exception(e)
+        else:
+            log_persistence(f"Committed batch of {len(batch)} messages")
+            for (_, future), row_id in zip(batch, row_ids):
+                future.set_result(row_id)
+        finally:
+            with self.condition:
+                self.committed += len(batch)
+                self.condition.notify_all()
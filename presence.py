@@ -0,0 +1,130 @@
+# presence.py - Who is where: in-memory indexes over connected users
+#
+# Disconnect cleanup used to scan every code session for the leaving user,
+# and group fan-out asked the database for all members and then filtered out
+# the offline ones. PresenceIndex keeps the relationships both ways and is
+# updated incrementally as users connect, disconnect, join sessions and join
+# groups, so each of those operations costs time proportional to the user's
+# own memberships:
+#
+#   user -> code sessions       session -> participants (in join order)
+#   online user -> groups       group -> online members
+import threading
+
+
+class PresenceIndex:
+    """Thread-safe reverse indexes of session participants and online group members.
+
+    Readers get snapshot lists, safe to iterate while the index changes.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.user_sessions = {}   # {user: {session_id}}
+        self.sessions = {}        # {session_id: {user: None}}, a set that keeps join order
+        self.user_groups = {}     # {online user: {group_name}}
+        self.group_online = {}    # {group_name: {online user}}
+
+    # --- code sessions --------------------------------------------------------
+
+    def join_session(self, user, session_id):
+        """Add user to a session; False if already a participant"""
+        with self.lock:
+            participants = self.sessions.setdefault(session_id, {})
+            if user in participants:
+                return False
+            participants[user] = None
+            self.user_sessions.setdefault(user, set()).add(session_id)
+            return True
+
+    def leave_session(self, user, session_id):
+        """Remove user from a session; returns the remaining participants"""
+        with self.lock:
+            self._leave(user, session_id)
+            sessions = self.user_sessions.get(user)
+            if sessions is not None:
+                sessions.discard(session_id)
+                if not sessions:
+                    del self.user_sessions[user]
+            return list(self.sessions.get(session_id, ()))
+
+    def leave_all_sessions(self, user):
+        """Remove user from every session; returns {session_id: remaining participants}"""
+        with self.lock:
+            remaining = {}
+            for session_id in self.user_sessions.pop(user, ()):
+                self._leave(user, session_id)
+                remaining[session_id] = list(self.sessions.get(session_id, ()))
+            return remaining
+
+    def _leave(self, user, session_id):
+        participants = self.sessions.get(session_id)
+        if participants is not None:
+            participants.pop(user, None)
+            if not participants:
+                del self.sessions[session_id]
+
+    def participants(self, session_id):
+        with self.lock:
+            return list(self.sessions.get(session_id, ()))
+
+    def in_session(self, user, session_id):
+        with self.lock:
+            return user in self.sessions.get(session_id, ())
+
+    def participant_count(self, session_id):
+        with self.lock:
+            return len(self.sessions.get(session_id, ()))
+
+    def sessions_of(self, user):
+        with self.lock:
+            return list(self.user_sessions.get(user, ()))
+
+    # --- groups ---------------------------------------------------------------
+
+    def user_online(self, user, groups):
+        """Record a connected user and the groups it belongs to"""
+        with self.lock:
+            self.user_groups[user] = set(groups)
+            for group_name in groups:
+                self.group_online.setdefault(group_name, set()).add(user)
+
+    def user_offline(self, user):
+        with self.lock:
+            for group_name in self.user_groups.pop(user, ()):
+                members = self.group_online.get(group_name)
+                if members is not None:
+                    members.discard(user)
+                    if not members:
+                        del self.group_online[group_name]
+
+    def add_group_member(self, group_name, user):
+        """A user joined a group; only tracked while the user is online"""
+        with self.lock:
+            groups = self.user_groups.get(user)
+            if groups is None:
+                return
+            groups.add(group_name)
+            self.group_online.setdefault(group_name, set()).add(user)
+
+    def remove_group_member(self, group_name, user):
+        with self.lock:
+            self.user_groups.get(user, set()).discard(group_name)
+            members = self.group_online.get(group_name)
+            if members is not None:
+                members.discard(user)
+                if not members:
+                    del self.group_online[group_name]
+
+    def online_members(self, group_name):
+        with self.lock:
+            return list(self.group_online.get(group_name, ()))
+
+    def stats(self):
+        with self.lock:
+            return {
+                'sessions': len(self.sessions),
+                'users_in_sessions': len(self.user_sessions),
+                'online_users': len(self.user_groups),
+                'groups_online': len(self.group_online)
+            }
@@ -0,0 +1,309 @@
+# sandbox.py - Resource limits and accounting for executed code
+#
+# Every program, compiler and interpreter worker started by CodeExecutor runs
+# in its own session (so the whole process group can be killed) with
+# setrlimit() limits on CPU seconds, address space, processes, file size and
+# open files, applied in the child before exec. When the server is given a
+# delegated cgroup v2 directory, each run also gets its own child cgroup with
+# memory.max and pids.max; the kernel then accounts memory peaks and OOM
+# kills per run, and cgroup.kill reaps fork bombs. Without a cgroup,
+# RLIMIT_NPROC only approximates a per-run process limit because the kernel
+# counts every process of the user (and does not apply it to root).
+import os
+import signal
+import time
+import uuid
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows: only the wall-clock timeout applies
+    resource = None
+
+MB = 1024 * 1024
+
+# Limits for one run; None leaves a limit unset. Languages may override
+# entries (see CodeExecutor.SUPPORTED_LANGUAGES).
+DEFAULT_LIMITS = {
+    'cpu_seconds': 10,
+    'memory_bytes': 512 * MB,           # memory.max; needs a cgroup
+    'address_space_bytes': 1024 * MB,  # RLIMIT_AS; runtimes reserve more than they touch
+    'max_processes': 64,                # pids.max with a cgroup, else RLIMIT_NPROC
+    'file_size_bytes': 16 * MB,
+    'open_files': 64
+}
+
+# What the result's error says for each exit_reason other than 'exited'
+EXIT_MESSAGES = {
+    'timeout': 'Execution timed out',
+    'cancelled': 'Execution cancelled',
+    'cpu_limit': 'CPU time limit exceeded',
+    'memory_limit': 'Memory limit exceeded',
+    'file_size_limit': 'File size limit exceeded',
+    'output_limit': 'Output limit exceeded',
+    'crashed': 'Interpreter crashed'
+}
+
+# What runtimes print when an allocation fails. Under RLIMIT_AS the kernel
+# does not kill the program; the allocation fails and the runtime reports
+# it on stderr before exiting (Python, Java) or aborting (C++, Node).
+OUT_OF_MEMORY_MARKERS = (
+    'MemoryError',
+    'std::bad_alloc',
+    'java.lang.OutOfMemoryError',
+    'JavaScript heap out of memory'
+)
+
+# How often the per-user task count behind RLIMIT_NPROC is refreshed
+TASK_COUNT_TTL = 1.0
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def log_sandbox(message, level="INFO"):
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    print(f"[SANDBOX {level}] {timestamp} - {message}")
+
+
+def merge_limits(*overrides):
+    """DEFAULT_LIMITS with each override dict applied in turn"""
+    limits = dict(DEFAULT_LIMITS)
+    for override in overrides:
+        if override:
+            limits.update(override)
+    return limits
+
+
+_task_count = (0.0, 0)
+
+
+def user_task_count():
+    """Processes and threads owned by our uid; what RLIMIT_NPROC compares against"""
+    global _task_count
+    checked_at, count = _task_count
+    if time.monotonic() - checked_at < TASK_COUNT_TTL:
+        return count
+
+    uid = str(os.getuid())
+    count = 0
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/status') as status:
+                owner = threads = None
+                for line in status:
+                    if line.startswith('Uid:'):
+                        owner = line.split()[1]
+                    elif line.startswith('Threads:'):
+                        threads = int(line.split()[1])
+                        break
+        except (OSError, ValueError):
+            continue
+        if owner == uid and threads:
+            count += threads
+    _task_count = (time.monotonic(), count)
+    return count
+
+
+def rlimit_settings(limits):
+    """(resource, (soft, hard)) pairs for limits, computed before fork"""
+    if resource is None:
+        return []
+    settings = [(resource.RLIMIT_CORE, (0, 0))]
+    if limits.get('cpu_seconds'):
+        # SIGXCPU at the soft limit, SIGKILL a second later
+        cpu = int(limits['cpu_seconds'] + 0.999)
+        settings.append((resource.RLIMIT_CPU, (cpu, cpu + 1)))
+    if limits.get('address_space_bytes'):
+        settings.append((resource.RLIMIT_AS, (limits['address_space_bytes'], limits['address_space_bytes'])))
+    if limits.get('file_size_bytes'):
+        settings.append((resource.RLIMIT_FSIZE, (limits['file_size_bytes'], limits['file_size_bytes'])))
+    if limits.get('open_files'):
+        settings.append((resource.RLIMIT_NOFILE, (limits['open_files'], limits['open_files'])))
+    if limits.get('max_processes') and hasattr(resource, 'RLIMIT_NPROC') and os.path.isdir('/proc'):
+        nproc = user_task_count() + limits['max_processes']
+        settings.append((resource.RLIMIT_NPROC, (nproc, nproc)))
+    return settings
+
+
+def make_preexec(limits, cgroup=None):
+    """preexec_fn for Popen: join the run's cgroup, then apply the rlimits.
+
+    Everything is computed up front; the child only makes system calls.
+    """
+    settings = rlimit_settings(limits)
+    procs_path = cgroup.procs_path if cgroup is not None else None
+
+    def preexec():
+        if procs_path is not None:
+            fd = os.open(procs_path, os.O_WRONLY)
+            try:
+                os.write(fd, b'0')  # "0" moves the writing process
+            finally:
+                os.close(fd)
+        for limit, values in settings:
+            try:
+                resource.setrlimit(limit, values)
+            except (ValueError, OSError):
+                pass  # cannot raise above the server's own hard limit
+
+    return preexec
+
+
+def kill_process_group(process):
+    """Kill a child started in its own session, with anything it forked"""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError, AttributeError):
+        try:
+            process.kill()
+        except OSError:
+            pass
+
+
+def set_cpu_budget(pid, cpu_seconds):
+    """Allow a long-lived process cpu_seconds more CPU from now (Linux)"""
+    if resource is None or not hasattr(resource, 'prlimit') or not cpu_seconds:
+        return
+    try:
+        used = process_cpu_time(pid)
+        soft = int(used + cpu_seconds + 0.999)
+        resource.prlimit(pid, resource.RLIMIT_CPU, (soft, soft + 1))
+    except (OSError, ValueError):
+        pass
+
+
+def process_cpu_time(pid):
+    """User + system CPU seconds a live process has used so far"""
+    with open(f'/proc/{pid}/stat') as stat:
+        # The command name may contain spaces; fields resume after its ')'
+        fields = stat.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def out_of_memory(stderr):
+    """True if a program's stderr ends with an allocation failure"""
+    tail = stderr[-4096:]
+    return any(marker in tail for marker in OUT_OF_MEMORY_MARKERS)
+
+
+def exit_reason(return_code, limits, cpu_time=None, oom_killed=False, memory_error=False):
+    """Why a process that was not timed out, cancelled or cut off ended.
+
+    memory_error says the program failed an allocation (see out_of_memory);
+    it only counts when the program did not exit cleanly.
+    """
+    if oom_killed or (memory_error and return_code != 0):
+        return 'memory_limit'
+    if return_code is None or return_code >= 0:
+        return 'exited'
+    signum = -return_code
+    if signum == getattr(signal, 'SIGXCPU', None):
+        return 'cpu_limit'
+    if signum == getattr(signal, 'SIGXFSZ', None):
+        return 'file_size_limit'
+    if (signum == signal.SIGKILL and cpu_time is not None and limits.get('cpu_seconds')
+            and cpu_time >= limits['cpu_seconds']):
+        return 'cpu_limit'
+    return 'signal'
+
+
+def signal_name(return_code):
+    if return_code is None or return_code >= 0:
+        return None
+    try:
+        return signal.Signals(-return_code).name
+    except ValueError:
+        return f'signal {-return_code}'
+
+
+def cgroup_available(parent):
+    """True if parent is a cgroup v2 directory we can create run cgroups under"""
+    try:
+        with open(os.path.join(parent, 'cgroup.subtree_control')) as control:
+            controllers = control.read().split()
+    except OSError:
+        return False
+    return 'memory' in controllers and 'pids' in controllers and os.access(parent, os.W_OK)
+
+
+class RunCgroup:
+    """A cgroup v2 child of a delegated directory, holding one run"""
+
+    def __init__(self, parent, limits):
+        self.path = os.path.join(parent, f'run-{uuid.uuid4().hex[:12]}')
+        os.mkdir(self.path)
+        self.procs_path = os.path.join(self.path, 'cgroup.procs')
+        try:
+            if limits.get('memory_bytes'):
+                self._write('memory.max', limits['memory_bytes'])
+                self._write('memory.swap.max', 0, required=False)
+            if limits.get('max_processes'):
+                self._write('pids.max', limits['max_processes'])
+        except OSError:
+            self.close()
+            raise
+
+    def _write(self, name, value, required=True):
+        try:
+            with open(os.path.join(self.path, name), 'w') as control:
+                control.write(str(value))
+        except FileNotFoundError:
+            if required:
+                raise
+
+    def _read_keys(self, name):
+        values = {}
+        try:
+            with open(os.path.join(self.path, name)) as control:
+                for line in control:
+                    key, _, value = line.partition(' ')
+                    values[key] = int(value)
+        except (OSError, ValueError):
+            pass
+        return values
+
+    def stats(self):
+        """cpu_time (s), peak_rss (bytes, None before Linux 5.19) and oom_killed"""
+        cpu = self._read_keys('cpu.stat').get('usage_usec')
+        try:
+            with open(os.path.join(self.path, 'memory.peak')) as peak:
+                peak_rss = int(peak.read())
+        except (OSError, ValueError):
+            peak_rss = None
+        return {
+            'cpu_time': cpu / 1e6 if cpu is not None else None,
+            'peak_rss': peak_rss,
+            'oom_killed': self._read_keys('memory.events').get('oom_kill', 0) > 0
+        }
+
+    def kill(self):
+        """Kill every process in the cgroup, including ones that left the process group"""
+        try:
+            self._write('cgroup.kill', 1)
+            return
+        except OSError:
+            pass  # before Linux 5.14
+        try:
+            with open(self.procs_path) as procs:
+                pids = [int(pid) for pid in procs.read().split()]
+        except (OSError, ValueError):
+            return
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def close(self):
+        self.kill()
+        for _ in range(50):
+            try:
+                os.rmdir(self.path)
+                return
+            except FileNotFoundError:
+                return
+            except OSError:
+                time.sleep(0.01)  # processes still exiting
+        log_sandbox(f"Could not remove cgroup {self.path}", "WARN")
@@ -1,5 +1,7 @@
 # enhanced_server_with_database.py - FIXED VERSION
 import socket
+import asyncio
+import argparse
 import threading
 import json
 import time
@@ -11,7 +13,20 @@ import sqlite3
 import base64
 from datetime import datetime
 from codeexecutor import CodeExecutor
-from file_transfer import FileTransferServer, FileTransferDatabase
+from code_delta import validate_edits, edit_size
+from ot import TextOperation, ServerDocument, StaleRevision
+from update_coalescer import UpdateCoalescer, tick_window, BACKLOG_BYTES
+from execution_scheduler import ExecutionScheduler, ExecutionQueueFull, DEFAULT_EXECUTION_WORKERS
+from dbpool import SQLiteConnectionManager
+from persistence import MessageWriteBehind
+from session_store import CodeSessionStore, SNAPSHOT_INTERVAL
+from presence import PresenceIndex
+from client_registry import ClientRegistry
+from file_transfer import (FileTransferServer, FileTransferDatabase, DEFAULT_HTTP_WORKERS,
+                           DEFAULT_HTTP_PENDING, DEFAULT_MAX_UPLOAD_SIZE)
+from framing import encode_frame
+from connection import (ClientConnection, AsyncClientConnection, DEFAULT_MAX_QUEUED_FRAMES,
+                        DEFAULT_HIGH_WATER_BYTES, SLOW_CONSUMER_POLICIES)
 
 # Enhanced logging function
 def log_server(message, level="INFO"):
@@ -37,15 +52,49 @@ def log_code_session(message, session_id=None):
     print(f"[CODE] {timestamp} {session_info} {message}")
 
 class ChatDatabase(FileTransferDatabase):
+    # Bumped whenever migrate_schema() gains a step; stored in PRAGMA user_version
+    SCHEMA_VERSION = 2
+    
+    # Composite indexes serving the three get_messages lookups
+    MESSAGE_INDEXES = {
+        'idx_messages_type_time': 'messages (message_type, timestamp)',
+        'idx_messages_pair_time': 'messages (sender, recipient, timestamp)',
+        'idx_messages_group_time': 'messages (group_name, timestamp)'
+    }
+    
     def __init__(self, db_file="chat_history.db"):
         self.db_file = db_file
         log_database(f"Initializing database: {db_file}")
+        self.connection_manager = SQLiteConnectionManager(db_file)
         self.init_database()
+        
+        # Chat messages are persisted in batches off the delivery path
+        self.message_writer = MessageWriteBehind(self.connection_manager)
+        
+        # Code session documents: snapshots plus a log of accepted edits
+        self.session_store = CodeSessionStore(self.connection_manager)
+        
+        # Group members by group, filled on first lookup and kept current by
+        # the group write methods, so group fan-out does not query SQLite
+        self.group_members_cache = {}  # {group_name: [member, ...]}
+        self.group_cache_lock = threading.Lock()
+        self.group_cache_generation = 0  # bumped by every membership write
+        self.group_cache_hits = 0
+        self.group_cache_misses = 0
+    
+    def close_connections(self):
+        """Flush queued messages and session edits, then close every pooled connection"""
+        stats = self.group_cache_stats()
+        log_database(f"Group member cache: {stats['hits']} hits, {stats['misses']} misses, "
+                     f"{stats['groups']} groups cached", "CACHE")
+        self.message_writer.close()
+        self.session_store.close()
+        super().close_connections()
     
     def init_database(self):
         """Initialize the database with required tables"""
         log_database("Creating database tables if not exist")
-        conn = sqlite3.connect(self.db_file)
+        conn = self.get_connection()
         cursor = conn.cursor()
         
         # Messages table
@@ -86,186 +135,351 @@ class ChatDatabase(FileTransferDatabase):
         ''')
         log_database("Group members table ready")
         
-        # Files table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS shared_files (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                file_id TEXT UNIQUE NOT NULL,
-                filename TEXT NOT NULL,
-                file_data BLOB NOT NULL,
-                file_size INTEGER,
-                mime_type TEXT,
-                sender TEXT NOT NULL,
-                recipient TEXT,
-                group_name TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        log_database("Files table ready")
-        
         conn.commit()
-        conn.close()
+        
+        self.migrate_schema()
 
-        # Initialize file transfer tables
+        # Initialize file transfer tables (shared_files metadata, blob store)
         log_database("Initializing file transfer tables")
         self.init_file_tables() 
     
+    def migrate_schema(self):
+        """Bring an existing database up to SCHEMA_VERSION"""
+        conn = self.get_connection()
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version >= self.SCHEMA_VERSION:
+            log_database(f"Schema is up to date (version {version})", "MIGRATE")
+            return
+        
+        log_database(f"Migrating schema from version {version} to {self.SCHEMA_VERSION}", "MIGRATE")
+        with conn:
+            if version < 1:
+                for index_name, definition in self.MESSAGE_INDEXES.items():
+                    log_database(f"Creating index {index_name} on {definition}", "MIGRATE")
+                    conn.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON {definition}')
+            if version < 2:
+                # One row per (group, member), so INSERT OR IGNORE in add_group_member
+                # matches the deduplicated member cache; keep the earliest join
+                removed = conn.execute('''
+                    DELETE FROM group_members WHERE id NOT IN (
+                        SELECT MIN(id) FROM group_members GROUP BY group_name, member
+                    )
+                ''').rowcount
+                log_database(f"Removed {removed} duplicate group memberships", "MIGRATE")
+                conn.execute('''
+                    CREATE UNIQUE INDEX IF NOT EXISTS idx_group_members_unique
+                    ON group_members (group_name, member)
+                ''')
+            conn.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+        
+        # Refresh planner statistics for the new indexes
+        conn.execute('ANALYZE')
+        log_database("Schema migration complete", "MIGRATE")
+    
     def save_message(self, sender, content, message_type, recipient=None, group_name=None, file_data=None):
         """Save a message to the database"""
         target = recipient or group_name or "BROADCAST"
         log_database(f"Saving {message_type} message from {sender} to {target}: {content[:50]}...")
         
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO messages (sender, recipient, group_name, content, message_type, file_data)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (sender, recipient, group_name, content, message_type, file_data))
+        conn = self.get_connection()
+        with conn:
+            cursor = conn.execute('''
+                INSERT INTO messages (sender, recipient, group_name, content, message_type, file_data)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (sender, recipient, group_name, content, message_type, file_data))
         
-        conn.commit()
-        conn.close()
         log_database(f"Message saved successfully (ID: {cursor.lastrowid})")
     
-    def get_messages(self, message_type, user1=None, user2_or_group=None, limit=50):
-        """Retrieve messages from the database"""
+    def queue_message(self, sender, content, message_type, recipient=None, group_name=None, file_data=None):
+        """Queue a message for the write-behind buffer.
+        
+        Returns a Future resolving to the message id once its batch is committed;
+        callers that need durability can wait on it.
+        """
+        target = recipient or group_name or "BROADCAST"
+        log_database(f"Queueing {message_type} message from {sender} to {target}: {content[:50]}...")
+        return self.message_writer.submit(sender, content, message_type, recipient, group_name, file_data)
+    
+    def get_messages(self, message_type, user1=None, user2_or_group=None, limit=50, before_id=None):
+        """Retrieve a page of messages, oldest first.
+        
+        Rows are (id, sender, content, timestamp, file_data). With before_id the
+        page ends just before that message (keyset pagination on (timestamp, id)),
+        so fetching older history costs O(limit) however deep it goes.
+        """
         if message_type == "BROADCAST":
-            log_database(f"Retrieving {limit} broadcast messages")
+            log_database(f"Retrieving {limit} broadcast messages before {before_id or 'latest'}")
         elif message_type == "PERSONAL":
-            log_database(f"Retrieving {limit} personal messages between {user1} and {user2_or_group}")
+            log_database(f"Retrieving {limit} personal messages between {user1} and {user2_or_group} before {before_id or 'latest'}")
         elif message_type == "GROUP":
-            log_database(f"Retrieving {limit} group messages for {user2_or_group}")
-            
-        conn = sqlite3.connect(self.db_file)
+            log_database(f"Retrieving {limit} group messages for {user2_or_group} before {before_id or 'latest'}")
+        
+        # Read-your-writes: history must include messages still in the write-behind buffer
+        self.message_writer.flush()
+        
+        conn = self.get_connection()
         cursor = conn.cursor()
         
+        # Resolve the cursor message to its position in (timestamp, id) order
+        keyset = ""
+        keyset_params = ()
+        if before_id is not None:
+            row = cursor.execute('SELECT timestamp FROM messages WHERE id = ?', (before_id,)).fetchone()
+            if not row:
+                log_database(f"Cursor message {before_id} not found", "ERROR")
+                return []
+            keyset = "AND (timestamp, id) < (?, ?)"
+            keyset_params = (row[0], before_id)
+        
+        # Each query walks one composite index backwards and stops after `limit` rows
         if message_type == "BROADCAST":
-            cursor.execute('''
-                SELECT sender, content, timestamp, file_data
+            cursor.execute(f'''
+                SELECT id, sender, content, timestamp, file_data
                 FROM messages 
-                WHERE message_type = ? 
-                ORDER BY timestamp DESC 
+                WHERE message_type = ? {keyset}
+                ORDER BY timestamp DESC, id DESC 
                 LIMIT ?
-            ''', (message_type, limit))
+            ''', (message_type, *keyset_params, limit))
         elif message_type == "PERSONAL":
-            cursor.execute('''
-                SELECT sender, content, timestamp, file_data
-                FROM messages 
-                WHERE message_type = ? AND 
-                      ((sender = ? AND recipient = ?) OR (sender = ? AND recipient = ?))
-                ORDER BY timestamp DESC 
+            # One index range per direction instead of an OR that forces a full sort
+            cursor.execute(f'''
+                SELECT id, sender, content, timestamp, file_data FROM (
+                    SELECT * FROM (
+                        SELECT id, sender, content, timestamp, file_data
+                        FROM messages
+                        WHERE sender = ? AND recipient = ? AND message_type = ? {keyset}
+                        ORDER BY timestamp DESC, id DESC
+                        LIMIT ?
+                    )
+                    UNION ALL
+                    SELECT * FROM (
+                        SELECT id, sender, content, timestamp, file_data
+                        FROM messages
+                        WHERE sender = ? AND recipient = ? AND message_type = ? {keyset}
+                        ORDER BY timestamp DESC, id DESC
+                        LIMIT ?
+                    )
+                )
+                ORDER BY timestamp DESC, id DESC 
                 LIMIT ?
-            ''', (message_type, user1, user2_or_group, user2_or_group, user1, limit))
+            ''', (user1, user2_or_group, message_type, *keyset_params, limit,
+                  user2_or_group, user1, message_type, *keyset_params, limit, limit))
         elif message_type == "GROUP":
-            cursor.execute('''
-                SELECT sender, content, timestamp, file_data
+            cursor.execute(f'''
+                SELECT id, sender, content, timestamp, file_data
                 FROM messages 
-                WHERE message_type = ? AND group_name = ?
-                ORDER BY timestamp DESC 
+                WHERE group_name = ? AND message_type = ? {keyset}
+                ORDER BY timestamp DESC, id DESC 
                 LIMIT ?
-            ''', (message_type, user2_or_group, limit))
+            ''', (user2_or_group, message_type, *keyset_params, limit))
         
         messages = cursor.fetchall()
-        conn.close()
         log_database(f"Retrieved {len(messages)} messages from database")
         return list(reversed(messages))
     
     def create_group(self, group_name, creator):
         """Create a new group"""
         log_database(f"Creating group '{group_name}' by {creator}")
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+        conn = self.get_connection()
         
         try:
-            cursor.execute('INSERT INTO groups (group_name, creator) VALUES (?, ?)', 
-                          (group_name, creator))
-            conn.commit()
+            with conn:
+                conn.execute('INSERT INTO groups (group_name, creator) VALUES (?, ?)', 
+                             (group_name, creator))
+            # A lookup before creation may have cached the group as empty
+            self.update_cached_group(group_name, lambda members: None)
             log_database(f"Group '{group_name}' created successfully")
             return True
         except sqlite3.IntegrityError:
             log_database(f"Group '{group_name}' already exists", "ERROR")
             return False
-        finally:
-            conn.close()
     
     def add_group_member(self, group_name, member):
         """Add a member to a group"""
         log_database(f"Adding {member} to group '{group_name}'")
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR IGNORE INTO group_members (group_name, member) 
-            VALUES (?, ?)
-        ''', (group_name, member))
-        
-        conn.commit()
-        conn.close()
+        conn = self.get_connection()
+        with conn:
+            conn.execute('''
+                INSERT OR IGNORE INTO group_members (group_name, member) 
+                VALUES (?, ?)
+            ''', (group_name, member))
+        self.update_cached_group(group_name,
+                                 lambda members: members if member in members else members + [member])
+
         log_database(f"{member} added to group '{group_name}'")
     
     def get_group_members(self, group_name):
-        """Get all members of a group"""
+        """Get all members of a group (served from the member cache when possible)"""
+        with self.group_cache_lock:
+            members = self.group_members_cache.get(group_name)
+            if members is not None:
+                self.group_cache_hits += 1
+                return list(members)
+            self.group_cache_misses += 1
+            generation = self.group_cache_generation
+        
         log_database(f"Retrieving members for group '{group_name}'")
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+        cursor = self.get_connection().cursor()
         
         cursor.execute('''
             SELECT member FROM group_members WHERE group_name = ?
         ''', (group_name,))
         
         members = [row[0] for row in cursor.fetchall()]
-        conn.close()
         log_database(f"Group '{group_name}' has {len(members)} members: {members}")
-        return members
+        
+        with self.group_cache_lock:
+            # Skip caching if a membership write raced with the query
+            if self.group_cache_generation == generation:
+                self.group_members_cache[group_name] = members
+        return list(members)
+    
+    def update_cached_group(self, group_name, change):
+        """Write a membership change through to the cache; call after the database commit.
+        
+        change maps the cached member list to the new one, or to None to drop
+        the entry so the next lookup reloads it.
+        """
+        with self.group_cache_lock:
+            self.group_cache_generation += 1
+            members = self.group_members_cache.get(group_name)
+            if members is None:
+                return
+            members = change(members)
+            if members is None:
+                del self.group_members_cache[group_name]
+            else:
+                self.group_members_cache[group_name] = members
+    
+    def group_cache_stats(self):
+        with self.group_cache_lock:
+            return {
+                'hits': self.group_cache_hits,
+                'misses': self.group_cache_misses,
+                'groups': len(self.group_members_cache)
+            }
     
     def get_user_groups(self, username):
         """Get all groups a user is a member of"""
         log_database(f"Retrieving groups for user {username}")
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+        cursor = self.get_connection().cursor()
         
         cursor.execute('''
             SELECT group_name FROM group_members WHERE member = ?
         ''', (username,))
         
         groups = [row[0] for row in cursor.fetchall()]
-        conn.close()
         log_database(f"User {username} is member of {len(groups)} groups: {groups}")
         return groups
     
     def remove_group_member(self, group_name, member):
         """Remove a member from a group"""
         log_database(f"Removing {member} from group '{group_name}'")
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            DELETE FROM group_members WHERE group_name = ? AND member = ?
-        ''', (group_name, member))
-        
-        conn.commit()
-        conn.close()
+        conn = self.get_connection()
+        with conn:
+            conn.execute('''
+                DELETE FROM group_members WHERE group_name = ? AND member = ?
+            ''', (group_name, member))
+        self.update_cached_group(group_name,
+                                 lambda members: [name for name in members if name != member])
+
         log_database(f"{member} removed from group '{group_name}'")
 
+# Messages per MESSAGE_HISTORY page, and the most a client may ask for
+HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE_SIZE = 200
+
+# Live output is held back while any participant has this much queued
+OUTPUT_BACKLOG_BYTES = 256 * 1024
+
+class ExecutionOutputRelay:
+    """Forwards a running job's output to its session as execution_output messages.
+    
+    While any participant's outbound queue is over OUTPUT_BACKLOG_BYTES,
+    new output is merged into the pending chunk instead of being sent, so a
+    slow client delays the live view rather than growing its queue. Each
+    chunk carries its offset in the stream; the final execution_result has
+    the whole (capped) output, so clients print whatever they have not seen.
+    """
+    
+    def __init__(self, server, job):
+        self.server = server
+        self.job = job
+        self.sent = {'stdout': 0, 'stderr': 0}
+        self.pending = []  # [[stream, text]] not yet sent, in order
+    
+    def write(self, stream, text):
+        if self.pending and self.pending[-1][0] == stream:
+            self.pending[-1][1] += text
+        else:
+            self.pending.append([stream, text])
+        
+        if self.server.session_backlogged(self.job.session_id, OUTPUT_BACKLOG_BYTES):
+            return
+        for stream, text in self.pending:
+            self.server.broadcast_to_session(self.job.session_id, {
+                'type': 'execution_output',
+                'session_id': self.job.session_id,
+                'job_id': self.job.job_id,
+                'executed_by': self.job.user,
+                'stream': stream,
+                'offset': self.sent[stream],
+                'data': text
+            }, quiet=True)
+            self.sent[stream] += len(text)
+        self.pending = []
+
 class ChatServer:
-    def __init__(self, host='localhost', port=5555):
+    def __init__(self, host='localhost', port=5555, max_queued_frames=DEFAULT_MAX_QUEUED_FRAMES,
+                 high_water_bytes=DEFAULT_HIGH_WATER_BYTES, slow_consumer_policy='disconnect',
+                 http_workers=DEFAULT_HTTP_WORKERS, http_pending=DEFAULT_HTTP_PENDING,
+                 execution_workers=DEFAULT_EXECUTION_WORKERS, execution_cgroup=None,
+                 max_upload_size=DEFAULT_MAX_UPLOAD_SIZE):
         self.host = host
         self.port = port
         self.http_port = 8080
         
+        # Limits for each client's outbound send queue
+        self.outbound_limits = {
+            'max_queued_frames': max_queued_frames,
+            'high_water_bytes': high_water_bytes,
+            'slow_consumer_policy': slow_consumer_policy
+        }
+        
         log_server(f"Initializing ChatServer on {host}:{port}")
         log_server(f"HTTP file server will run on port {self.http_port}")
+        log_server(f"Outbound queues: {max_queued_frames} frames / {high_water_bytes} bytes, "
+                   f"slow consumers: {slow_consumer_policy}")
         
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((self.host, self.port))
         
-        self.clients = {}  # {client_name: (client_socket, client_address)}
+        self.clients = ClientRegistry()  # {client_name: (connection, client_address)}
         self.db = ChatDatabase()
+        # Who is in which code session and which groups have members online
+        self.presence = PresenceIndex()
         
         # Code editor sessions
-        self.code_sessions = {}  # {session_id: {code, language, participants, owner}}
+        # Sessions with participants are kept here; the rest stay in the database
+        # until someone joins (see load_code_session)
+        self.code_sessions = {}  # {session_id: {document, language, synced, owner}}; participants in self.presence
+        self.db.session_store.recover()
+        self.code_session_lock = threading.RLock()  # orders edits and loads/unloads of sessions
+        # Accepted edits are broadcast once per session tick
+        self.code_update_coalescer = UpdateCoalescer(self.flush_code_updates, self.code_tick_window)
         log_server("Code sessions dictionary initialized")
+        
+        # Code runs are queued and executed off the client handler threads
+        if execution_cgroup:
+            CodeExecutor.use_cgroup(execution_cgroup)
+        # Compiled programs are kept privately next to the database, like shared files
+        CodeExecutor.use_compile_cache_dir(os.path.splitext(os.path.abspath(self.db.db_file))[0] + '_compile_cache')
+        self.execution_scheduler = ExecutionScheduler(self.run_execution_job,
+                                                      on_queue_change=self.report_queue_position,
+                                                      on_start=self.report_execution_started,
+                                                      max_workers=execution_workers)
+        CodeExecutor.start_interpreter_pools(execution_workers)
 
         # Add file transfer server
         log_server("Initializing file transfer server")
@@ -273,7 +487,11 @@ class ChatServer:
             host=self.host,
             port=self.http_port,
             database=self.db,
-            clients=self.clients
+            clients=self.clients,
+            presence=self.presence,
+            max_workers=http_workers,
+            max_pending=http_pending,
+            max_upload_size=max_upload_size
         )
         log_server("ChatServer initialization complete")
         
@@ -306,72 +524,43 @@ class ChatServer:
         finally:
             log_server("Cleaning up server resources...")
             self.server_socket.close()
+            self.execution_scheduler.shutdown()
+            self.code_update_coalescer.shutdown()
+            CodeExecutor.shutdown_interpreter_pools()
+            CodeExecutor.close_compile_cache()
             self.file_server.stop()
+            self.save_code_sessions()
+            self.db.close_connections()
             log_server(" Server shutdown complete")
 
     def handle_client(self, client_socket, client_address):
+        connection = ClientConnection(client_socket, **self.outbound_limits)
         client_name = None
         try:
             log_networking(f"Handling new client from {client_address}")
             
             # Get client name
-            client_name = client_socket.recv(1024).decode('utf-8')
+            frame = connection.recv_frame()
+            if frame is None:
+                return
+            client_name = frame.decode('utf-8')
             log_networking(f"Client wants username: '{client_name}'", client_name)
             
-            # Check if name already exists
-            if client_name in self.clients:
-                log_networking(f"Username '{client_name}' already taken!", client_name)
-                client_socket.send("NAME_TAKEN".encode('utf-8'))
-                client_socket.close()
+            if not self.register_client(client_name, connection, client_address):
+                client_name = None
                 return
             
-            # Add client to clients dictionary
-            self.clients[client_name] = (client_socket, client_address)
-            client_socket.send("CONNECTED".encode('utf-8'))
-            log_networking(f" Client '{client_name}' successfully connected", client_name)
-            
-            # Send server info including active users
-            server_info = json.dumps({
-                'type': 'SERVER_INFO',
-                'supported_languages': list(CodeExecutor.SUPPORTED_LANGUAGES.keys()),
-                'active_users': list(self.clients.keys()),
-                'http_port': self.http_port,
-                'file_upload_url': f'http://{self.host}:{self.http_port}/upload',
-                'file_download_url': f'http://{self.host}:{self.http_port}/download',
-                'file_list_url': f'http://{self.host}:{self.http_port}/files'
-            })
-            client_socket.send(f"SERVER_INFO|{server_info}".encode('utf-8'))
-            log_networking(f"Sent server info to {client_name}", client_name)
-            
-            # Send user's groups immediately after connection
-            user_groups = self.db.get_user_groups(client_name)
-            if user_groups:
-                groups_info = json.dumps({
-                    'type': 'USER_GROUPS',
-                    'groups': user_groups
-                })
-                client_socket.send(f"USER_GROUPS|{groups_info}".encode('utf-8'))
-                log_networking(f"Sent user groups to {client_name}: {user_groups}", client_name)
-                
-                # Small delay to ensure groups are processed before history
-                time.sleep(0.1)
+            self.welcome_client(client_name)
             
-            # Send general chat history immediately
-            self.send_message_history(client_name, "BROADCAST", None)
-            
-            # Broadcast new client connection and update user lists
-            self.broadcast_message(f"SERVER: {client_name} has joined the chat!")
-            self.broadcast_user_list()
-            log_networking(f" Announced {client_name}'s arrival to all clients")
-            
-            # Handle client messages
+            # Handle client messages, one frame at a time
             log_networking(f"Starting message loop for {client_name}", client_name)
             while True:
-                data = client_socket.recv(8192).decode('utf-8')
-                if not data:
+                frame = connection.recv_frame()
+                if frame is None:
                     log_networking(f"No data received from {client_name}, closing connection", client_name)
                     break
                 
+                data = frame.decode('utf-8')
                 log_networking(f" Received from {client_name}: {data[:100]}{'...' if len(data) > 100 else ''}", client_name)
                 self.process_message(client_name, data)
                 
@@ -379,43 +568,97 @@ class ChatServer:
             log_networking(f" Error handling client {client_address}: {e}", client_name)
         finally:
             # Clean up on disconnect
-            if client_name and client_name in self.clients:
-                del self.clients[client_name]
-                log_networking(f" {client_name} disconnected, removed from client list", client_name)
-                
-                # Remove from code sessions
-                sessions_removed = []
-                for session_id in list(self.code_sessions.keys()):
-                    if client_name in self.code_sessions[session_id]['participants']:
-                        self.code_sessions[session_id]['participants'].remove(client_name)
-                        sessions_removed.append(session_id)
-                        log_code_session(f"{client_name} removed from session", session_id)
-                        
-                        # Notify other participants
-                        self.broadcast_to_session(session_id, {
-                            'type': 'user_left',
-                            'user': client_name,
-                            'participants': self.code_sessions[session_id]['participants']
-                        })
-                        
-                        # Remove empty sessions
-                        if len(self.code_sessions[session_id]['participants']) == 0:
-                            del self.code_sessions[session_id]
-                            log_code_session(f"Empty session deleted", session_id)
-                
-                if sessions_removed:
-                    log_code_session(f"{client_name} was removed from {len(sessions_removed)} sessions")
-                
-                self.broadcast_message(f"SERVER: {client_name} has left the chat")
-                self.broadcast_user_list()
-                log_networking(f" Announced {client_name}'s departure to all clients")
+            if client_name:
+                self.unregister_client(client_name)
             
             try:
-                client_socket.close()
+                connection.close()
                 log_networking(f" Socket closed for {client_name or client_address}")
             except:
                 pass
     
+    def register_client(self, client_name, connection, client_address):
+        """Add a client to the registry and send the connection handshake"""
+        # Claim the name; fails if it is already taken
+        if not self.clients.add(client_name, connection, client_address):
+            log_networking(f"Username '{client_name}' already taken!", client_name)
+            connection.send("NAME_TAKEN".encode('utf-8'))
+            return False
+        
+        connection.send("CONNECTED".encode('utf-8'))
+        log_networking(f" Client '{client_name}' successfully connected", client_name)
+        
+        # Send server info including active users
+        server_info = json.dumps({
+            'type': 'SERVER_INFO',
+            'supported_languages': list(CodeExecutor.SUPPORTED_LANGUAGES.keys()),
+            'active_users': list(self.clients.keys()),
+            'http_port': self.http_port,
+            'file_upload_url': f'http://{self.host}:{self.http_port}/upload',
+            'file_download_url': f'http://{self.host}:{self.http_port}/download',
+            'file_list_url': f'http://{self.host}:{self.http_port}/files'
+        })
+        connection.send(f"SERVER_INFO|{server_info}".encode('utf-8'))
+        log_networking(f"Sent server info to {client_name}", client_name)
+        
+        # Send user's groups immediately after connection
+        user_groups = self.db.get_user_groups(client_name)
+        self.presence.user_online(client_name, user_groups)
+        if user_groups:
+            groups_info = json.dumps({
+                'type': 'USER_GROUPS',
+                'groups': user_groups
+            })
+            connection.send(f"USER_GROUPS|{groups_info}".encode('utf-8'))
+            log_networking(f"Sent user groups to {client_name}: {user_groups}", client_name)
+        
+        return True
+    
+    def welcome_client(self, client_name):
+        """Send initial history and announce a newly registered client"""
+        # Send general chat history immediately
+        self.send_message_history(client_name, "BROADCAST", None)
+        
+        # Broadcast new client connection and update user lists
+        self.broadcast_message(f"SERVER: {client_name} has joined the chat!")
+        self.broadcast_user_list()
+        log_networking(f" Announced {client_name}'s arrival to all clients")
+    
+    def unregister_client(self, client_name):
+        """Remove a client from the registry and its code sessions"""
+        if not self.clients.remove(client_name):
+            return
+        
+        self.presence.user_offline(client_name)
+        log_networking(f" {client_name} disconnected, removed from client list", client_name)
+        
+        # Remove from code sessions; only the user's own sessions are visited
+        sessions_removed = self.presence.leave_all_sessions(client_name)
+        for session_id, remaining in sessions_removed.items():
+            session = self.code_sessions.get(session_id)
+            if session is not None:
+                session['synced'].pop(client_name, None)
+            log_code_session(f"{client_name} removed from session", session_id)
+            
+            # Empty sessions are kept in the session store until someone rejoins
+            if not remaining:
+                self.unload_code_session(session_id)
+                continue
+            
+            # Notify other participants
+            self.broadcast_to_session(session_id, {
+                'type': 'user_left',
+                'user': client_name,
+                'participants': remaining
+            })
+        
+        if sessions_removed:
+            log_code_session(f"{client_name} was removed from {len(sessions_removed)} sessions")
+        
+        self.broadcast_message(f"SERVER: {client_name} has left the chat")
+        self.broadcast_user_list()
+        log_networking(f" Announced {client_name}'s departure to all clients")
+    
     def broadcast_user_list(self):
         """Broadcast updated user list to all clients"""
         user_list = list(self.clients.keys())
@@ -438,14 +681,14 @@ class ChatServer:
             if message_type == "BROADCAST":
                 broadcast_msg = parts[1]
                 log_networking(f" BROADCAST: {sender} -> ALL: {broadcast_msg}", sender)
-                self.db.save_message(sender, broadcast_msg, "BROADCAST")
+                self.db.queue_message(sender, broadcast_msg, "BROADCAST")
                 self.broadcast_message(f"{sender}: {broadcast_msg}", exclude=None)
                 
             elif message_type == "PERSONAL":
                 recipient = parts[1]
                 content = parts[2]
                 log_networking(f" PERSONAL: {sender} -> {recipient}: {content}", sender)
-                self.db.save_message(sender, content, "PERSONAL", recipient=recipient)
+                self.db.queue_message(sender, content, "PERSONAL", recipient=recipient)
                 self.send_personal_message(sender, recipient, content)
                 
             elif message_type == "CREATE_GROUP":
@@ -458,7 +701,7 @@ class ChatServer:
                 group_name = parts[1]
                 content = parts[2]
                 log_networking(f" GROUP: {sender} -> [{group_name}]: {content}", sender)
-                self.db.save_message(sender, content, "GROUP", group_name=group_name)
+                self.db.queue_message(sender, content, "GROUP", group_name=group_name)
                 self.send_group_message(sender, group_name, content)
                 
             elif message_type == "LIST_CLIENTS":
@@ -481,6 +724,18 @@ class ChatServer:
                 log_networking(f" GET_MESSAGES: {sender} requesting {msg_type} messages for {target}", sender)
                 self.send_message_history(sender, msg_type, target)
             
+            elif message_type == "GET_MESSAGES_PAGE":
+                try:
+                    page_request = json.loads(parts[1])
+                    msg_type = page_request.get('msg_type')
+                    target = page_request.get('target')
+                    before_id = page_request.get('before_id')
+                    limit = page_request.get('limit', HISTORY_PAGE_SIZE)
+                    log_networking(f" GET_MESSAGES_PAGE: {sender} requesting {limit} {msg_type} messages for {target} before {before_id}", sender)
+                    self.send_message_history(sender, msg_type, target, before_id=before_id, limit=limit)
+                except json.JSONDecodeError:
+                    log_networking(f"Invalid JSON in GET_MESSAGES_PAGE from {sender}", sender)
+            
             # File-related message handling
             elif message_type == "LIST_FILES":
                 log_file_transfer(f"LIST_FILES request from {sender}")
@@ -526,8 +781,6 @@ class ChatServer:
             elif message_type == "CODE_UPDATE":
                 try:
                     update_data = json.loads(parts[1])
-                    session_id = update_data.get('session_id')
-                    log_code_session(f"Code update from {sender} ({len(update_data.get('code', ''))} chars)", session_id)
                     self.handle_code_update(sender, update_data)
                 except json.JSONDecodeError:
                     log_code_session(f"Invalid JSON in CODE_UPDATE from {sender}", "ERROR")
@@ -541,6 +794,14 @@ class ChatServer:
                     self.handle_code_execution(sender, exec_data)
                 except json.JSONDecodeError:
                     log_code_session(f"Invalid JSON in EXECUTE_CODE from {sender}", "ERROR")
+            
+            elif message_type == "CANCEL_EXECUTION":
+                try:
+                    cancel_data = json.loads(parts[1])
+                    log_code_session(f"{sender} cancelling job {cancel_data.get('job_id')}", cancel_data.get('session_id'))
+                    self.handle_cancel_execution(sender, cancel_data)
+                except json.JSONDecodeError:
+                    log_code_session(f"Invalid JSON in CANCEL_EXECUTION from {sender}", "ERROR")
                     
             elif message_type == "INVITE_TO_CODE":
                 try:
@@ -558,29 +819,43 @@ class ChatServer:
         except Exception as e:
             log_networking(f" Error processing message from {sender}: {e}", sender)
     
-    def send_message_history(self, requester, msg_type, target):
-        """Send message history to a client with improved reliability"""
+    def send_message_history(self, requester, msg_type, target, before_id=None, limit=HISTORY_PAGE_SIZE):
+        """Send one page of message history to a client.
+        
+        Without before_id this is the latest page; with it, the page of messages
+        just older than that id. has_more tells the client whether to keep paging.
+        """
         try:
+            limit = max(1, min(int(limit), MAX_HISTORY_PAGE_SIZE))
+            
+            # Fetch one extra row to learn whether an older page exists
             if msg_type == "BROADCAST":
-                messages = self.db.get_messages("BROADCAST")
+                messages = self.db.get_messages("BROADCAST", limit=limit + 1, before_id=before_id)
             elif msg_type == "PERSONAL":
-                messages = self.db.get_messages("PERSONAL", requester, target)
+                messages = self.db.get_messages("PERSONAL", requester, target, limit=limit + 1, before_id=before_id)
             elif msg_type == "GROUP":
-                messages = self.db.get_messages("GROUP", requester, target)
+                messages = self.db.get_messages("GROUP", requester, target, limit=limit + 1, before_id=before_id)
             else:
                 log_networking(f"Invalid message type for history: {msg_type}", requester)
                 return
             
+            has_more = len(messages) > limit
+            if has_more:
+                messages = messages[1:]
+            
             history_data = {
                 'type': 'MESSAGE_HISTORY',
                 'msg_type': msg_type,
                 'target': target,
+                'before_id': before_id,
+                'has_more': has_more,
                 'messages': []
             }
             
             for msg in messages:
-                sender, content, timestamp, file_data = msg
+                message_id, sender, content, timestamp, file_data = msg
                 message_item = {
+                    'id': message_id,
                     'sender': sender,
                     'content': content,
                     'timestamp': timestamp,
@@ -607,6 +882,7 @@ class ChatServer:
         if self.db.create_group(group_name, creator):
             # Add creator to group
             self.db.add_group_member(group_name, creator)
+            self.presence.add_group_member(group_name, creator)
             
             valid_members = [creator]
             invalid_members = []
@@ -615,6 +891,7 @@ class ChatServer:
                 member = member.strip()
                 if member and member in self.clients and member != creator:
                     self.db.add_group_member(group_name, member)
+                    self.presence.add_group_member(group_name, member)
                     valid_members.append(member)
                     log_networking(f" Added {member} to group '{group_name}'")
                 elif member and member != creator:
@@ -672,12 +949,14 @@ class ChatServer:
         message = f"[{group_name}] {sender}: {content}"
         log_networking(f"👥 Broadcasting to group '{group_name}' ({len(group_members)} members): {content[:50]}...")
         
-        # Send directly to group members
+        # Encode once, share the frame across the queues of the members online
+        frame = encode_frame(message)
         delivered = 0
-        for member in group_members:
-            if member in self.clients:
+        for member in self.presence.online_members(group_name):
+            client = self.clients.get(member)
+            if client is not None:
                 try:
-                    self.clients[member][0].send(message.encode('utf-8'))
+                    client[0].send_frame(frame)
                     delivered += 1
                 except:
                     log_networking(f"Failed to deliver group message to {member}")
@@ -690,19 +969,26 @@ class ChatServer:
         session_id = str(uuid.uuid4())[:8]
         log_code_session(f"Creating new {language} session for {creator}", session_id)
         
-        self.code_sessions[session_id] = {
-            'code': f'# Welcome to collaborative {language} coding!\n# Start writing your code here...\n\n',
+        session = {
+            'document': ServerDocument(f'# Welcome to collaborative {language} coding!\n# Start writing your code here...\n\n'),
             'language': language or 'python',
-            'participants': [creator],
+            'synced': {creator: 0},  # {participant: version of the last full document sent}
+            'snapshot_version': 0,  # version of the last snapshot in the session store
             'owner': creator,
             'created_at': datetime.now().isoformat()
         }
+        with self.code_session_lock:
+            self.code_sessions[session_id] = session
+            self.presence.join_session(creator, session_id)
+            self.db.session_store.create(session_id, session['language'], creator, session['created_at'],
+                                         session['document'].text)
         
         session_data = {
             'type': 'session_created',
             'session_id': session_id,
-            'language': language or 'python',
-            'code': self.code_sessions[session_id]['code']
+            'language': session['language'],
+            'code': session['document'].text,
+            'version': 0
         }
         
         if creator in self.clients:
@@ -716,18 +1002,27 @@ class ChatServer:
     
     def handle_join_code_session(self, user, session_id):
         """Add user to existing code session"""
-        if session_id in self.code_sessions:
-            if user not in self.code_sessions[session_id]['participants']:
-                self.code_sessions[session_id]['participants'].append(user)
-                log_code_session(f"{user} joined session (now {len(self.code_sessions[session_id]['participants'])} participants)", session_id)
-                
+        with self.code_session_lock:
+            # Loads it from the session store if nobody is in it
+            found = self.load_code_session(session_id)
+            joined = found and self.presence.join_session(user, session_id)
+            if joined:
+                session = self.code_sessions[session_id]
+                document = session['document']
+                session['synced'][user] = document.revision
+                participants = self.presence.participants(session_id)
                 session_data = {
                     'type': 'session_joined',
                     'session_id': session_id,
-                    'language': self.code_sessions[session_id]['language'],
-                    'code': self.code_sessions[session_id]['code'],
-                    'participants': self.code_sessions[session_id]['participants']
+                    'language': session['language'],
+                    'code': document.text,
+                    'version': document.revision,
+                    'participants': participants
                 }
+        
+        if found:
+            if joined:
+                log_code_session(f"{user} joined session (now {len(participants)} participants)", session_id)
                 
                 if user in self.clients:
                     try:
@@ -739,7 +1034,7 @@ class ChatServer:
                 self.broadcast_to_session(session_id, {
                     'type': 'user_joined',
                     'user': user,
-                    'participants': self.code_sessions[session_id]['participants']
+                    'participants': participants
                 }, exclude=user)
             else:
                 log_code_session(f"{user} already in session", session_id)
@@ -753,67 +1048,305 @@ class ChatServer:
                     pass
     
     def handle_code_update(self, sender, update_data):
-        """Handle real-time code updates"""
+        """Merge a participant's edit into the session document and relay it.
+
+        update_data carries an OT 'op' made against document 'version'; it is
+        transformed past any edits the sender had not seen yet (see ot.py).
+        Older clients sending 'ops' edit lists or the full 'code' are still
+        accepted.
+        """
         session_id = update_data.get('session_id')
-        
-        if session_id in self.code_sessions and sender in self.code_sessions[session_id]['participants']:
-            code_length = len(update_data.get('code', ''))
-            self.code_sessions[session_id]['code'] = update_data.get('code', '')
-            log_code_session(f"Code updated by {sender} ({code_length} chars)", session_id)
+        with self.code_session_lock:
+            # Looked up under the lock: a session being unloaded is gone
+            # from code_sessions, and its final snapshot must stay final
+            session = self.code_sessions.get(session_id)
+            if session is None or not self.presence.in_session(sender, session_id):
+                log_code_session(f" Invalid code update from {sender}", session_id)
+                return
+            document = session['document']
+            version = update_data.get('version', document.revision)
+            try:
+                if 'op' in update_data:
+                    operation = TextOperation.from_json(update_data['op'])
+                elif 'ops' in update_data:
+                    validate_edits(update_data['ops'])
+                    operation = TextOperation.from_edits(update_data['ops'], document.length_at(version))
+                else:
+                    version = document.revision
+                    operation = TextOperation.diff(document.text, update_data.get('code', ''))
+                    if operation.is_noop():
+                        return
+                operation = document.receive(version, operation)
+            except StaleRevision as e:
+                log_code_session(f"Edit from {sender} is too old to merge ({e}); resyncing", session_id)
+                self.resync_participant(sender, session_id)
+                return
+            except (ValueError, KeyError, TypeError) as e:
+                log_code_session(f" Rejected edit from {sender}: {e}", session_id)
+                self.resync_participant(sender, session_id)
+                return
             
-            broadcast_data = {
-                'type': 'code_update',
-                'session_id': session_id,
-                'code': update_data.get('code', ''),
+            missed = document.revision - 1 - version
+            log_code_session(f"Version {document.revision} by {sender} "
+                             f"({edit_size(operation.to_edits())} chars changed, {len(document.text)} total"
+                             f"{f', merged past {missed} concurrent edits' if missed else ''})", session_id)
+            
+            self.db.session_store.append(session_id, document.revision, sender, operation)
+            if (document.revision - session['snapshot_version'] >= SNAPSHOT_INTERVAL
+                    or self.db.session_store.needs_snapshot(session_id)):
+                self.db.session_store.snapshot(session_id, document.revision, document.text)
+                session['snapshot_version'] = document.revision
+            
+            # The ack and the relay to the others go out on the session's next tick
+            self.code_update_coalescer.add(session_id, {
                 'user': sender,
+                'op': operation,
+                'version': document.revision,
                 'cursor_pos': update_data.get('cursor_pos')
+            })
+    
+    def flush_code_updates(self, session_id, entries):
+        """Send one tick of accepted edits; returns the number of frames sent.
+
+        Everyone who made none of the edits gets them in a single code_update.
+        An author gets the edits of others before and after its own as
+        separate code_updates, and a code_ack for each of its own, in
+        document order. Edits are listed rather than composed into one
+        operation: clients must transform their unconfirmed edits past the
+        same operations the server did, or insert ties can break differently.
+        """
+        session = self.code_sessions.get(session_id)
+        if session is None:
+            return 0
+        
+        authors = {entry['user'] for entry in entries}
+        shared_frame = None
+        frames = 0
+        for participant in self.presence.participants(session_id):
+            client = self.clients.get(participant)
+            if client is None:
+                continue
+            # Skip edits already contained in a document sent on join or resync
+            synced = session['synced'].get(participant, 0)
+            if participant not in authors and synced < entries[0]['version']:
+                if shared_frame is None:
+                    shared_frame = encode_frame(f"CODE_SESSION|{json.dumps(self.code_update_message(session_id, entries))}")
+                tick_frames = [shared_frame]
+            else:
+                tick_frames = [encode_frame(f"CODE_SESSION|{json.dumps(message)}")
+                               for message in self.code_tick_messages(session_id, participant,
+                                                                      [entry for entry in entries if entry['version'] > synced])]
+            try:
+                for frame in tick_frames:
+                    client[0].send_frame(frame)
+                    frames += 1
+            except Exception as e:
+                log_code_session(f" Failed to send edits to {participant}: {e}", session_id)
+        return frames
+    
+    def code_tick_messages(self, session_id, participant, entries):
+        """One participant's messages for a tick: others' edits grouped, acks for its own"""
+        messages = []
+        run = []
+        for entry in entries:
+            if entry['user'] != participant:
+                run.append(entry)
+                continue
+            if run:
+                messages.append(self.code_update_message(session_id, run))
+                run = []
+            messages.append({'type': 'code_ack', 'session_id': session_id, 'version': entry['version']})
+        if run:
+            messages.append(self.code_update_message(session_id, run))
+        return messages
+    
+    def code_update_message(self, session_id, entries):
+        """A code_update carrying consecutive versions, ending at entries[-1]"""
+        cursors = {}
+        for entry in entries:
+            cursors[entry['user']] = entry['cursor_pos']
+        return {
+            'type': 'code_update',
+            'session_id': session_id,
+            'version': entries[-1]['version'],
+            'ops': [entry['op'].to_json() for entry in entries],
+            'users': list(cursors),
+            'cursors': cursors
+        }
+    
+    def code_tick_window(self, session_id):
+        """Current tick length for a session, from its participants' links"""
+        participants = self.presence.participants(session_id)
+        connections = [client[0] for client in map(self.clients.get, participants) if client]
+        return tick_window(len(connections),
+                           [connection.round_trip_time() for connection in connections],
+                           any(connection.pending_bytes() > BACKLOG_BYTES for connection in connections))
+    
+    def load_code_session(self, session_id):
+        """Bring a stored session back into code_sessions; returns False if there is none"""
+        with self.code_session_lock:
+            if session_id in self.code_sessions:
+                return True
+            stored = self.db.session_store.load(session_id)
+            if stored is None:
+                return False
+            self.code_sessions[session_id] = {
+                'document': ServerDocument(stored['text'], stored['version']),
+                'language': stored['language'],
+                'synced': {},
+                'snapshot_version': stored['snapshot_version'],
+                'owner': stored['owner'],
+                'created_at': stored['created_at']
             }
-            
-            self.broadcast_to_session(session_id, broadcast_data, exclude=sender)
-            log_code_session(f"Broadcasted code update to {len(self.code_sessions[session_id]['participants'])-1} participants", session_id)
-        else:
-            log_code_session(f" Invalid code update from {sender}", session_id)
+        log_code_session(f"Loaded from the session store at version {stored['version']} "
+                         f"({stored['version'] - stored['snapshot_version']} operations replayed)", session_id)
+        return True
+    
+    def unload_code_session(self, session_id):
+        """Snapshot a session nobody is in and drop it from memory"""
+        with self.code_session_lock:
+            session = self.code_sessions.get(session_id)
+            if session is None or self.presence.participant_count(session_id):
+                return
+            document = session['document']
+            if (document.revision > session['snapshot_version']
+                    or self.db.session_store.needs_snapshot(session_id)):
+                self.db.session_store.snapshot(session_id, document.revision, document.text)
+            del self.code_sessions[session_id]
+            self.code_update_coalescer.forget(session_id)
+        log_code_session(f"Empty session saved at version {document.revision} and unloaded", session_id)
+    
+    def save_code_sessions(self):
+        """Snapshot every loaded session; used at shutdown"""
+        with self.code_session_lock:
+            for session_id, session in self.code_sessions.items():
+                document = session['document']
+                if (document.revision > session['snapshot_version']
+                        or self.db.session_store.needs_snapshot(session_id)):
+                    self.db.session_store.snapshot(session_id, document.revision, document.text)
+                    session['snapshot_version'] = document.revision
+        log_code_session(f"Saved {len(self.code_sessions)} code sessions")
+    
+    def resync_participant(self, user, session_id):
+        """Send one participant the whole canonical document; caller holds code_session_lock"""
+        document = self.code_sessions[session_id]['document']
+        self.code_sessions[session_id]['synced'][user] = document.revision
+        self.send_to_participant(user, {
+            'type': 'code_resync',
+            'session_id': session_id,
+            'code': document.text,
+            'version': document.revision
+        })
     
     def handle_code_execution(self, sender, exec_data):
-        """Handle code execution requests"""
+        """Queue a code execution request for the execution scheduler"""
         session_id = exec_data.get('session_id')
         
-        if session_id in self.code_sessions and sender in self.code_sessions[session_id]['participants']:
-            code = exec_data.get('code', self.code_sessions[session_id]['code'])
-            language = exec_data.get('language', self.code_sessions[session_id]['language'])
+        session = self.code_sessions.get(session_id)
+        if session is not None and self.presence.in_session(sender, session_id):
+            code = exec_data.get('code', session['document'].text)
+            language = exec_data.get('language', session['language'])
             input_data = exec_data.get('input', '')
             
-            log_code_session(f" Executing {language} code by {sender} ({len(code)} chars)", session_id)
+            log_code_session(f" Queueing {language} code by {sender} ({len(code)} chars)", session_id)
             if input_data:
                 log_code_session(f" Input provided: {input_data[:50]}{'...' if len(input_data) > 50 else ''}", session_id)
             
-            # Execute code (this might take time)
-            start_time = time.time()
-            result = CodeExecutor.execute_code(code, language, input_data)
-            execution_time = time.time() - start_time
-            
-            success = result.get('success', False)
-            output = result.get('output', '')
-            error = result.get('error', '')
-            
-            log_code_session(f" Execution {'successful' if success else 'failed'} in {execution_time:.2f}s", session_id)
-            if output:
-                log_code_session(f" Output: {output[:100]}{'...' if len(output) > 100 else ''}", session_id)
-            if error:
-                log_code_session(f" Error: {error[:100]}{'...' if len(error) > 100 else ''}", session_id)
-            
-            result_data = {
-                'type': 'execution_result',
-                'session_id': session_id,
-                'result': result,
-                'executed_by': sender
-            }
-            
-            self.broadcast_to_session(session_id, result_data)
-            log_code_session(f" Execution result broadcasted to all participants", session_id)
+            try:
+                self.execution_scheduler.submit(sender, session_id, code, language, input_data)
+            except ExecutionQueueFull as e:
+                log_code_session(f" Execution rejected: {e}", session_id)
+                self.send_to_participant(sender, {
+                    'type': 'execution_rejected',
+                    'session_id': session_id,
+                    'reason': 'Too many runs waiting; wait for one to finish or cancel it'
+                })
         else:
             log_code_session(f" Invalid execution request from {sender}", session_id)
     
+    def run_execution_job(self, job):
+        """Execute a queued job on a scheduler worker and broadcast its result"""
+        session_id = job.session_id
+        
+        # Execute code (this might take time)
+        start_time = time.time()
+        relay = ExecutionOutputRelay(self, job)
+        result = CodeExecutor.execute_code(job.code, job.language, job.input_data, job=job,
+                                           on_output=relay.write)
+        execution_time = time.time() - start_time
+        
+        success = result.get('success', False)
+        output = result.get('output', '')
+        error = result.get('error', '')
+        
+        log_code_session(f" Execution {'successful' if success else 'failed'} in {execution_time:.2f}s", session_id)
+        if output:
+            log_code_session(f" Output: {output[:100]}{'...' if len(output) > 100 else ''}", session_id)
+        if error:
+            log_code_session(f" Error: {error[:100]}{'...' if len(error) > 100 else ''}", session_id)
+        
+        result_data = {
+            'type': 'execution_result',
+            'session_id': session_id,
+            'job_id': job.job_id,
+            'result': result,
+            'executed_by': job.user
+        }
+        
+        self.broadcast_to_session(session_id, result_data)
+        log_code_session(f" Execution result broadcasted to all participants", session_id)
+    
+    def report_queue_position(self, job, position):
+        """Tell a session where its waiting run is in the execution queue"""
+        self.broadcast_to_session(job.session_id, {
+            'type': 'execution_queued',
+            'session_id': job.session_id,
+            'job_id': job.job_id,
+            'executed_by': job.user,
+            'position': position
+        })
+    
+    def report_execution_started(self, job):
+        self.broadcast_to_session(job.session_id, {
+            'type': 'execution_started',
+            'session_id': job.session_id,
+            'job_id': job.job_id,
+            'executed_by': job.user
+        })
+    
+    def handle_cancel_execution(self, sender, cancel_data):
+        """Cancel a queued or running job; allowed for its submitter and the session owner"""
+        job = self.execution_scheduler.get_job(cancel_data.get('job_id'))
+        if job is None:
+            log_code_session(f" No such job to cancel: {cancel_data.get('job_id')}", cancel_data.get('session_id'))
+            return
+        
+        session = self.code_sessions.get(job.session_id)
+        if sender != job.user and (session is None or session['owner'] != sender):
+            log_code_session(f" {sender} may not cancel job {job.job_id}", job.session_id)
+            return
+        
+        cancelled_from = self.execution_scheduler.cancel(job.job_id)
+        if cancelled_from is None:
+            log_code_session(f" Job {job.job_id} finished before it could be cancelled", job.session_id)
+        elif cancelled_from == 'queued':
+            # A running job reports through its execution_result instead
+            self.broadcast_to_session(job.session_id, {
+                'type': 'execution_cancelled',
+                'session_id': job.session_id,
+                'job_id': job.job_id,
+                'executed_by': job.user,
+                'cancelled_by': sender
+            })
+    
+    def send_to_participant(self, user, data):
+        """Send one CODE_SESSION message to a single user"""
+        if user in self.clients:
+            try:
+                self.clients[user][0].send_frame(encode_frame(f"CODE_SESSION|{json.dumps(data)}"))
+            except Exception as e:
+                log_code_session(f" Failed to send to {user}: {e}")
+    
     def handle_code_invitation(self, sender, invite_data):
         """Handle code session invitations"""
         recipient = invite_data.get('recipient')
@@ -821,12 +1354,13 @@ class ChatServer:
         
         log_code_session(f"{sender} inviting {recipient} to session", session_id)
         
-        if recipient in self.clients and session_id in self.code_sessions:
+        session = self.code_sessions.get(session_id)
+        if recipient in self.clients and session is not None:
             invitation = {
                 'type': 'code_invitation',
                 'from': sender,
                 'session_id': session_id,
-                'language': self.code_sessions[session_id]['language']
+                'language': session['language']
             }
             
             try:
@@ -837,11 +1371,19 @@ class ChatServer:
         else:
             log_code_session(f" Cannot invite {recipient} (not online or session not found)", session_id)
     
-    def broadcast_to_session(self, session_id, data, exclude=None):
+    def session_backlogged(self, session_id, limit):
+        """True if any participant of the session has more than limit bytes queued"""
+        for participant in self.presence.participants(session_id):
+            client = self.clients.get(participant)
+            if client is not None and client[0].pending_bytes() > limit:
+                return True
+        return False
+    
+    def broadcast_to_session(self, session_id, data, exclude=None, quiet=False):
         """Broadcast message to all participants in a code session"""
         if session_id in self.code_sessions:
-            participants = self.code_sessions[session_id]['participants']
-            message = f"CODE_SESSION|{json.dumps(data)}"
+            participants = self.presence.participants(session_id)
+            frame = encode_frame(f"CODE_SESSION|{json.dumps(data)}")
             
             sent_count = 0
             for participant in participants:
@@ -849,26 +1391,28 @@ class ChatServer:
                     continue
                 if participant in self.clients:
                     try:
-                        self.clients[participant][0].send(message.encode('utf-8'))
+                        self.clients[participant][0].send_frame(frame)
                         sent_count += 1
                     except:
                         log_code_session(f"Failed to send to {participant}", session_id)
             
-            log_code_session(f"Broadcasted to {sent_count}/{len(participants)} participants", session_id)
+            if not quiet:
+                log_code_session(f"Broadcasted to {sent_count}/{len(participants)} participants", session_id)
         else:
             log_code_session(f" Cannot broadcast to non-existent session", session_id)
     
     def broadcast_message(self, message, exclude=None, is_system=False):
         """Send a message to all connected clients"""
-        recipients = [name for name in self.clients.keys() if name != exclude]
+        # One snapshot of the registry; clients may come and go meanwhile
+        recipients = [(name, entry[0]) for name, entry in self.clients.items() if name != exclude]
         log_networking(f" Broadcasting to {len(recipients)} clients: {message[:50]}...")
         
+        # Encode once, share the frame across every recipient's queue
+        frame = encode_frame(message)
         sent_count = 0
-        for client_name, (client_socket, _) in self.clients.items():
-            if exclude and client_name == exclude:
-                continue
+        for client_name, connection in recipients:
             try:
-                client_socket.send(message.encode('utf-8'))
+                connection.send_frame(frame)
                 sent_count += 1
             except:
                 log_networking(f"Failed to broadcast to {client_name}")
@@ -879,8 +1423,9 @@ class ChatServer:
         """Send a private message to a specific client"""
         log_networking(f" Sending personal message: {sender} -> {recipient}: {content[:50]}...")
         
-        if recipient in self.clients:
-            recipient_socket = self.clients[recipient][0]
+        recipient_entry = self.clients.get(recipient)
+        if recipient_entry is not None:
+            recipient_socket = recipient_entry[0]
             message = f"PM from {sender}: {content}"
             try:
                 recipient_socket.send(message.encode('utf-8'))
@@ -907,10 +1452,167 @@ class ChatServer:
                 except:
                     pass
 
+class AsyncChatServer(ChatServer):
+    """Chat server engine that serves every client from a single asyncio event loop.
+    
+    Idle connections cost a StreamReader/StreamWriter pair instead of a thread
+    stack. Messages go through the same process_message dispatch as the
+    threaded engine; verbs that wait on SQLite are run in the loop's default
+    executor so they never stall other clients.
+    """
+    
+    # Protocol verbs that are handed off to the executor instead of the loop:
+    # history reads wait for the message writer's pending commit, the others
+    # query or write the database directly (JOIN_CODE_SESSION may load the
+    # session from the session store, GROUP reads the members on a member
+    # cache miss). EXECUTE_CODE only enqueues a job for the execution
+    # scheduler and stays on the loop.
+    BLOCKING_VERBS = {
+        'GET_MESSAGES', 'GET_MESSAGES_PAGE',
+        'LIST_CLIENTS', 'LIST_GROUPS', 'LIST_FILES',
+        'CREATE_GROUP', 'DELETE_FILE', 'JOIN_CODE_SESSION', 'GROUP'
+    }
+    
+    def __init__(self, host='localhost', port=5555, backlog=1024, **options):
+        super().__init__(host, port, **options)
+        self.backlog = backlog
+        self.loop = None
+    
+    def start(self):
+        """Start the HTTP server and run the chat server event loop"""
+        self.server_socket.listen(self.backlog)
+        self.server_socket.setblocking(False)
+        log_server(f" Async chat server LISTENING on {self.host}:{self.port} (backlog {self.backlog})")
+        log_server(f" Supported programming languages: {list(CodeExecutor.SUPPORTED_LANGUAGES.keys())}")
+        
+        # Start file transfer server
+        file_server_url = self.file_server.start()
+        log_server(f" File transfer server started at {file_server_url}")
+        
+        log_server(" Server is ready to accept connections!")
+        log_server("=" * 60)
+        
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            log_server(" Keyboard interrupt received, shutting down...")
+        finally:
+            log_server("Cleaning up server resources...")
+            self.server_socket.close()
+            self.execution_scheduler.shutdown()
+            self.code_update_coalescer.shutdown()
+            CodeExecutor.shutdown_interpreter_pools()
+            CodeExecutor.close_compile_cache()
+            self.file_server.stop()
+            self.save_code_sessions()
+            self.db.close_connections()
+            log_server(" Server shutdown complete")
+    
+    async def serve(self):
+        """Accept connections until the loop is stopped"""
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self.handle_connection,
+                                            sock=self.server_socket,
+                                            backlog=self.backlog)
+        async with server:
+            await server.serve_forever()
+    
+    async def handle_connection(self, reader, writer):
+        """Coroutine equivalent of ChatServer.handle_client"""
+        client_address = writer.get_extra_info('peername')
+        connection = AsyncClientConnection(reader, writer, self.loop, **self.outbound_limits)
+        client_name = None
+        try:
+            log_networking(f"Handling new client from {client_address}")
+            
+            # Get client name
+            frame = await connection.read_frame()
+            if frame is None:
+                return
+            client_name = frame.decode('utf-8')
+            log_networking(f"Client wants username: '{client_name}'", client_name)
+            
+            # Both read the database (the user's groups, then chat history)
+            registered = await self.loop.run_in_executor(None, self.register_client, client_name,
+                                                         connection, client_address)
+            if not registered:
+                client_name = None
+                return
+            
+            await self.loop.run_in_executor(None, self.welcome_client, client_name)
+            
+            log_networking(f"Starting message loop for {client_name}", client_name)
+            while True:
+                frame = await connection.read_frame()
+                if frame is None:
+                    log_networking(f"No data received from {client_name}, closing connection", client_name)
+                    break
+                
+                data = frame.decode('utf-8')
+                log_networking(f" Received from {client_name}: {data[:100]}{'...' if len(data) > 100 else ''}", client_name)
+                await self.dispatch_message(client_name, data)
+                
+        except Exception as e:
+            log_networking(f" Error handling client {client_address}: {e}", client_name)
+        finally:
+            if client_name:
+                self.unregister_client(client_name)
+            
+            connection.close()
+            log_networking(f" Socket closed for {client_name or client_address}")
+    
+    async def dispatch_message(self, sender, message):
+        """Run process_message on the loop, or in the executor for blocking verbs.
+        
+        Awaiting the executor holds back only this client's next message, so
+        its messages are still handled in order.
+        """
+        message_type = message.split('|', 1)[0]
+        if message_type in self.BLOCKING_VERBS:
+            await self.loop.run_in_executor(None, self.process_message, sender, message)
+        else:
+            self.process_message(sender, message)
+
+# Server engines selectable with --engine
+ENGINES = {
+    'threaded': ChatServer,
+    'async': AsyncChatServer
+}
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DevConnect chat server")
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='threaded',
+                        help="connection engine: one thread per client or a single asyncio event loop")
+    parser.add_argument('--send-queue-frames', type=int, default=DEFAULT_MAX_QUEUED_FRAMES,
+                        help="maximum frames queued for one client before the slow consumer policy applies")
+    parser.add_argument('--send-queue-bytes', type=int, default=DEFAULT_HIGH_WATER_BYTES,
+                        help="high-water mark in bytes for one client's outbound queue")
+    parser.add_argument('--slow-consumer-policy', choices=SLOW_CONSUMER_POLICIES, default='disconnect',
+                        help="drop new messages for a slow client, or disconnect it")
+    parser.add_argument('--http-workers', type=int, default=DEFAULT_HTTP_WORKERS,
+                        help="file transfers (HTTP connections) served concurrently")
+    parser.add_argument('--http-pending', type=int, default=DEFAULT_HTTP_PENDING,
+                        help="HTTP connections allowed to wait for a worker before getting 503")
+    parser.add_argument('--max-upload-size', type=int, default=DEFAULT_MAX_UPLOAD_SIZE,
+                        help="largest file, in bytes, accepted for upload (larger ones get 413)")
+    parser.add_argument('--execution-workers', type=int, default=DEFAULT_EXECUTION_WORKERS,
+                        help="code runs (compilers/programs) executed at the same time")
+    parser.add_argument('--execution-cgroup', default=None,
+                        help="delegated cgroup v2 directory; each code run gets a child cgroup "
+                             "with memory and process limits")
+    args = parser.parse_args()
+    
     print("=" * 60)
     print(" STARTING ENHANCED CHAT SERVER WITH DETAILED LOGGING")
+    print(f" Engine: {args.engine}")
     print("=" * 60)
     
-    server = ChatServer()
+    server = ENGINES[args.engine](max_queued_frames=args.send_queue_frames,
+                                  high_water_bytes=args.send_queue_bytes,
+                                  slow_consumer_policy=args.slow_consumer_policy,
+                                  http_workers=args.http_workers,
+                                  http_pending=args.http_pending,
+                                  max_upload_size=args.max_upload_size,
+                                  execution_workers=args.execution_workers,
+                                  execution_cgroup=args.execution_cgroup)
     server.start()
\ No newline at end of file
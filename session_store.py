@@ -0,0 +1,326 @@
+# session_store.py - Durable code sessions: snapshots plus an edit log
+#
+# Code sessions used to live only in ChatServer.code_sessions, so a restart
+# lost every document and a session vanished as soon as its last participant
+# left. Each session is now stored in the chat database as a snapshot (the
+# full text at some version) plus the operations accepted since, one row per
+# version. Accepted edits are appended by a background writer in batched
+# transactions, off the editing path. Every SNAPSHOT_INTERVAL operations,
+# and when a session is unloaded, a new snapshot is written and the log up to
+# it is deleted in the same transaction, so loading a session replays at most
+# a short tail. On startup recover() replays the logs left by a crash and
+# compacts them, then drops sessions nobody has edited for RETENTION_DAYS.
+#
+# A batch that still fails after WRITE_ATTEMPTS tries is written one change
+# at a time, and the sessions whose changes could not be stored are marked
+# as needing a snapshot: their stored log has a gap that only a new snapshot
+# of the in-memory document repairs.
+import collections
+import json
+import threading
+import time
+from datetime import datetime
+
+from ot import TextOperation
+
+DEFAULT_FLUSH_INTERVAL = 0.02  # seconds
+SNAPSHOT_INTERVAL = 500        # operations between snapshots of a busy session
+RETENTION_DAYS = 30
+WRITE_ATTEMPTS = 3             # tries for a batch before its changes are written one by one
+
+
+def log_session_store(message, operation="SESSIONS"):
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    print(f"[DATABASE {operation}] {timestamp} - {message}")
+
+
+class CodeSessionStore:
+    """Snapshot + operation log persistence for collaborative code sessions"""
+
+    SESSIONS_TABLE = '''
+        CREATE TABLE IF NOT EXISTS code_sessions (
+            session_id TEXT PRIMARY KEY,
+            language TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            snapshot TEXT NOT NULL,
+            snapshot_version INTEGER NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    '''
+
+    OPERATIONS_TABLE = '''
+        CREATE TABLE IF NOT EXISTS code_session_ops (
+            session_id TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            author TEXT,
+            operation TEXT NOT NULL,
+            logged_at DATETIME,
+            PRIMARY KEY (session_id, version)
+        ) WITHOUT ROWID
+    '''
+
+    CREATE_SQL = '''
+        INSERT OR REPLACE INTO code_sessions
+            (session_id, language, owner, created_at, snapshot, snapshot_version)
+        VALUES (?, ?, ?, ?, ?, 0)
+    '''
+
+    APPEND_SQL = '''
+        INSERT OR REPLACE INTO code_session_ops (session_id, version, author, operation, logged_at)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+    '''
+
+    SNAPSHOT_SQL = '''
+        UPDATE code_sessions SET snapshot = ?, snapshot_version = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE session_id = ?
+    '''
+
+    # A snapshot folded from the log keeps the time of the session's last
+    # logged edit rather than the time of the recovery
+    RECOVER_SQL = '''
+        UPDATE code_sessions SET snapshot = ?, snapshot_version = ?,
+            updated_at = MAX(updated_at, COALESCE(
+                (SELECT MAX(logged_at) FROM code_session_ops WHERE session_id = ?), updated_at))
+        WHERE session_id = ?
+    '''
+
+    def __init__(self, connection_manager, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.connection_manager = connection_manager
+        self.flush_interval = flush_interval
+
+        self.pending = collections.deque()  # [(kind, params)] in submission order
+        self.condition = threading.Condition()
+        self.submitted = 0
+        self.processed = 0  # writes taken off the queue and finished with, stored or not
+        self.committed = 0
+        self.failed = 0
+        self.damaged = {}  # {session_id: error} sessions with unstored changes, until a snapshot lands
+        self.closing = False
+
+        self.init_tables()
+
+        self.writer_thread = threading.Thread(target=self._writer_loop, name="CodeSessionStore")
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+
+    def init_tables(self):
+        conn = self.connection_manager.get_connection()
+        with conn:
+            conn.execute(self.SESSIONS_TABLE)
+            conn.execute(self.OPERATIONS_TABLE)
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(code_session_ops)')]
+            if 'logged_at' not in columns:
+                # Logs from older versions have no edit times; recover() falls back to updated_at
+                conn.execute('ALTER TABLE code_session_ops ADD COLUMN logged_at DATETIME')
+        log_session_store("Code session tables ready")
+
+    # --- writes (queued, applied in order by the writer thread) --------------
+
+    def create(self, session_id, language, owner, created_at, text):
+        self._submit('create', (session_id, language, owner, created_at, text))
+
+    def append(self, session_id, version, author, operation):
+        """Log the operation that produced version"""
+        self._submit('operation', (session_id, version, author, operation.to_json()))
+
+    def snapshot(self, session_id, version, text):
+        """Store text as of version and drop the log up to it"""
+        self._submit('snapshot', (session_id, version, text))
+
+    def _submit(self, kind, params):
+        with self.condition:
+            if self.closing:
+                raise RuntimeError("Code session store is closed")
+            self.pending.append((kind, params))
+            self.submitted += 1
+            self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        """Block until every write submitted so far has been attempted; False on timeout.
+
+        Writes that could not be stored show up in needs_snapshot().
+        """
+        with self.condition:
+            target = self.submitted
+            return self.condition.wait_for(lambda: self.processed >= target, timeout)
+
+    def needs_snapshot(self, session_id):
+        """True if changes to the session failed to store since its last snapshot"""
+        with self.condition:
+            return session_id in self.damaged
+
+    def close(self):
+        """Write everything still queued and stop the writer thread"""
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        self.writer_thread.join()
+        if self.damaged:
+            log_session_store(f"{self.failed} session changes were never stored; sessions "
+                              f"{', '.join(sorted(self.damaged))} may have lost edits", "ERROR")
+
+    def _next_batch(self):
+        with self.condition:
+            while not self.pending and not self.closing:
+                self.condition.wait()
+            if not self.pending:
+                return None
+            # Let a burst of keystrokes share one commit
+            deadline = time.monotonic() + self.flush_interval
+            while not self.closing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch = list(self.pending)
+            self.pending.clear()
+            return batch
+
+    def _writer_loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        conn = self.connection_manager.get_connection()
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            try:
+                with conn:
+                    snapshotted = [self._execute(conn, kind, params) for kind, params in batch]
+            except Exception as e:
+                log_session_store(f"Failed to write {len(batch)} session changes "
+                                  f"(attempt {attempt} of {WRITE_ATTEMPTS}): {e}", "ERROR")
+                time.sleep(0.05 * attempt)
+            else:
+                self._finish(batch, snapshotted, [])
+                return
+
+        # Keep what can be stored; a single bad change should not cost the whole batch
+        stored, snapshotted, failed = [], [], []
+        for kind, params in batch:
+            try:
+                with conn:
+                    snapshotted.append(self._execute(conn, kind, params))
+                stored.append((kind, params))
+            except Exception as e:
+                failed.append((params[0], e))
+        log_session_store(f"Stored {len(stored)} of {len(batch)} session changes one by one", "ERROR")
+        self._finish(stored, snapshotted, failed)
+
+    def _finish(self, stored, snapshotted, failed):
+        with self.condition:
+            for (kind, params), repaired in zip(stored, snapshotted):
+                if repaired:
+                    self.damaged.pop(params[0], None)
+            for session_id, error in failed:
+                self.damaged[session_id] = str(error)
+                log_session_store(f"Session {session_id}: change not stored ({error}); "
+                                  f"needs a new snapshot", "ERROR")
+            self.committed += len(stored)
+            self.failed += len(failed)
+            self.processed += len(stored) + len(failed)
+            self.condition.notify_all()
+
+    def _execute(self, conn, kind, params):
+        """Apply one change; True if it was a snapshot that replaced the session's stored text"""
+        if kind == 'create':
+            conn.execute(self.CREATE_SQL, params)
+            return False
+        if kind == 'operation':
+            session_id, version, author, operation = params
+            conn.execute(self.APPEND_SQL, (session_id, version, author, json.dumps(operation)))
+            return False
+        # The snapshot and the removal of the log it covers commit together
+        session_id, version, text = params
+        updated = conn.execute(self.SNAPSHOT_SQL, (text, version, session_id)).rowcount
+        conn.execute('DELETE FROM code_session_ops WHERE session_id = ? AND version <= ?',
+                     (session_id, version))
+        return updated == 1
+
+    # --- reads ----------------------------------------------------------------
+
+    def load(self, session_id):
+        """The stored session as a dict with its text and version, or None.
+
+        Replays logged operations on top of the snapshot; replay stops at a
+        missing version or an operation that does not apply, keeping the
+        text of the last good version.
+        """
+        self.flush()
+        error = self.damaged.get(session_id)
+        if error is not None:
+            log_session_store(f"Session {session_id}: loading with changes that were not stored "
+                              f"({error})", "ERROR")
+        conn = self.connection_manager.get_connection()
+        row = conn.execute('''
+            SELECT language, owner, created_at, snapshot, snapshot_version
+            FROM code_sessions WHERE session_id = ?
+        ''', (session_id,)).fetchone()
+        if row is None:
+            return None
+        language, owner, created_at, text, version = row
+        snapshot_version = version
+
+        operations = conn.execute('''
+            SELECT version, operation FROM code_session_ops
+            WHERE session_id = ? AND version > ? ORDER BY version
+        ''', (session_id, snapshot_version))
+        for logged_version, operation in operations:
+            if logged_version != version + 1:
+                log_session_store(f"Session {session_id}: log jumps from version {version} to "
+                                  f"{logged_version}; keeping version {version}", "ERROR")
+                break
+            try:
+                text = TextOperation.from_json(json.loads(operation)).apply(text)
+            except ValueError as e:
+                log_session_store(f"Session {session_id}: version {logged_version} does not apply "
+                                  f"({e}); keeping version {version}", "ERROR")
+                break
+            version = logged_version
+
+        return {
+            'session_id': session_id,
+            'language': language,
+            'owner': owner,
+            'created_at': created_at,
+            'text': text,
+            'version': version,
+            'snapshot_version': snapshot_version
+        }
+
+    def recover(self):
+        """Fold logs left by an unclean shutdown into snapshots, then expire idle sessions.
+
+        Sessions are expired by their last edit: a recovered session keeps
+        the time of its newest logged operation. Returns (sessions recovered,
+        sessions expired).
+        """
+        self.flush()
+        conn = self.connection_manager.get_connection()
+        session_ids = [row[0] for row in conn.execute('''
+            SELECT DISTINCT session_id FROM code_session_ops
+            WHERE session_id IN (SELECT session_id FROM code_sessions)
+        ''')]
+        for session_id in session_ids:
+            session = self.load(session_id)
+            with conn:
+                conn.execute(self.RECOVER_SQL, (session['text'], session['version'], session_id, session_id))
+                # Anything past the recovered version could not be replayed
+                conn.execute('DELETE FROM code_session_ops WHERE session_id = ?', (session_id,))
+            log_session_store(f"Recovered session {session_id} at version {session['version']} "
+                              f"({session['version'] - session['snapshot_version']} operations replayed)", "RECOVER")
+
+        with conn:
+            # Logs of sessions whose row is gone
+            conn.execute('DELETE FROM code_session_ops')
+            expired = conn.execute('''
+                DELETE FROM code_sessions WHERE updated_at < datetime('now', ?)
+            ''', (f'-{RETENTION_DAYS} days',)).rowcount
+
+        total = conn.execute('SELECT COUNT(*) FROM code_sessions').fetchone()[0]
+        log_session_store(f"{total} stored code sessions, {len(session_ids)} recovered from the log, "
+                          f"{expired} expired", "RECOVER")
+        return len(session_ids), expired
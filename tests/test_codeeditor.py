@@ -0,0 +1,71 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+pytest.importorskip('tkinter')
+
+from codeeditor import CodeEditorWindow
+from codeexecutor import CodeExecutor
+from execution_scheduler import ExecutionScheduler
+
+
+class RecordingEditor(CodeEditorWindow):
+    """The editor's result handling without a window: output is collected"""
+
+    def __init__(self):
+        self.streamed = {}
+        self.current_job_id = None
+        self.shown = []
+
+    def add_output(self, text, tag="info"):
+        self.shown.append(text)
+
+    def add_execution_footer(self, result):
+        pass
+
+
+def cancelled_run_result():
+    """Start a long run, cancel it once it is running and return its result"""
+    started = threading.Event()
+    finished = threading.Event()
+    results = {}
+
+    def run_job(job):
+        results['result'] = CodeExecutor.execute_code(job.code, job.language, job=job)
+        finished.set()
+
+    scheduler = ExecutionScheduler(run_job, on_start=lambda job: started.set(), max_workers=1)
+    try:
+        job = scheduler.submit('alice', 'session', "import time\ntime.sleep(30)\n", 'python')
+        assert started.wait(10)
+        assert scheduler.cancel(job.job_id) == 'running'
+        assert finished.wait(10)
+    finally:
+        scheduler.shutdown()
+    return job.job_id, results['result']
+
+
+def test_cancelled_run_is_shown_as_cancelled():
+    job_id, result = cancelled_run_result()
+    assert result['exit_reason'] == 'cancelled'
+
+    editor = RecordingEditor()
+    editor.handle_execution_result(result, 'alice', job_id)
+    shown = ''.join(editor.shown)
+    assert "■ Execution cancelled" in shown
+    assert "failed" not in shown
+
+
+def test_cancelled_run_with_live_output_is_shown_as_cancelled():
+    job_id, result = cancelled_run_result()
+
+    editor = RecordingEditor()
+    editor.streamed[job_id] = {'stdout': 0, 'stderr': 0}
+    editor.handle_execution_result(result, 'alice', job_id)
+    shown = ''.join(editor.shown)
+    assert "■ Execution cancelled" in shown
+    assert "Execution failed" not in shown
@@ -0,0 +1,165 @@
+# update_coalescer.py - Batches code session edits into per-session ticks
+#
+# handle_code_update merges each edit into the session document straight
+# away, but no longer fans it out itself: accepted edits are queued here and
+# a single flusher thread hands each session's queue to the server once per
+# tick. Consecutive edits by other people reach a participant as one frame
+# listing their operations in order (they are not composed into one
+# operation; see ChatServer.flush_code_updates), so a fast typist costs a
+# frame per tick per participant rather than a frame per keystroke per
+# participant, though the frame still carries every keystroke's op. Acks are
+# delivered on the same tick, and since each editor keeps one edit in flight
+# until it is acked, typists also send at most about one update per tick.
+#
+# A session that has been quiet for a whole tick is flushed at once, so a
+# single keystroke is not delayed. The tick length adapts per session (see
+# tick_window): longer with more participants, slower links and backlogged
+# recipients, within MIN_TICK..MAX_TICK.
+import heapq
+import math
+import threading
+import time
+from datetime import datetime
+
+MIN_TICK = 0.016
+MAX_TICK = 0.100
+# A participant with this much output queued gets the longest tick
+BACKLOG_BYTES = 64 * 1024
+# How often the flusher logs updates received vs. frames sent
+METRICS_INTERVAL = 60.0
+
+
+def log_coalescer(message, level="INFO"):
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    print(f"[CODE_TICKS {level}] {timestamp} - {message}")
+
+
+def tick_window(participants, round_trip_times=(), backlogged=False):
+    """Seconds between broadcasts for one session.
+
+    MIN_TICK per two participants, plus half the slowest participant's round
+    trip (updates cannot reach it faster than that anyway), or MAX_TICK while
+    any participant is backlogged.
+    """
+    if backlogged:
+        return MAX_TICK
+    window = MIN_TICK * max(1, math.ceil(participants / 2))
+    known = [rtt for rtt in round_trip_times if rtt is not None]
+    if known:
+        window += max(known) / 2
+    return min(MAX_TICK, max(MIN_TICK, window))
+
+
+class UpdateCoalescer:
+    """Queues accepted edits per session and flushes each session once per tick.
+
+    flush(session_id, entries) sends one tick's entries (in the order they
+    were added) and returns the number of frames it sent. window(session_id)
+    returns the session's current tick length in seconds.
+    """
+
+    def __init__(self, flush, window):
+        self.flush = flush
+        self.window = window
+        self.condition = threading.Condition()
+        self.pending = {}     # {session_id: [entry, ...]} waiting for the next tick
+        self.due = []         # heap of (due time, session_id) for sessions in pending
+        self.next_tick = {}   # {session_id: earliest time of the next flush}
+        self.windows = {}     # {session_id: tick length measured at the last flush}
+        self.metrics = {}     # {session_id: {'updates', 'ticks', 'frames'}}
+        self.totals = {'updates': 0, 'ticks': 0, 'frames': 0}
+        self.running = True
+
+        self.thread = threading.Thread(target=self._flush_loop, name="CodeTicks")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, session_id, entry):
+        """Queue one accepted edit for the session's next tick"""
+        with self.condition:
+            self._session_metrics(session_id)['updates'] += 1
+            self.totals['updates'] += 1
+            entries = self.pending.get(session_id)
+            if entries is not None:
+                entries.append(entry)
+                return
+            self.pending[session_id] = [entry]
+            due = max(time.monotonic(), self.next_tick.get(session_id, 0.0))
+            heapq.heappush(self.due, (due, session_id))
+            self.condition.notify()
+
+    def forget(self, session_id):
+        """Drop a closed session's queue and counters"""
+        with self.condition:
+            self.pending.pop(session_id, None)
+            self.next_tick.pop(session_id, None)
+            self.windows.pop(session_id, None)
+            self.metrics.pop(session_id, None)
+
+    def _session_metrics(self, session_id):
+        metrics = self.metrics.get(session_id)
+        if metrics is None:
+            metrics = self.metrics[session_id] = {'updates': 0, 'ticks': 0, 'frames': 0}
+        return metrics
+
+    def _flush_loop(self):
+        last_report = time.monotonic()
+        reported_updates = 0
+        while True:
+            with self.condition:
+                while self.running:
+                    now = time.monotonic()
+                    if self.due and self.due[0][0] <= now:
+                        break
+                    timeout = self.due[0][0] - now if self.due else METRICS_INTERVAL
+                    self.condition.wait(min(timeout, METRICS_INTERVAL))
+                if not self.running:
+                    return
+                _, session_id = heapq.heappop(self.due)
+                entries = self.pending.pop(session_id, None)
+                if entries is None:
+                    continue  # forgotten
+                window = self.windows.get(session_id, MIN_TICK)
+                self.next_tick[session_id] = time.monotonic() + window
+
+            try:
+                frames = self.flush(session_id, entries)
+                window = self.window(session_id)
+            except Exception as e:
+                log_coalescer(f"Flushing session {session_id} failed: {e}", "ERROR")
+                frames, window = 0, MIN_TICK
+
+            with self.condition:
+                if session_id in self.next_tick:
+                    self.windows[session_id] = window
+                    metrics = self._session_metrics(session_id)
+                    metrics['ticks'] += 1
+                    metrics['frames'] += frames
+                self.totals['ticks'] += 1
+                self.totals['frames'] += frames
+
+                if time.monotonic() - last_report >= METRICS_INTERVAL and self.totals['updates'] != reported_updates:
+                    self._report()
+                    last_report = time.monotonic()
+                    reported_updates = self.totals['updates']
+
+    def _report(self):
+        """Log totals; caller holds the condition"""
+        totals = self.totals
+        log_coalescer(f"{totals['updates']} updates received, {totals['ticks']} ticks, "
+                      f"{totals['frames']} frames sent "
+                      f"({totals['frames'] / max(1, totals['updates']):.2f} frames per update)")
+
+    def stats(self):
+        with self.condition:
+            return {
+                'totals': dict(self.totals),
+                'sessions': {session_id: dict(metrics, window=self.windows.get(session_id, MIN_TICK))
+                             for session_id, metrics in self.metrics.items()}
+            }
+
+    def shutdown(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join(1)